@@ -1,11 +1,36 @@
 """FastAPI application for the chatbot."""
-from fastapi import FastAPI, Depends
+from typing import AsyncIterator
+from fastapi import FastAPI, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from contextlib import asynccontextmanager
 
+from ..common.metrics import PROMETHEUS_CONTENT_TYPE, REGISTRY
 from ..config import get_settings, Settings
 from ..chat.manager import ChatManager
-from .models import ChatRequest, ChatResponse
+from .models import ChatRequest, ChatResponse, StreamEvent, StreamFormat
+
+
+STREAM_MEDIA_TYPES = {
+    StreamFormat.SSE: "text/event-stream",
+    StreamFormat.NDJSON: "application/x-ndjson",
+}
+
+
+def encode_stream_event(event: StreamEvent, stream_format: StreamFormat) -> str:
+    """Serialize a stream event for the requested wire format.
+    
+    Args:
+        event: Event to serialize.
+        stream_format: Target wire format.
+        
+    Returns:
+        Encoded event, including its trailing delimiter.
+    """
+    payload = event.model_dump_json()
+    if stream_format == StreamFormat.NDJSON:
+        return f"{payload}\n"
+    return f"event: {event.type}\ndata: {payload}\n\n"
 
 
 @asynccontextmanager
@@ -17,8 +42,8 @@ async def lifespan(app: FastAPI):
     
     yield
     
-    # Shutdown: close resources
-    app.state.chat_manager.close()
+    # Shutdown: drain buffered history writes and close resources
+    await app.state.chat_manager.aclose()
 
 
 def create_app() -> FastAPI:
@@ -68,6 +93,56 @@ def create_app() -> FastAPI:
             conversation_id=conversation_id
         )
     
+    @app.post("/chat/stream")
+    async def chat_stream(
+        request: ChatRequest,
+        http_request: Request,
+        stream_format: StreamFormat = Query(default=StreamFormat.SSE, alias="format")
+    ):
+        """Stream the AI response to a chat message.
+        
+        Args:
+            request: Chat request containing user message and conversation ID.
+            http_request: Raw HTTP request, used to detect client disconnects.
+            stream_format: Wire format of the stream, SSE or NDJSON.
+            
+        Returns:
+            Streaming response emitting chunk events followed by an end event.
+        """
+        conversation_id = request.conversation_id or "default"
+        stream = app.state.chat_manager.stream_message(
+            user_input=request.input,
+            conversation_id=conversation_id
+        )
+        
+        async def event_stream() -> AsyncIterator[str]:
+            try:
+                async for chunk in stream:
+                    if await http_request.is_disconnected():
+                        # Stop generating; the partial turn is not persisted
+                        return
+                    yield encode_stream_event(
+                        StreamEvent(type="chunk", content=chunk, conversation_id=conversation_id),
+                        stream_format
+                    )
+                yield encode_stream_event(
+                    StreamEvent(type="end", conversation_id=conversation_id),
+                    stream_format
+                )
+            except Exception as e:
+                yield encode_stream_event(
+                    StreamEvent(type="error", content=str(e), conversation_id=conversation_id),
+                    stream_format
+                )
+            finally:
+                await stream.aclose()
+        
+        return StreamingResponse(
+            event_stream(),
+            media_type=STREAM_MEDIA_TYPES[stream_format],
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    
     @app.post("/clear/{conversation_id}")
     async def clear_history(conversation_id: str):
         """Clear the conversation history.
@@ -78,7 +153,7 @@ def create_app() -> FastAPI:
         Returns:
             Status message.
         """
-        app.state.chat_manager.clear_history(conversation_id)
+        await app.state.chat_manager.clear_history(conversation_id)
         return {
             "status": "success",
             "message": f"History for conversation {conversation_id} cleared"
@@ -93,4 +168,14 @@ def create_app() -> FastAPI:
         """
         return {"status": "healthy"}
     
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics():
+        """Prometheus metrics endpoint.
+        
+        Returns:
+            Stage latencies, requests in flight and background queue sizes,
+            in the Prometheus text format.
+        """
+        return PlainTextResponse(REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+    
     return app 
\ No newline at end of file
@@ -1,4 +1,5 @@
 """API models for chatbot requests and responses."""
+from enum import Enum
 from typing import Optional
 from pydantic import BaseModel, Field
 
@@ -14,4 +15,19 @@ class ChatResponse(BaseModel):
     """Chat response model."""
     
     output: str = Field(..., description="AI response")
-    conversation_id: str = Field(..., description="Conversation ID") 
\ No newline at end of file
+    conversation_id: str = Field(..., description="Conversation ID") 
+
+
+class StreamFormat(str, Enum):
+    """Wire formats supported by the streaming chat endpoint."""
+    
+    SSE = "sse"
+    NDJSON = "ndjson"
+
+
+class StreamEvent(BaseModel):
+    """A single event emitted by the streaming chat endpoint."""
+    
+    type: str = Field(..., description="Event type: chunk, end or error")
+    content: str = Field(default="", description="Response chunk or error message")
+    conversation_id: str = Field(..., description="Conversation ID")
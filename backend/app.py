@@ -1,7 +1,8 @@
 import os
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from dotenv import load_dotenv
 from langserve import add_routes
 from operator import itemgetter
@@ -10,7 +11,10 @@ from langchain_core.runnables import RunnableLambda
 from bot import Bot
 from models import ModelTypes
 from memory import MemoryTypes
+from common.metrics import PROMETHEUS_CONTENT_TYPE, REGISTRY
 from common.objects import ChatRequest
+from common.tracing import get_trace_sampler
+from utils import AdmissionRejected
 
 # Load environment variables
 load_dotenv()
@@ -35,13 +39,18 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# Shed load with 503 instead of queueing LLM calls without bound
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
 # Add LangServe routes for the chat endpoint
 add_routes(
     app,
     {
         "sentence": itemgetter("input"),
         "conversation_id": itemgetter("conversation_id")
-    } | RunnableLambda(bot.call),
+    } | RunnableLambda(bot.call, afunc=bot.acall),
     path="/chat",
     input_type=ChatRequest
 )
@@ -51,6 +60,26 @@ add_routes(
 async def health_check():
     return {"status": "healthy"}
 
+# Add admission queue and micro-batching metrics endpoint
+@app.get("/stats")
+async def stats():
+    stats = {"admission": bot.admission.stats()}
+    if bot.chain.batcher is not None:
+        stats["micro_batching"] = bot.chain.batcher.stats()
+    if hasattr(bot.cache, "stats"):
+        stats["cache"] = bot.cache.stats()
+    if bot.anonymizer is not None:
+        stats["anonymizer"] = bot.anonymizer.stats()
+    sampler = get_trace_sampler(bot.config)
+    if sampler is not None:
+        stats["tracing"] = sampler.stats()
+    return stats
+
+# Add Prometheus endpoint with per-stage latencies, queue depths and cache sizes
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
 # Add clear history endpoint
 @app.post("/clear/{conversation_id}")
 async def clear_history(conversation_id: str):
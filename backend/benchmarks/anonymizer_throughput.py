@@ -0,0 +1,118 @@
+"""
+Compare anonymization throughput in the serving process with the worker pool used when ANONYMIZER_WORKERS > 0.
+In-process calls share one GIL, so threads cannot use more than one core, while the pool scales with workers.
+
+Usage (from the backend directory):
+    python -m benchmarks.anonymizer_throughput                      # Presidio, needs the spaCy models
+    python -m benchmarks.anonymizer_throughput --synthetic --json   # CPU-bound stand-in, no models needed
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from utils.process_pool import ShardedProcessPool, worker_resource
+
+MESSAGES = [
+    "Hi, my name is John Smith and my SSN is 123-45-6789, can you check my account?",
+    "I lost my passport 912803456 last week in Hanoi, what should I do?",
+    "Tôi tên là Nguyễn Văn A, số điện thoại của tôi là 0912345678.",
+    "What's the weather like today? I'm driving with license D1234567 to Boston.",
+]
+
+_DIGITS = re.compile(r"\d")
+
+
+class SyntheticAnonymizer:
+    """Pure-Python CPU-bound stand-in for Presidio, masking digits after a fixed amount of work"""
+
+    def __init__(self, work: int = 20000):
+        self.work = work
+
+    def anonymize(self, text: str, language: str) -> str:
+        checksum = 0
+        for i in range(self.work):
+            checksum = (checksum * 31 + i) % 1000003
+        return _DIGITS.sub("#", text)
+
+
+def _build_presidio():
+    from utils.anonymizer import build_presidio_anonymizer
+    return build_presidio_anonymizer()
+
+
+def _anonymize(texts: List[str], language: str) -> List[str]:
+    anonymizer = worker_resource()
+    return [anonymizer.anonymize(text, language) for text in texts]
+
+
+def run_in_process(factory, messages: List[str], threads: int) -> float:
+    anonymizer = factory()
+    anonymizer.anonymize(messages[0], "en")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda message: anonymizer.anonymize(message, "en"), messages))
+    return time.perf_counter() - start
+
+
+def run_in_pool(factory, messages: List[str], workers: int) -> float:
+    pool = ShardedProcessPool(num_workers=workers, factory=factory, max_pending=len(messages), timeout=None)
+    try:
+        # Wait for every worker to load its models before timing
+        for i in range(workers * 4):
+            pool.call(f"warm-up-{i}", _anonymize, [messages[0]], "en")
+
+        async def run():
+            await asyncio.gather(*[
+                pool.acall(f"conversation-{i}", _anonymize, [message], "en") for i, message in enumerate(messages)
+            ])
+
+        start = time.perf_counter()
+        asyncio.run(run())
+        return time.perf_counter() - start
+    finally:
+        pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=400)
+    parser.add_argument("--workers", type=int, nargs="*", help="Pool sizes to measure, defaults to 1, 2, 4... cores")
+    parser.add_argument("--synthetic", action="store_true", help="Use a CPU-bound stand-in instead of Presidio")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    factory = SyntheticAnonymizer if args.synthetic else _build_presidio
+    messages = [MESSAGES[i % len(MESSAGES)] for i in range(args.messages)]
+    cores = os.cpu_count() or 1
+    worker_counts = args.workers or sorted({2 ** i for i in range(cores.bit_length()) if 2 ** i <= cores} | {cores})
+
+    results = []
+    elapsed = run_in_process(factory, messages, threads=cores)
+    results.append({"mode": "in_process", "workers": cores, "seconds": elapsed,
+                    "messages_per_second": len(messages) / elapsed})
+    for workers in worker_counts:
+        elapsed = run_in_pool(factory, messages, workers)
+        results.append({"mode": "pool", "workers": workers, "seconds": elapsed,
+                        "messages_per_second": len(messages) / elapsed})
+
+    baseline = results[0]["messages_per_second"]
+    for result in results:
+        result["speedup"] = result["messages_per_second"] / baseline
+
+    if args.json:
+        print(json.dumps({"cores": cores, "messages": len(messages), "results": results}, indent=2))
+    else:
+        print(f"{len(messages)} messages, {cores} cores")
+        for result in results:
+            label = "threads" if result["mode"] == "in_process" else "workers"
+            print(f"  {result['mode']:<10} {result['workers']:>3} {label:<8} "
+                  f"{result['messages_per_second']:9.1f} msg/s  x{result['speedup']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
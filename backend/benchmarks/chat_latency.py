@@ -0,0 +1,304 @@
+"""
+Offline latency benchmarks of the chat hot paths, for conversations of 1 to 1,000 turns:
+    memory        BaseCustomMongoChatbotMemory.load_history and add_message
+    chat_manager  ChatManager.process_message, as served by the API
+    bot           Bot.predict, the LangChain agent
+LLM calls go to a deterministic fake chat model with a configurable latency and token rate, and MongoDB is replaced
+by mongomock, so no account or server is needed. Each case reports p50/p95/p99 latency, throughput and memory
+allocations, and the results can be saved as JSON and compared with a baseline.
+
+Usage (from the backend directory, needs mongomock):
+    python -m benchmarks.chat_latency                                         # every scenario
+    python -m benchmarks.chat_latency memory --lengths 1 100 1000 --json      # one scenario, JSON on stdout
+    python -m benchmarks.chat_latency --output current.json --compare baseline.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Awaitable, Callable, Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("memory", "chat_manager", "bot")
+DEFAULT_LENGTHS = (1, 10, 100, 1000)
+
+# Local ReAct prompt with the variables the Bot fills in, so that no hub prompt is needed
+BENCH_PROMPT = """{bot_personality}
+{user_personality}
+You can use these tools:
+{tools}
+Use the format "Action: <one of [{tool_names}]>" or "Final Answer: <answer>".
+
+Previous conversation:
+{history}
+
+Question: {input}
+{agent_scratchpad}"""
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Latency statistics in milliseconds"""
+    ordered = sorted(samples)
+
+    def at(fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": at(0.50),
+        "p95_ms": at(0.95),
+        "p99_ms": at(0.99),
+        "max_ms": ordered[-1] * 1000
+    }
+
+
+def run_sync(call: Callable[[int], object], requests: int, alloc_requests: int) -> Dict[str, float]:
+    """Time `requests` sequential calls, then trace the allocations of `alloc_requests` more"""
+    latencies = []
+    start = time.perf_counter()
+    for i in range(requests):
+        begin = time.perf_counter()
+        call(i)
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - start
+    # Tracing slows allocations down, so it is kept out of the timed calls
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    for i in range(requests, requests + alloc_requests):
+        call(i)
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        **percentiles(latencies),
+        "throughput_per_s": requests / elapsed,
+        "alloc_peak_kib": (peak - before) / 1024,
+        "alloc_retained_kib_per_call": (after - before) / 1024 / max(alloc_requests, 1)
+    }
+
+
+async def run_async(
+        call: Callable[[int], Awaitable[object]],
+        requests: int,
+        concurrency: int,
+        alloc_requests: int
+) -> Dict[str, float]:
+    """Time `requests` calls issued by `concurrency` concurrent clients, then trace the allocations of a few more"""
+    latencies = []
+    counter = iter(range(requests))
+
+    async def client():
+        for i in counter:
+            begin = time.perf_counter()
+            await call(i)
+            latencies.append(time.perf_counter() - begin)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    await asyncio.gather(*[call(i) for i in range(requests, requests + alloc_requests)])
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        **percentiles(latencies),
+        "throughput_per_s": requests / elapsed,
+        "alloc_peak_kib": (peak - before) / 1024,
+        "alloc_retained_kib_per_call": (after - before) / 1024 / max(alloc_requests, 1)
+    }
+
+
+def make_turn(i: int, conversation_id: str):
+    from common.objects import Message, MessageTurn
+
+    return MessageTurn(
+        human_message=Message(message=f"Question {i}: what did we say about topic {i % 17}?", role="Human"),
+        ai_message=Message(message=f"Answer {i}: topic {i % 17} was covered a while ago, here is a recap.", role="AI"),
+        conversation_id=conversation_id
+    )
+
+
+def bench_memory(args) -> List[dict]:
+    from benchmarks.fakes import in_memory_mongo_client
+    from memory.custom_memory import BaseCustomMongoChatbotMemory
+
+    memory = BaseCustomMongoChatbotMemory(
+        client=in_memory_mongo_client(),
+        session_id="benchmark",
+        database_name="benchmark",
+        collection_name="turns",
+        k=args.window
+    )
+    results = []
+    for length in args.lengths:
+        conversation_id = f"memory-{length}"
+        memory.collection.insert_many([
+            {"ConversationId": conversation_id, "SessionId": "benchmark", "History": make_turn(i, conversation_id).dict()}
+            for i in range(length)
+        ])
+        stats = run_sync(lambda i: memory.load_history(conversation_id), args.requests, args.alloc_requests)
+        results.append({"scenario": "memory.load_history", "turns": length, **stats})
+        stats = run_sync(lambda i: memory.add_message(make_turn(length + i, conversation_id)),
+                         args.requests, args.alloc_requests)
+        results.append({"scenario": "memory.add_message", "turns": length, **stats})
+    return results
+
+
+def bench_chat_manager(args) -> List[dict]:
+    # The API is the `backend` package, importable from the parent directory
+    sys.path.insert(0, os.path.dirname(BACKEND_DIR))
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    from backend.chat.manager import ChatManager
+    from backend.database.mongodb import AsyncMongodbClient, MongodbClient
+    from benchmarks.fakes import FakeChatModel, in_memory_mongo_client
+
+    async def run_length(length: int) -> dict:
+        manager = ChatManager(db=AsyncMongodbClient(client=in_memory_mongo_client()))
+        model = FakeChatModel(latency=args.llm_latency, tokens_per_second=args.tokens_per_second)
+        manager.model = model
+        manager.chain = manager.template | model | manager.output_parser
+        if manager.batcher is not None:
+            manager.batcher.runnable = manager.chain
+        conversation_ids = [f"chat-{length}-{client}" for client in range(args.concurrency)]
+        manager.db.sync_client.add_conversation_messages({
+            conversation_id: [
+                MongodbClient.build_message(turn.human_message.message, turn.ai_message.message)
+                for turn in (make_turn(i, conversation_id) for i in range(length))
+            ]
+            for conversation_id in conversation_ids
+        })
+        try:
+            stats = await run_async(
+                lambda i: manager.process_message(f"Question {i}?", conversation_ids[i % len(conversation_ids)]),
+                args.requests, args.concurrency, args.alloc_requests
+            )
+        finally:
+            await manager.aclose()
+        return {"scenario": "chat_manager.process_message", "turns": length, **stats}
+
+    return [asyncio.run(run_length(length)) for length in args.lengths]
+
+
+def bench_bot(args) -> List[dict]:
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ["LANGCHAIN_TRACING_V2"] = "false"
+    from benchmarks.fakes import FakeChatModel, in_memory_mongo_client
+    from bot import Bot
+    from common.config import Config
+    from memory import MemoryTypes
+    from models import ModelTypes
+
+    memory_type = MemoryTypes(args.bot_memory)
+    memory_kwargs = {"client": in_memory_mongo_client(), "k": args.window} \
+        if memory_type in (MemoryTypes.CUSTOM_MEMORY, MemoryTypes.RETRIEVAL_MEMORY) else None
+    # Config is a process singleton, possibly created by another scenario already
+    config = Config()
+    config.memory_window_size = args.window
+    bot = Bot(
+        config=config,
+        prompt_template=BENCH_PROMPT,
+        memory=memory_type,
+        model=ModelTypes.OPENAI,
+        memory_kwargs=memory_kwargs,
+        model_kwargs={"model_name": "benchmark", "openai_api_key": "benchmark"},
+        tools=[]
+    )
+    # Swap the model for the fake one and rebuild the chain and the agent on top of it
+    bot.chain._base_model = FakeChatModel(
+        latency=args.llm_latency, tokens_per_second=args.tokens_per_second, react=True
+    )
+    bot.chain._init_chain()
+    bot.start()
+    # The agent's step-by-step printing would be timed too
+    bot.brain.verbose = False
+
+    results = []
+    for length in args.lengths:
+        conversation_id = f"bot-{length}"
+        for i in range(length):
+            bot.memory.add_message(make_turn(i, conversation_id))
+        stats = run_sync(lambda i: bot.predict(f"Question {i}?", conversation_id=conversation_id),
+                         args.requests, args.alloc_requests)
+        results.append({"scenario": "bot.predict", "turns": length, "memory": memory_type.value, **stats})
+    return results
+
+
+BENCHMARKS = {
+    "memory": bench_memory,
+    "chat_manager": bench_chat_manager,
+    "bot": bench_bot
+}
+
+
+def compare(results: List[dict], baseline_path: str, tolerance: float) -> List[str]:
+    """Return the cases whose p95 latency grew by more than `tolerance` over the baseline"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(result["scenario"], result["turns"]): result for result in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        reference = baseline.get((result["scenario"], result["turns"]))
+        if reference is None:
+            continue
+        result["baseline_p95_ms"] = reference["p95_ms"]
+        if result["p95_ms"] > reference["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{result['scenario']} at {result['turns']} turns: p95 {result['p95_ms']:.2f}ms, "
+                               f"baseline {reference['p95_ms']:.2f}ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run among {', '.join(SCENARIOS)}, defaults to all")
+    parser.add_argument("--lengths", type=int, nargs="+", default=list(DEFAULT_LENGTHS),
+                        help="Conversation lengths, in turns")
+    parser.add_argument("--requests", type=int, default=50, help="Timed calls per case")
+    parser.add_argument("--alloc-requests", type=int, default=5, help="Calls traced for allocations per case")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients of the ChatManager")
+    parser.add_argument("--window", type=int, default=5, help="History window, in turns")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds before the fake model's first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200, help="Token rate of the fake model")
+    parser.add_argument("--bot-memory", default="base-memory", help="Memory type of the bot scenario")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Baseline JSON file, exit with status 1 on a p95 regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative p95 growth over the baseline")
+    args = parser.parse_args()
+    unknown = sorted(set(args.scenarios) - set(SCENARIOS))
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    results = []
+    for scenario in args.scenarios or SCENARIOS:
+        results.extend(BENCHMARKS[scenario](args))
+    regressions = compare(results, args.compare, args.tolerance) if args.compare else []
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("json", "output", "compare")},
+        "results": results,
+        "regressions": regressions
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for result in results:
+            print(f"{result['scenario']:<30} {result['turns']:>5} turns  p50 {result['p50_ms']:8.2f}ms  "
+                  f"p95 {result['p95_ms']:8.2f}ms  p99 {result['p99_ms']:8.2f}ms  "
+                  f"{result['throughput_per_s']:8.1f}/s  {result['alloc_peak_kib']:8.1f} KiB peak")
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Offline stand-ins for the services the chat hot paths depend on: a deterministic chat model with a configurable
+latency and token rate, and an in-memory MongoDB.
+"""
+import asyncio
+import time
+import zlib
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+WORDS = ("the", "answer", "depends", "on", "what", "you", "asked", "before", "so", "here", "is", "a", "short", "reply")
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic chat model: the reply is derived from a hash of the prompt, and is produced after `latency`
+    seconds plus one `1 / tokens_per_second` delay per token, token by token when streamed.
+    """
+
+    latency: float = 0.05
+    tokens_per_second: float = 100.0
+    reply_tokens: int = 20
+    # Reply in the ReAct format expected by the Bot's agent
+    react: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"latency": self.latency, "tokens_per_second": self.tokens_per_second, "reply_tokens": self.reply_tokens}
+
+    def _tokens(self, messages: List[BaseMessage]) -> List[str]:
+        seed = zlib.crc32("".join(str(message.content) for message in messages).encode("utf-8"))
+        tokens = [f"{WORDS[(seed + i) % len(WORDS)]} " for i in range(self.reply_tokens)]
+        return ["Final Answer: "] + tokens if self.react else tokens
+
+    def _token_delay(self) -> float:
+        return 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _generate(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[CallbackManagerForLLMRun] = None,
+            **kwargs: Any
+    ) -> ChatResult:
+        tokens = self._tokens(messages)
+        time.sleep(self.latency + len(tokens) * self._token_delay())
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens).strip()))])
+
+    async def _agenerate(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+            **kwargs: Any
+    ) -> ChatResult:
+        tokens = self._tokens(messages)
+        await asyncio.sleep(self.latency + len(tokens) * self._token_delay())
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens).strip()))])
+
+    def _stream(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[CallbackManagerForLLMRun] = None,
+            **kwargs: Any
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        for token in self._tokens(messages):
+            time.sleep(self._token_delay())
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+            **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        for token in self._tokens(messages):
+            await asyncio.sleep(self._token_delay())
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+def in_memory_mongo_client():
+    """Return an in-memory MongoDB client"""
+    try:
+        import mongomock
+    except ImportError as e:
+        raise ImportError("The benchmarks need mongomock for an in-memory MongoDB, `pip install mongomock`") from e
+    return mongomock.MongoClient()
@@ -0,0 +1,104 @@
+"""
+Measure the import time of the backend entry modules with `python -X importtime` and check it against
+the budgets in import_budget.json: a maximum cumulative import time, and optional dependencies that must
+not be imported at all. Exits with a non-zero status when a budget is exceeded.
+
+Usage (from the backend directory):
+    python -m benchmarks.import_time                 # every module of the budget file
+    python -m benchmarks.import_time bot --top 20    # one module, with its 20 slowest imports
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "import_budget.json")
+
+
+def measure(module: str) -> Dict[str, Tuple[int, int]]:
+    """Import `module` in a fresh interpreter, return {imported module: (self us, cumulative us)}"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    # Nested imports are listed, indented, before the top-level import they belong to
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+        if name.strip() == name[1:]:
+            if name.strip() == module:
+                return timings
+            # Interpreter startup (site, sitecustomize) is not part of the measured import
+            timings = {}
+    return timings
+
+
+def report(module: str, budget: dict, repeat: int, top: int) -> Tuple[dict, List[str]]:
+    # The fastest run is the least disturbed by the machine's noise
+    runs = [measure(module) for _ in range(repeat)]
+    timings = min(runs, key=lambda run: run.get(module, (0, 0))[1])
+    total = timings.get(module, (0, 0))[1] / 1e6
+    loaded = {name.split(".")[0] for name in timings}
+    forbidden = sorted(name for name in budget.get("forbidden", []) if name in loaded)
+
+    violations = []
+    max_seconds = budget.get("max_seconds")
+    if max_seconds is not None and total > max_seconds:
+        violations.append(f"{module}: import took {total:.3f}s, budget is {max_seconds:.3f}s")
+    for name in forbidden:
+        violations.append(f"{module}: imports {name}, which must stay lazy")
+
+    slowest = sorted(timings.items(), key=lambda item: item[1][1], reverse=True)[:top]
+    return {
+        "module": module,
+        "seconds": total,
+        "max_seconds": max_seconds,
+        "modules_imported": len(timings),
+        "forbidden_imported": forbidden,
+        "slowest": [{"module": name, "self_us": s, "cumulative_us": c} for name, (s, c) in slowest]
+    }, violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", help="Modules to measure, defaults to every module of the budget file")
+    parser.add_argument("--budget", default=BUDGET_FILE)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    with open(args.budget, "r", encoding="utf-8") as f:
+        budgets = json.load(f)
+
+    reports, violations = [], []
+    for module in args.modules or list(budgets):
+        module_report, module_violations = report(module, budgets.get(module, {}), args.repeat, args.top)
+        reports.append(module_report)
+        violations.extend(module_violations)
+
+    if args.json:
+        print(json.dumps({"reports": reports, "violations": violations}, indent=2))
+    else:
+        for module_report in reports:
+            budget = module_report["max_seconds"]
+            print(f"{module_report['module']}: {module_report['seconds']:.3f}s"
+                  f"{f' (budget {budget:.3f}s)' if budget is not None else ''}, "
+                  f"{module_report['modules_imported']} modules")
+            for item in module_report["slowest"]:
+                print(f"  {item['cumulative_us'] / 1e3:9.1f} ms  {item['module']}")
+        for violation in violations:
+            print(f"FAIL {violation}")
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,35 @@
 import asyncio
-from queue import Queue
 from typing import Optional, Dict, Union, List
 from operator import itemgetter
 
-from langchain_core.agents import AgentExecutor
+from langchain.agents import AgentExecutor
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables import RunnableLambda, RunnableMap
+from langchain_core.prompts import BasePromptTemplate, ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableLambda, RunnableMap, RunnablePassthrough
 from langchain.agents.format_scratchpad import format_log_to_str
 from langchain.agents.output_parsers import ReActSingleInputOutputParser
-from langchain_community.callbacks.tracers.langchain import wait_for_all_tracers
 from langchain_community.callbacks.streaming_stdout_final_only import FinalStreamingStdOutCallbackHandler
 
 from memory import MemoryTypes, MEM_TO_CLASS
 from models import ModelTypes
 from common.config import Config, BaseObject
+from common.metrics import REGISTRY
 from common.objects import Message, MessageTurn
+from common.stage_metrics import StageMetricsHandler, stage_histogram
+from common.summary import BackgroundSummarizer, llm_summarize
+from common.tokens import history_token_budget
+from common.tracing import trace_callbacks
 from common.constants import *
 from chain import ChainManager
 from prompt import BOT_PERSONALITY
-from utils import BotAnonymizer, CacheTypes, ChatbotCache
-from tools import CustomSearchTool
+from utils import AdmissionController, BoundedLLMCache, CacheTypes, ChatbotCache
 
 
 class Bot(BaseObject):
     def __init__(
             self,
             config: Config = None,
-            prompt_template: str = PERSONAL_CHAT_PROMPT_REACT,
+            prompt_template: Union[str, BasePromptTemplate] = PERSONAL_CHAT_PROMPT_REACT,
             memory: Optional[MemoryTypes] = None,
             cache: Optional[CacheTypes] = None,
             model: Optional[ModelTypes] = None,
@@ -38,48 +40,71 @@ class Bot(BaseObject):
     ):
         super().__init__()
         self.config = config if config is not None else Config()
-        self.tools = tools or [CustomSearchTool()]
+        if tools is None:
+            # Imported here so that bots without the default tool never load its API client
+            from tools import CustomSearchTool
+
+            tools = [CustomSearchTool()]
+        self.tools = tools
         partial_variables = {
             "bot_personality": bot_personality or BOT_PERSONALITY,
             "user_personality": "",
             "tools": "\n".join([f"{tool.name}: {tool.description}" for tool in self.tools]),
             "tool_names": ", ".join([tool.name for tool in self.tools])
         }
+        if cache == CacheTypes.GPTCache and model != ModelTypes.OPENAI:
+            self.logger.warning(f"GPTCache only supports OpenAI models, using the semantic cache for {model}")
+            cache = CacheTypes.semantic
+        self._cache = ChatbotCache.create(cache_type=cache, config=self.config)
         self.chain = ChainManager(
             config=self.config,
             prompt_template=prompt_template,
             model=model,
             model_kwargs=model_kwargs if model_kwargs else self.get_model_kwargs(model=model),
-            partial_variables=partial_variables
+            partial_variables=partial_variables,
+            semantic_cache=self._cache if cache == CacheTypes.semantic else None,
+            llm_cache=self._cache if isinstance(self._cache, BoundedLLMCache) else None
         )
-        self.input_queue = Queue(maxsize=6)
-        self._memory = self.get_memory(memory_type=memory, parameters=memory_kwargs)
-        if cache == CacheTypes.GPTCache and model != ModelTypes.OPENAI:
-            cache = None
-        self._cache = ChatbotCache.create(cache_type=cache)
-        self.anonymizer = BotAnonymizer(config=self.config)
+        self.admission = AdmissionController(
+            max_concurrency=self.config.max_concurrent_requests,
+            max_queue_size=self.config.max_queued_requests,
+            queue_timeout=self.config.queue_timeout
+        )
+        self._memory = self.get_memory(memory_type=memory, parameters=self.get_memory_kwargs(model, memory_kwargs))
+        self.anonymizer = None
+        if self.config.enable_anonymizer:
+            # Loads Presidio and its spaCy models, only done when anonymization is enabled
+            from utils import BotAnonymizer
+
+            self.anonymizer = BotAnonymizer(config=self.config)
         self.brain = None
+        self.stage_metrics = StageMetricsHandler()
         self.start()
+        self._register_gauges()
 
     @property
     def memory(self):
         return self._memory
 
+    @property
+    def cache(self):
+        return self._cache
+
     def start(self):
         history_loader = RunnableMap({
             "input": itemgetter("input"),
+            "conversation_id": itemgetter("conversation_id"),
             "agent_scratchpad": itemgetter("intermediate_steps") | RunnableLambda(format_log_to_str),
-            "history": itemgetter("conversation_id") | RunnableLambda(self.memory.load_history)
+            "history": self._history_loader()
         }).with_config(run_name="LoadHistory")
 
         if self.config.enable_anonymizer:
             anonymizer_runnable = self.anonymizer.get_runnable_anonymizer().with_config(run_name="AnonymizeSentence")
-            de_anonymizer = RunnableLambda(self.anonymizer.anonymizer.deanonymize).with_config(
-                run_name="DeAnonymizeResponse")
+            de_anonymizer = self.anonymizer.get_runnable_deanonymizer().with_config(run_name="DeAnonymizeResponse")
 
+            # The conversation id is kept next to the output, responses are de-anonymized with its own mapping
             agent = (history_loader
-                     | anonymizer_runnable
-                     | self.chain.chain
+                     | RunnablePassthrough.assign(output=anonymizer_runnable | self.chain.chain)
                      | de_anonymizer
                      | ReActSingleInputOutputParser())
 
@@ -94,6 +119,38 @@ class Bot(BaseObject):
             handle_parsing_errors=True
         )
 
+    def _register_gauges(self):
+        # Read at scrape time, from whichever component keeps the counts
+        if hasattr(self.cache, "stats"):
+            cache = "llm" if isinstance(self.cache, BoundedLLMCache) else "semantic"
+            REGISTRY.gauge("chatbot_cache_entries", "Entries held by a cache", labels={"cache": cache},
+                           function=lambda: self.cache.stats()["entries"])
+            if cache == "llm":
+                REGISTRY.gauge("chatbot_cache_bytes", "Estimated size of the entries held by a cache",
+                               labels={"cache": cache}, function=lambda: self.cache.stats()["bytes"])
+        if hasattr(self.memory, "stats"):
+            REGISTRY.gauge("chatbot_cache_entries", "Entries held by a cache", labels={"cache": "memory"},
+                           function=lambda: self.memory.stats["entries"])
+            REGISTRY.gauge("chatbot_cache_bytes", "Estimated size of the entries held by a cache",
+                           labels={"cache": "memory"}, function=lambda: self.memory.stats["bytes"])
+        if self.anonymizer is not None:
+            REGISTRY.gauge("chatbot_cache_entries", "Entries held by a cache", labels={"cache": "anonymizer"},
+                           function=lambda: self.anonymizer.stats()["conversations"])
+
+    def _history_loader(self):
+        if not getattr(self.memory, "retrieves_by_input", False):
+            return itemgetter("conversation_id") | RunnableLambda(self.memory.load_history,
+                                                                  afunc=self.memory.aload_history)
+
+        # Retrieval memories also look up the turns relevant to the input
+        def load_history(inputs: dict):
+            return self.memory.load_history(inputs["conversation_id"], query=inputs["input"])
+
+        async def aload_history(inputs: dict):
+            return await self.memory.aload_history(inputs["conversation_id"], query=inputs["input"])
+
+        return RunnableLambda(load_history, afunc=aload_history)
+
     def get_memory(
             self,
             parameters: dict = None,
@@ -116,6 +173,20 @@ class Bot(BaseObject):
             )
         return memory_class(config=self.config, **parameters)
 
+    def get_memory_kwargs(self, model: Optional[ModelTypes], memory_kwargs: Optional[dict] = None):
+        memory_kwargs = dict(memory_kwargs or {})
+        if self.config.memory_window_mode == "tokens":
+            memory_kwargs.setdefault("token_budget", history_token_budget(model, self.config.history_token_budget))
+        elif self.config.memory_window_mode != "turns":
+            raise ValueError(
+                f"Got unknown memory window mode: {self.config.memory_window_mode}. "
+                f"Valid modes are: turns, tokens."
+            )
+        if self.config.memory_summary_threshold is not None and "summarizer" not in memory_kwargs:
+            # Summaries are written by the bot's own model, in a background thread
+            memory_kwargs["summarizer"] = BackgroundSummarizer(llm_summarize(self.chain.base_model))
+        return memory_kwargs
+
     def get_model_kwargs(self, model: Optional[ModelTypes]):
         if model and model == ModelTypes.OPENAI:
             return self.openai_model_kwargs
@@ -150,45 +221,63 @@ class Bot(BaseObject):
     def reset_history(self, conversation_id: str = None):
         self.memory.clear(conversation_id=conversation_id)
 
-    def add_message_to_memory(
+    def _build_turn(
             self,
             human_message: Union[Message, str],
             ai_message: Union[Message, str],
             conversation_id: str
-    ):
+    ) -> MessageTurn:
         if isinstance(human_message, str):
             human_message = Message(message=human_message, role=self.config.human_prefix)
         if isinstance(ai_message, str):
             ai_message = Message(message=ai_message, role=self.config.ai_prefix)
 
-        turn = MessageTurn(
+        return MessageTurn(
             human_message=human_message,
             ai_message=ai_message,
             conversation_id=conversation_id
         )
-        self.memory.add_message(turn)
+
+    def add_message_to_memory(
+            self,
+            human_message: Union[Message, str],
+            ai_message: Union[Message, str],
+            conversation_id: str
+    ):
+        with stage_histogram("persistence").time():
+            self.memory.add_message(self._build_turn(human_message, ai_message, conversation_id))
+
+    async def aadd_message_to_memory(
+            self,
+            human_message: Union[Message, str],
+            ai_message: Union[Message, str],
+            conversation_id: str
+    ):
+        with stage_histogram("persistence").time():
+            await self.memory.aadd_message(self._build_turn(human_message, ai_message, conversation_id))
 
     async def __call__(self, message: Message, conversation_id: str):
+        # Sampled traces are uploaded in the background, see `common.tracing`
+        callbacks = [self.stage_metrics, *trace_callbacks(self.config)]
         try:
-            try:
-                output = self.brain.invoke({"input": message.message, "conversation_id": conversation_id})['output']
-            except ValueError as e:
-                import regex as re
-                response = str(e)
-                # Try to extract the actual response from error messages
-                response = re.findall(r".*?Could not parse LLM output: `(.*)`", response)
+            output = (await self.brain.ainvoke(
+                {"input": message.message, "conversation_id": conversation_id},
+                config={"callbacks": callbacks}
+            ))['output']
+        except ValueError as e:
+            import regex as re
+            response = str(e)
+            # Try to extract the actual response from error messages
+            response = re.findall(r".*?Could not parse LLM output: `(.*)`", response)
+            if not response:
+                # Try another common error pattern
+                response = re.findall(r".*?Error in parsing LLM output: `(.*)`", response)
                 if not response:
-                    # Try another common error pattern
-                    response = re.findall(r".*?Error in parsing LLM output: `(.*)`", response)
-                    if not response:
-                        raise e
-                output = response[0]
-
-            output = Message(message=output, role=self.config.ai_prefix)
-            return output
-        finally:
-            # Wait for invoke chain finish before push to Langsmith
-            wait_for_all_tracers()
+                    raise e
+            output = response[0]
+
+        output = Message(message=output, role=self.config.ai_prefix)
+        return output
 
     def predict(self, sentence: str, conversation_id: str = None):
         message = Message(message=sentence, role=self.config.human_prefix)
@@ -196,5 +285,16 @@ class Bot(BaseObject):
         self.add_message_to_memory(human_message=message, ai_message=output, conversation_id=conversation_id)
         return output
 
+    async def apredict(self, sentence: str, conversation_id: str = None):
+        message = Message(message=sentence, role=self.config.human_prefix)
+        # Raises AdmissionRejected when overloaded; the turn is saved before the conversation's next request starts
+        async with self.admission.slot(conversation_id):
+            output = await self(message, conversation_id=conversation_id)
+            await self.aadd_message_to_memory(human_message=message, ai_message=output, conversation_id=conversation_id)
+        return output
+
     def call(self, input: dict):
         return self.predict(**input)
+
+    async def acall(self, input: dict):
+        return await self.apredict(**input)
@@ -1,38 +1,54 @@
-from typing import Optional
+from typing import TYPE_CHECKING, Optional, Union
 
-from langchain_core.prompts import PromptTemplate
+from langchain_core.caches import BaseCache
+from langchain_core.prompts import BasePromptTemplate, PromptTemplate
 from langchain_core.runnables import RunnableLambda
-from langchain_hub import pull as hub_pull
-from langchain_community.callbacks.tracers.langchain import wait_for_all_tracers
 
+from common.batching import MicroBatcher
 from common.config import BaseObject, Config
 from common.objects import Message
-from utils import ChatbotCache
+from common.tracing import trace_callbacks
+from utils import ChatbotCache, PromptStore
+from utils.prompt_store import is_hub_handle
 from models import ModelTypes, MODEL_TO_CLASS
 
+if TYPE_CHECKING:
+    from utils import SemanticCache
+
 
 class ChainManager(BaseObject):
     def __init__(
             self,
             config: Config = None,
             model: Optional[ModelTypes] = None,
-            prompt_template: str = None,
+            prompt_template: Union[str, BasePromptTemplate] = None,
             model_kwargs: Optional[dict] = None,
-            partial_variables: dict = None
+            partial_variables: dict = None,
+            semantic_cache: Optional["SemanticCache"] = None,
+            llm_cache: Optional[BaseCache] = None
     ):
         super().__init__()
         self.config = config if config is not None else Config()
-        self._base_model = self.get_model(model_type=model, parameters=model_kwargs)
+        self.semantic_cache = semantic_cache
+        self._base_model = self.get_model(model_type=model, parameters=model_kwargs, cache=llm_cache)
         self._init_prompt_template(template_path=prompt_template, partial_variables=partial_variables)
         self._init_chain()
 
+    @property
+    def base_model(self):
+        return self._base_model
+
     def get_model(
             self,
             model_type: Optional[ModelTypes] = None,
-            parameters: Optional[dict] = None
+            parameters: Optional[dict] = None,
+            cache: Optional[BaseCache] = None
     ):
         parameters = parameters or {}
         model_name = parameters.pop("model_name", None)
+        if cache is not None:
+            # Private to this model instead of the process-wide cache set by `set_llm_cache`
+            parameters["cache"] = cache
         if model_type is None:
             model_type = ModelTypes.VERTEX
 
@@ -40,7 +56,7 @@ class ChainManager(BaseObject):
             if model_type not in MODEL_TO_CLASS:
                 raise ValueError(
                     f"Got unknown model type: {model_type}. "
-                    f"Valid types are: {MODEL_TO_CLASS.keys()}."
+                    f"Valid types are: {list(MODEL_TO_CLASS.keys())}."
                 )
             model_class = MODEL_TO_CLASS[model_type]
         else:
@@ -49,6 +65,9 @@ class ChainManager(BaseObject):
                 "this should never happen."
             )
 
+        if model_type == ModelTypes.VERTEX:
+            # Credentials are only needed, and read, when a Vertex model is used
+            self.config.init_env()
         if model_type in [ModelTypes.VERTEX, ModelTypes.OPENAI]:
             if not model_name:
                 model_name = self.config.base_model_name
@@ -57,26 +76,47 @@ class ChainManager(BaseObject):
 
     def _init_chain(self):
         self.chain = (self._prompt | self._base_model).with_config(run_name="GenerateResponse")
+        self.batcher = None
+        if self.config.enable_micro_batching:
+            # Concurrent async calls are grouped into `abatch` calls, sync calls go straight to the chain
+            chain = self.chain
+            self.batcher = MicroBatcher(
+                chain,
+                max_batch_size=self.config.micro_batch_max_size,
+                max_wait_ms=self.config.micro_batch_max_wait_ms
+            )
+            self.chain = RunnableLambda(chain.invoke, afunc=self.batcher.ainvoke).with_config(
+                run_name="BatchedGenerateResponse")
+        if self.semantic_cache is not None:
+            # Everything the prompt uses besides the user input (history window, scratchpad) must match exactly
+            self.chain = self.semantic_cache.wrap(
+                self.chain,
+                namespace_keys=self._prompt.input_variables,
+                scope=[repr(self._prompt), type(self._base_model).__name__, self._base_model._identifying_params]
+            )
 
-    def _init_prompt_template(self, template_path: str = None, partial_variables=None):
+    def _init_prompt_template(self, template_path: Union[str, BasePromptTemplate] = None, partial_variables=None):
         partial_variables = partial_variables or {}
-        try:
-            # First try to pull from the hub
-            prompt: PromptTemplate = hub_pull(template_path)
-        except Exception as e:
-            self.logger.warning(f"Failed to pull prompt from hub: {e}")
-            # If it fails, treat it as a local template
+        if isinstance(template_path, BasePromptTemplate):
+            prompt = template_path
+        elif is_hub_handle(template_path):
+            # Served from the local snapshot, the hub is only reached when there is none
+            self.prompt_store = PromptStore(self.config.prompt_snapshot_dir)
+            prompt = self.prompt_store.get(template_path)
+            if self.config.prompt_refresh_interval:
+                self.prompt_store.start_refresh([template_path], interval=self.config.prompt_refresh_interval)
+        else:
             prompt = PromptTemplate.from_template(template_path)
         self._prompt = prompt.partial(**partial_variables)
 
     async def _predict(self, message: Message, conversation_id: str):
-        try:
-            output = self.chain.invoke({"input": message.message, "conversation_id": conversation_id})
-            output = Message(message=output, role=self.config.ai_prefix)
-            return output
-        finally:
-            # Wait for invoke chain finish before push to Langsmith
-            wait_for_all_tracers()
+        # Sampled traces are uploaded in the background, see `common.tracing`
+        output = await self.chain.ainvoke(
+            {"input": message.message, "conversation_id": conversation_id},
+            config={"callbacks": trace_callbacks(self.config)}
+        )
+        output = Message(message=output, role=self.config.ai_prefix)
+        return output
 
     def chain_stream(self, input: str, conversation_id: str):
         return self.chain.astream_log(
@@ -1,12 +1,17 @@
 """Chat manager for handling conversations with LLMs."""
-from typing import Any, Dict, Optional
+from functools import partial
+from typing import Any, AsyncIterator, Dict, List, Optional
 import os
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_openai import ChatOpenAI
 
+from ..common.batching import MicroBatcher
+from ..common.metrics import REGISTRY
+from ..common.stage_metrics import StageMetricsHandler, stage_histogram
+from ..common.summary import BackgroundSummarizer, llm_summarize
 from ..config import settings
-from ..database.mongodb import MongodbClient
+from ..database.mongodb import AsyncMongodbClient
 
 
 class ChatManager:
@@ -14,21 +19,26 @@ class ChatManager:
     
     def __init__(self, 
                  model_name: Optional[str] = None,
-                 temperature: float = 0.7):
+                 temperature: float = 0.7,
+                 db: Optional[AsyncMongodbClient] = None):
         """Initialize the chat manager.
         
         Args:
             model_name: Name of the model to use, defaults to configuration.
             temperature: Temperature for generation, higher means more creative.
+            db: Database client, defaults to one built from configuration.
         """
         self.model_name = model_name or settings.base_model_name
         self.temperature = temperature
         
         # Initialize database client
-        self.db = MongodbClient()
+        self.db = db if db is not None else AsyncMongodbClient()
         
         # Initialize chat components
         self._init_chat_components()
+        
+        # Record per-stage latencies and expose the state of the background work
+        self._init_metrics()
     
     def _init_chat_components(self) -> None:
         """Initialize chat components."""
@@ -58,6 +68,37 @@ class ChatManager:
         
         # Create the chain
         self.chain = self.template | self.model | self.output_parser
+        
+        # Optionally group concurrent requests into batched LLM calls
+        self.batcher: Optional[MicroBatcher] = None
+        if settings.enable_micro_batching:
+            self.batcher = MicroBatcher(
+                self.chain,
+                max_batch_size=settings.micro_batch_max_size,
+                max_wait_ms=settings.micro_batch_max_wait_ms
+            )
+        
+        # Optionally fold old turns into a rolling summary, in the background
+        self.summarizer: Optional[BackgroundSummarizer] = None
+        if settings.history_summary_threshold is not None:
+            self.summarizer = BackgroundSummarizer(llm_summarize(self.model))
+    
+    def _init_metrics(self) -> None:
+        """Initialize the metrics exposed on `/metrics`."""
+        self.stage_metrics = StageMetricsHandler()
+        self.run_config = {"callbacks": [self.stage_metrics]}
+        self.in_flight = REGISTRY.gauge("chatbot_requests_in_flight", "Chat requests being processed")
+        REGISTRY.gauge(
+            "chatbot_history_pending_writes",
+            "Message pairs buffered before being written to the database",
+            function=lambda: self.db.pending_writes
+        )
+        if self.summarizer is not None:
+            REGISTRY.gauge(
+                "chatbot_summaries_pending",
+                "Conversations queued or being summarized",
+                function=lambda: self.summarizer.stats()["pending"]
+            )
     
     async def process_message(self, user_input: str, conversation_id: str) -> str:
         """Process a user message and return the AI response.
@@ -69,32 +110,96 @@ class ChatManager:
         Returns:
             Response from the AI.
         """
-        # Get conversation history
-        history = self.db.format_history(conversation_id)
-        
-        # Generate response
-        response = await self.chain.ainvoke({
-            "history": history,
-            "input": user_input
-        })
-        
-        # Add message pair to history
-        self.db.add_conversation_message(
-            conversation_id=conversation_id,
-            user_message=user_input,
-            ai_message=response
-        )
+        with self.in_flight.track():
+            # Get conversation history
+            with stage_histogram("history_load").time():
+                history = await self.db.format_history(conversation_id)
+            
+            # Generate response
+            invoke = self.batcher.ainvoke if self.batcher is not None else self.chain.ainvoke
+            response = await invoke({
+                "history": history,
+                "input": user_input
+            }, config=self.run_config)
+            
+            # Add message pair to history
+            with stage_histogram("persistence").time():
+                await self.db.add_conversation_message(
+                    conversation_id=conversation_id,
+                    user_message=user_input,
+                    ai_message=response
+                )
+            self._schedule_summary(conversation_id)
         
         return response
     
-    def clear_history(self, conversation_id: str) -> None:
+    async def stream_message(self, user_input: str, conversation_id: str) -> AsyncIterator[str]:
+        """Stream the AI response to a user message as it is generated.
+        
+        The full turn is persisted only after the stream has been consumed to
+        the end. If the consumer stops early, e.g. because the client
+        disconnected, the partial response is discarded and nothing is written.
+        
+        Args:
+            user_input: Message from the user.
+            conversation_id: ID of the conversation.
+        
+        Yields:
+            Chunks of the AI response.
+        """
+        with self.in_flight.track():
+            # Get conversation history
+            with stage_histogram("history_load").time():
+                history = await self.db.format_history(conversation_id)
+            
+            chunks: List[str] = []
+            async for chunk in self.chain.astream({
+                "history": history,
+                "input": user_input
+            }, config=self.run_config):
+                chunks.append(chunk)
+                yield chunk
+            
+            # Add message pair to history once the whole response is known
+            with stage_histogram("persistence").time():
+                await self.db.add_conversation_message(
+                    conversation_id=conversation_id,
+                    user_message=user_input,
+                    ai_message="".join(chunks)
+                )
+            self._schedule_summary(conversation_id)
+    
+    def _schedule_summary(self, conversation_id: str) -> None:
+        """Queue the summarization of a conversation, which only runs past the threshold."""
+        if self.summarizer is None:
+            return
+        self.summarizer.schedule(
+            conversation_id,
+            partial(
+                self.db.fold_summary,
+                conversation_id,
+                self.summarizer.summarize,
+                keep_recent=settings.history_window_size,
+                threshold=settings.history_summary_threshold
+            )
+        )
+    
+    async def clear_history(self, conversation_id: str) -> None:
         """Clear the conversation history.
         
         Args:
             conversation_id: ID of the conversation.
         """
-        self.db.clear_conversation_history(conversation_id)
+        await self.db.clear_conversation_history(conversation_id)
+    
+    async def aclose(self) -> None:
+        """Flush pending history writes and close resources."""
+        if self.summarizer is not None:
+            self.summarizer.close()
+        await self.db.aclose()
     
     def close(self) -> None:
         """Close resources."""
+        if self.summarizer is not None:
+            self.summarizer.close()
         self.db.close() 
\ No newline at end of file
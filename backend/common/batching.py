@@ -0,0 +1,93 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .metrics import REGISTRY, Histogram
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class MicroBatcher:
+    """
+    Collects concurrent calls to a runnable for a short window and dispatches them together through `abatch`.
+    A batch is sent as soon as `max_batch_size` calls are pending, or `max_wait_ms` after its first call arrived,
+    and each result is routed back to the caller that submitted the input.
+    """
+
+    def __init__(self, runnable, max_batch_size: int = 16, max_wait_ms: float = 10):
+        """
+        :param runnable: Runnable exposing `abatch(inputs, config=..., return_exceptions=True)`
+        :param max_batch_size: Number of pending calls that triggers an immediate dispatch
+        :param max_wait_ms: Maximum time a call waits for others to join its batch
+        """
+        self.runnable = runnable
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending: List[Tuple[Any, Optional[dict], asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        # Registered so that `/metrics` reports the latest batcher
+        self.batch_size = REGISTRY.register(Histogram("micro_batch_size", "Number of calls per dispatched batch",
+                                                      buckets=BATCH_SIZE_BUCKETS))
+        self.queue_time = REGISTRY.register(
+            Histogram("micro_batch_queue_seconds", "Time a call waits before its batch is dispatched"))
+        self.latency = REGISTRY.register(
+            Histogram("micro_batch_latency_seconds", "Time from submitting a call to receiving its result"))
+        REGISTRY.gauge("micro_batch_pending", "Calls waiting for their batch to be dispatched",
+                       function=lambda: len(self._pending))
+
+    def stats(self) -> Dict:
+        return {
+            "pending": len(self._pending),
+            "batch_size": self.batch_size.snapshot(),
+            "queue_time": self.queue_time.snapshot(),
+            "latency": self.latency.snapshot()
+        }
+
+    async def ainvoke(self, input: Any, config: Optional[dict] = None) -> Any:
+        """Submit one input and wait for its result, which is computed as part of a batch"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((input, config, future, time.monotonic()))
+        if len(self._pending) >= self.max_batch_size:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._dispatch)
+        return await future
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[Any, Optional[dict], asyncio.Future, float]]):
+        dispatched_at = time.monotonic()
+        self.batch_size.observe(len(batch))
+        for _, _, _, submitted_at in batch:
+            self.queue_time.observe(dispatched_at - submitted_at)
+
+        try:
+            results = await self.runnable.abatch(
+                [input for input, _, _, _ in batch],
+                config=[config or {} for _, config, _, _ in batch],
+                return_exceptions=True
+            )
+        except Exception as e:
+            results = [e] * len(batch)
+
+        finished_at = time.monotonic()
+        for (_, _, future, submitted_at), result in zip(batch, results):
+            self.latency.observe(finished_at - submitted_at)
+            # The caller may have been cancelled while waiting
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -9,4 +9,34 @@ CREDENTIALS_FILE = "CREDENTIALS_FILE"
 AI_PREFIX = "AI_PREFIX"
 HUMAN_PREFIX = "HUMAN_PREFIX"
 MEMORY_KEY = "MEMORY_KEY"
-
+MEMORY_MAX_CONVERSATIONS = "MEMORY_MAX_CONVERSATIONS"
+MEMORY_MAX_BYTES = "MEMORY_MAX_BYTES"
+MEMORY_CONVERSATION_TTL = "MEMORY_CONVERSATION_TTL"
+MAX_CONCURRENT_REQUESTS = "MAX_CONCURRENT_REQUESTS"
+MAX_QUEUED_REQUESTS = "MAX_QUEUED_REQUESTS"
+QUEUE_TIMEOUT = "QUEUE_TIMEOUT"
+ENABLE_MICRO_BATCHING = "ENABLE_MICRO_BATCHING"
+MICRO_BATCH_MAX_SIZE = "MICRO_BATCH_MAX_SIZE"
+MICRO_BATCH_MAX_WAIT_MS = "MICRO_BATCH_MAX_WAIT_MS"
+SEMANTIC_CACHE_DIR = "SEMANTIC_CACHE_DIR"
+SEMANTIC_CACHE_THRESHOLD = "SEMANTIC_CACHE_THRESHOLD"
+SEMANTIC_CACHE_MAX_ENTRIES = "SEMANTIC_CACHE_MAX_ENTRIES"
+LLM_CACHE_MAX_ENTRIES = "LLM_CACHE_MAX_ENTRIES"
+LLM_CACHE_MAX_BYTES = "LLM_CACHE_MAX_BYTES"
+LLM_CACHE_TTL = "LLM_CACHE_TTL"
+PROMPT_SNAPSHOT_DIR = "PROMPT_SNAPSHOT_DIR"
+PROMPT_REFRESH_INTERVAL = "PROMPT_REFRESH_INTERVAL"
+ANONYMIZER_WORKERS = "ANONYMIZER_WORKERS"
+ANONYMIZER_MAX_PENDING = "ANONYMIZER_MAX_PENDING"
+ANONYMIZER_TIMEOUT = "ANONYMIZER_TIMEOUT"
+ANONYMIZER_MAX_LANGUAGES = "ANONYMIZER_MAX_LANGUAGES"
+ANONYMIZER_WARM_UP_LANGUAGES = "ANONYMIZER_WARM_UP_LANGUAGES"
+MEMORY_WINDOW_MODE = "MEMORY_WINDOW_MODE"
+HISTORY_TOKEN_BUDGET = "HISTORY_TOKEN_BUDGET"
+MEMORY_SUMMARY_THRESHOLD = "MEMORY_SUMMARY_THRESHOLD"
+MEMORY_RETRIEVAL_TOP_M = "MEMORY_RETRIEVAL_TOP_M"
+MEMORY_RETRIEVAL_MIN_SIMILARITY = "MEMORY_RETRIEVAL_MIN_SIMILARITY"
+TRACE_SAMPLE_RATE = "TRACE_SAMPLE_RATE"
+TRACE_ERRORS = "TRACE_ERRORS"
+TRACE_BUFFER_SIZE = "TRACE_BUFFER_SIZE"
+TRACE_FLUSH_TIMEOUT = "TRACE_FLUSH_TIMEOUT"
@@ -1,12 +1,24 @@
 import logging
 import os
 import json
-import vertexai
 import urllib.parse
 
 from .constants import CHAT_MODEL_NAME
 from .common_keys import *
 
+# Vendored prompt snapshots ship with the backend sources
+DEFAULT_PROMPT_SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prompts")
+
+
+def _optional_env(key: str, cast, default=None):
+    """Read an optional numeric setting, where an empty value or "none" disables it"""
+    value = os.getenv(key)
+    if value is None:
+        return default
+    if value.strip().lower() in ("", "none"):
+        return None
+    return cast(value)
+
 
 class Singleton(type):
     _instances = {}
@@ -46,12 +58,43 @@ class Config(BaseObject):
             mongo_username: str = None,
             mongo_password: str = None,
             mongo_cluster: str = None,
-            memory_window_size: int = 5
+            memory_window_size: int = 5,
+            memory_window_mode: str = None,
+            history_token_budget: int = None,
+            memory_summary_threshold: int = None,
+            memory_retrieval_top_m: int = None,
+            memory_retrieval_min_similarity: float = None,
+            memory_max_conversations: int = None,
+            memory_max_bytes: int = None,
+            memory_conversation_ttl: float = None,
+            max_concurrent_requests: int = None,
+            max_queued_requests: int = None,
+            queue_timeout: float = None,
+            enable_micro_batching: bool = None,
+            micro_batch_max_size: int = None,
+            micro_batch_max_wait_ms: float = None,
+            semantic_cache_dir: str = None,
+            semantic_cache_threshold: float = None,
+            semantic_cache_max_entries: int = None,
+            llm_cache_max_entries: int = None,
+            llm_cache_max_bytes: int = None,
+            llm_cache_ttl: float = None,
+            prompt_snapshot_dir: str = None,
+            prompt_refresh_interval: float = None,
+            anonymizer_workers: int = None,
+            anonymizer_max_pending: int = None,
+            anonymizer_timeout: float = None,
+            anonymizer_max_languages: int = None,
+            anonymizer_warm_up_languages: list = None,
+            trace_sample_rate: float = None,
+            trace_errors: bool = None,
+            trace_buffer_size: int = None,
+            trace_flush_timeout: float = None
     ):
         super().__init__()
         self.credentials = credentials if credentials is not None else os.getenv(CREDENTIALS_FILE,
                                                                                  "secure/vertex.json")
-        self.init_env()
+        self._vertex_initialized = False
         self.serp_api_token = serp_api_token if serp_api_token is not None else ""
         self.cache_type = cache_type if cache_type is not None else "in_memory"
         self.base_model_name = base_model_name if base_model_name is not None else CHAT_MODEL_NAME
@@ -74,12 +117,83 @@ class Config(BaseObject):
                            f"mongodb+srv://{self.mongo_username}:{self.mongo_password}@{self.mongo_cluster}.xnkswcg.mongodb.net")
         self.session_id = session_id if session_id is not None else "chatbot_backend"
         self.memory_window_size = memory_window_size if memory_window_size is not None else 5
+        # "turns" keeps the last `memory_window_size` turns, "tokens" also caps them by `history_token_budget`
+        self.memory_window_mode = memory_window_mode if memory_window_mode is not None \
+            else os.getenv(MEMORY_WINDOW_MODE, "turns").lower()
+        # Defaults to the budget of the model type when unset, see common.tokens
+        self.history_token_budget = history_token_budget if history_token_budget is not None \
+            else _optional_env(HISTORY_TOKEN_BUDGET, int)
+        # Turns past the memory window folded into a rolling summary at once, disabled when unset
+        self.memory_summary_threshold = memory_summary_threshold if memory_summary_threshold is not None \
+            else _optional_env(MEMORY_SUMMARY_THRESHOLD, int)
+        self.memory_retrieval_top_m = memory_retrieval_top_m if memory_retrieval_top_m is not None \
+            else int(os.getenv(MEMORY_RETRIEVAL_TOP_M, 3))
+        self.memory_retrieval_min_similarity = memory_retrieval_min_similarity \
+            if memory_retrieval_min_similarity is not None \
+            else float(os.getenv(MEMORY_RETRIEVAL_MIN_SIMILARITY, 0.2))
+        self.memory_max_conversations = memory_max_conversations if memory_max_conversations is not None \
+            else _optional_env(MEMORY_MAX_CONVERSATIONS, int, 10000)
+        self.memory_max_bytes = memory_max_bytes if memory_max_bytes is not None \
+            else _optional_env(MEMORY_MAX_BYTES, int)
+        self.memory_conversation_ttl = memory_conversation_ttl if memory_conversation_ttl is not None \
+            else _optional_env(MEMORY_CONVERSATION_TTL, float, 24 * 3600)
+        self.max_concurrent_requests = max_concurrent_requests if max_concurrent_requests is not None \
+            else int(os.getenv(MAX_CONCURRENT_REQUESTS, 16))
+        self.max_queued_requests = max_queued_requests if max_queued_requests is not None \
+            else int(os.getenv(MAX_QUEUED_REQUESTS, 64))
+        self.queue_timeout = queue_timeout if queue_timeout is not None else float(os.getenv(QUEUE_TIMEOUT, 30))
+        self.enable_micro_batching = enable_micro_batching if enable_micro_batching is not None \
+            else os.getenv(ENABLE_MICRO_BATCHING, "false").lower() == "true"
+        self.micro_batch_max_size = micro_batch_max_size if micro_batch_max_size is not None \
+            else int(os.getenv(MICRO_BATCH_MAX_SIZE, 16))
+        self.micro_batch_max_wait_ms = micro_batch_max_wait_ms if micro_batch_max_wait_ms is not None \
+            else float(os.getenv(MICRO_BATCH_MAX_WAIT_MS, 10))
+        self.semantic_cache_dir = semantic_cache_dir if semantic_cache_dir is not None \
+            else os.getenv(SEMANTIC_CACHE_DIR, "semantic_cache")
+        self.semantic_cache_threshold = semantic_cache_threshold if semantic_cache_threshold is not None \
+            else float(os.getenv(SEMANTIC_CACHE_THRESHOLD, 0.92))
+        self.semantic_cache_max_entries = semantic_cache_max_entries if semantic_cache_max_entries is not None \
+            else int(os.getenv(SEMANTIC_CACHE_MAX_ENTRIES, 10000))
+        self.llm_cache_max_entries = llm_cache_max_entries if llm_cache_max_entries is not None \
+            else _optional_env(LLM_CACHE_MAX_ENTRIES, int, 1000)
+        self.llm_cache_max_bytes = llm_cache_max_bytes if llm_cache_max_bytes is not None \
+            else _optional_env(LLM_CACHE_MAX_BYTES, int, 64 * 1024 * 1024)
+        self.llm_cache_ttl = llm_cache_ttl if llm_cache_ttl is not None \
+            else _optional_env(LLM_CACHE_TTL, float, 3600)
+        self.prompt_snapshot_dir = prompt_snapshot_dir if prompt_snapshot_dir is not None \
+            else os.getenv(PROMPT_SNAPSHOT_DIR, DEFAULT_PROMPT_SNAPSHOT_DIR)
+        self.prompt_refresh_interval = prompt_refresh_interval if prompt_refresh_interval is not None \
+            else _optional_env(PROMPT_REFRESH_INTERVAL, float)
+        self.anonymizer_workers = anonymizer_workers if anonymizer_workers is not None \
+            else int(os.getenv(ANONYMIZER_WORKERS, 0))
+        self.anonymizer_max_pending = anonymizer_max_pending if anonymizer_max_pending is not None \
+            else int(os.getenv(ANONYMIZER_MAX_PENDING, 64))
+        self.anonymizer_timeout = anonymizer_timeout if anonymizer_timeout is not None \
+            else _optional_env(ANONYMIZER_TIMEOUT, float, 10)
+        self.anonymizer_max_languages = anonymizer_max_languages if anonymizer_max_languages is not None \
+            else _optional_env(ANONYMIZER_MAX_LANGUAGES, int)
+        self.anonymizer_warm_up_languages = anonymizer_warm_up_languages if anonymizer_warm_up_languages is not None \
+            else [lang.strip() for lang in os.getenv(ANONYMIZER_WARM_UP_LANGUAGES, "en").split(",") if lang.strip()]
+        # Share of requests traced to LangSmith when tracing is enabled, requests that fail are traced regardless
+        self.trace_sample_rate = trace_sample_rate if trace_sample_rate is not None \
+            else float(os.getenv(TRACE_SAMPLE_RATE, 1.0))
+        self.trace_errors = trace_errors if trace_errors is not None \
+            else os.getenv(TRACE_ERRORS, "true").lower() == "true"
+        self.trace_buffer_size = trace_buffer_size if trace_buffer_size is not None \
+            else int(os.getenv(TRACE_BUFFER_SIZE, 1000))
+        self.trace_flush_timeout = trace_flush_timeout if trace_flush_timeout is not None \
+            else float(os.getenv(TRACE_FLUSH_TIMEOUT, 5))
         self.ai_prefix = os.getenv(AI_PREFIX, "AI")
         self.human_prefix = os.getenv(HUMAN_PREFIX, "Human")
         self.memory_key = os.getenv(MEMORY_KEY, "history")
         self.enable_anonymizer = False
 
     def init_env(self):
+        """Export the Vertex AI credentials and initialize the SDK, once"""
+        if self._vertex_initialized:
+            return
+        import vertexai
+
         credential_data = json.load(open(self.credentials, "r"))
         project = credential_data["project_id"]
         os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = self.credentials
@@ -88,3 +202,4 @@ class Config(BaseObject):
             project=project,
             location="us-central1"
         )
+        self._vertex_initialized = True
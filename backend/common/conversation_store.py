@@ -0,0 +1,236 @@
+import logging
+import shelve
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Protocol, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class BackingStore(Protocol):
+    """Secondary storage receiving the entries a ConversationStore evicts"""
+
+    def get(self, key: str) -> Optional[Any]:
+        ...
+
+    def set(self, key: str, value: Any):
+        ...
+
+    def delete(self, key: str):
+        ...
+
+
+class ShelveBackingStore:
+    """Spill evicted entries to a local `shelve` file so they survive eviction"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = shelve.open(path)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            return self._db.get(key)
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._db[key] = value
+
+    def delete(self, key: str):
+        with self._lock:
+            self._db.pop(key, None)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class ConversationStore:
+    __slots__ = ["max_entries", "max_bytes", "ttl", "refresh_on_access", "_size_func", "_backing_store",
+                 "_on_evict", "_entries", "_bytes", "_lock", "hits", "misses", "evictions", "expirations"]
+
+    def __init__(
+            self,
+            max_entries: Optional[int] = None,
+            max_bytes: Optional[int] = None,
+            ttl: Optional[float] = None,
+            size_func: Optional[Callable[[Any], int]] = None,
+            backing_store: Optional[BackingStore] = None,
+            refresh_on_access: bool = True,
+            on_evict: Optional[Callable[[Hashable, Any], None]] = None
+    ):
+        """
+        Thread-safe mapping of conversation id to a value, bounded in size.
+        Least recently used entries are evicted once `max_entries` or `max_bytes` is exceeded,
+        and entries not accessed for `ttl` seconds expire.
+        :param max_entries: Maximum number of conversations kept, unbounded if None
+        :param max_bytes: Maximum total size of kept values as measured by `size_func`, unbounded if None
+        :param ttl: Idle time in seconds after which an entry expires, never if None
+        :param size_func: Approximate size of a value in bytes, required by `max_bytes`
+        :param backing_store: Optional store that receives evicted and expired entries,
+            they are moved back on their next access
+        :param refresh_on_access: Whether reads restart the `ttl` of an entry, otherwise it expires `ttl` seconds
+            after it was written, and is only dropped when read or evicted
+        :param on_evict: Called with the key and value of every evicted or expired entry, under the store's lock
+        """
+        if max_bytes is not None and size_func is None:
+            raise ValueError("`size_func` is required when `max_bytes` is set.")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.refresh_on_access = refresh_on_access
+        self._size_func = size_func
+        self._backing_store = backing_store
+        self._on_evict = on_evict
+        # key -> [value, size, last access or write time], ordered from least to most recently used
+        self._entries: "OrderedDict[Hashable, list]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            self._expire()
+            return key in self._entries
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is not None and not self.refresh_on_access and self._expired(entry):
+                self._drop(key)
+                self.expirations += 1
+                entry = None
+            if entry is not None:
+                self.hits += 1
+                if self.refresh_on_access:
+                    entry[2] = time.monotonic()
+                self._entries.move_to_end(key)
+                return entry[0]
+
+            self.misses += 1
+            if self._backing_store is not None:
+                value = self._backing_store.get(key)
+                if value is not None:
+                    self._backing_store.delete(key)
+                    self._insert(key, value)
+                    return value
+            return default
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """Atomically return the value of `key`, creating it with `factory` when missing"""
+        with self._lock:
+            value = self.get(key)
+            if value is None:
+                value = factory()
+                self._insert(key, value)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._remove(key)
+            self._insert(key, value)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._remove(key)
+            if entry is not None:
+                return entry[0]
+            if self._backing_store is not None:
+                value = self._backing_store.get(key)
+                if value is not None:
+                    self._backing_store.delete(key)
+                    return value
+            return default
+
+    def clear(self):
+        """Drop every entry, without passing them to the backing store"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """Snapshot of the entries, from least to most recently used"""
+        with self._lock:
+            return [(key, entry[0]) for key, entry in self._entries.items()]
+
+    def resize(self, key: Hashable, delta: Optional[int] = None):
+        """
+        Re-measure an entry whose value was mutated in place
+        :param delta: Bytes added to the value, to update its size without measuring it again
+        """
+        if self._size_func is None:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            size = entry[1] + delta if delta is not None else self._size_func(entry[0])
+            self._bytes += size - entry[1]
+            entry[1] = size
+            self._evict()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+    def _insert(self, key: Hashable, value: Any):
+        size = self._size_func(value) if self._size_func is not None else 0
+        self._entries[key] = [value, size, time.monotonic()]
+        self._bytes += size
+        self._evict()
+
+    def _remove(self, key: Hashable) -> Optional[list]:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+        return entry
+
+    def _evict(self):
+        while self._entries and (
+                (self.max_entries is not None and len(self._entries) > self.max_entries)
+                or (self.max_bytes is not None and self._bytes > self.max_bytes and len(self._entries) > 1)
+        ):
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _expired(self, entry: list) -> bool:
+        return self.ttl is not None and entry[2] <= time.monotonic() - self.ttl
+
+    def _expire(self):
+        # Entries are ordered by last access, so when reads refresh the ttl expired ones are all at the front
+        if self.ttl is None or not self.refresh_on_access:
+            return
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if not self._expired(entry):
+                break
+            self._drop(key)
+            self.expirations += 1
+
+    def _drop(self, key: Hashable):
+        entry = self._remove(key)
+        self._spill(key, entry)
+        if self._on_evict is not None:
+            self._on_evict(key, entry[0])
+
+    def _spill(self, key: Hashable, entry: list):
+        if self._backing_store is None:
+            return
+        try:
+            self._backing_store.set(key, entry[0])
+        except Exception as e:
+            logger.error(f"Failed to spill conversation <{key}> to the backing store: {e}")
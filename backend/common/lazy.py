@@ -0,0 +1,38 @@
+import importlib
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator
+
+
+def import_string(path: str) -> Any:
+    """Import an attribute from its "package.module:attribute" path"""
+    module_name, _, attribute = path.partition(":")
+    module = importlib.import_module(module_name)
+    return getattr(module, attribute) if attribute else module
+
+
+class LazyMapping(Mapping):
+    """
+    Read-only mapping whose values are "package.module:attribute" paths imported on first access,
+    so that listing or checking keys never imports the optional dependencies behind the values.
+    """
+
+    def __init__(self, paths: Dict[str, str]):
+        self._paths = dict(paths)
+        self._loaded: Dict[str, Any] = {}
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._loaded:
+            self._loaded[key] = import_string(self._paths[key])
+        return self._loaded[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._paths)
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._paths
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self._paths!r})"
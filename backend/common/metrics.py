@@ -0,0 +1,213 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+# Seconds, suited to request latencies from a few milliseconds to a minute
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labels: Dict[str, str], extra: Optional[Dict[str, str]] = None) -> str:
+    labels = {**labels, **(extra or {})}
+    if not labels:
+        return ""
+    escaped = (
+        key + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative histogram of observed values, with Prometheus-style upper-bound buckets"""
+
+    kind = "histogram"
+
+    def __init__(
+            self,
+            name: str,
+            description: str = "",
+            buckets: Optional[Sequence[float]] = None,
+            labels: Optional[Dict[str, str]] = None
+    ):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets or DEFAULT_BUCKETS))
+        self.labels = dict(labels or {})
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+            self._count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Observe the duration of the block, in seconds, whether it raises or not"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            cumulative, buckets = 0, {}
+            for bound, count in zip(self.buckets, self._counts):
+                cumulative += count
+                buckets[bound] = cumulative
+            return {
+                "count": self._count,
+                "sum": self._sum,
+                "buckets": buckets
+            }
+
+    def samples(self) -> List[str]:
+        snapshot = self.snapshot()
+        lines = [
+            f"{self.name}_bucket{_format_labels(self.labels, {'le': _format_value(bound)})} {count}"
+            for bound, count in snapshot["buckets"].items()
+        ]
+        lines.append(f"{self.name}_bucket{_format_labels(self.labels, {'le': '+Inf'})} {snapshot['count']}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labels)} {_format_value(snapshot['sum'])}")
+        lines.append(f"{self.name}_count{_format_labels(self.labels)} {snapshot['count']}")
+        return lines
+
+
+class Gauge:
+    """Value that goes up and down, either set directly or read from `function` at collection time"""
+
+    kind = "gauge"
+
+    def __init__(
+            self,
+            name: str,
+            description: str = "",
+            labels: Optional[Dict[str, str]] = None,
+            function: Optional[Callable[[], float]] = None
+    ):
+        self.name = name
+        self.description = description
+        self.labels = dict(labels or {})
+        self.function = function
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    @contextmanager
+    def track(self) -> Iterator[None]:
+        """Count the block as in progress while it runs"""
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    @property
+    def value(self) -> float:
+        if self.function is not None:
+            return self.function()
+        with self._lock:
+            return self._value
+
+    def samples(self) -> List[str]:
+        try:
+            value = self.value
+        except Exception:
+            # A failing callback must not break the whole scrape
+            value = math.nan
+        return [f"{self.name}{_format_labels(self.labels)} {_format_value(value)}"]
+
+
+Metric = Union[Histogram, Gauge]
+
+
+class MetricsRegistry:
+    """
+    Process-wide set of metrics, rendered in the Prometheus text exposition format.
+    Metrics are identified by their name and labels: asking twice for the same one returns the same object,
+    so that modules can look them up where they record values instead of passing them around.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Metric] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: Optional[Dict[str, str]]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+        return name, tuple(sorted((labels or {}).items()))
+
+    def register(self, metric: Metric) -> Metric:
+        """Add a metric built elsewhere, replacing any metric with the same name and labels"""
+        with self._lock:
+            self._metrics[self._key(metric.name, metric.labels)] = metric
+        return metric
+
+    def histogram(
+            self,
+            name: str,
+            description: str = "",
+            buckets: Optional[Sequence[float]] = None,
+            labels: Optional[Dict[str, str]] = None
+    ) -> Histogram:
+        with self._lock:
+            key = self._key(name, labels)
+            if key not in self._metrics:
+                self._metrics[key] = Histogram(name, description, buckets=buckets, labels=labels)
+            return self._metrics[key]
+
+    def gauge(
+            self,
+            name: str,
+            description: str = "",
+            labels: Optional[Dict[str, str]] = None,
+            function: Optional[Callable[[], float]] = None
+    ) -> Gauge:
+        """Return a gauge, `function` replaces the callback of an existing one so that its latest owner reports"""
+        with self._lock:
+            key = self._key(name, labels)
+            if key not in self._metrics:
+                self._metrics[key] = Gauge(name, description, labels=labels, function=function)
+            elif function is not None:
+                self._metrics[key].function = function
+            return self._metrics[key]
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines, described = [], set()
+        for metric in metrics:
+            if metric.name not in described:
+                described.add(metric.name)
+                lines.append(f"# HELP {metric.name} {metric.description}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+# Content type of `MetricsRegistry.render`
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY = MetricsRegistry()
@@ -21,7 +21,4 @@ class ChatRequest(BaseModel):
 def messages_from_dict(message: dict) -> str:
     human_message = message["human_message"]
     ai_message = message["ai_message"]
-
-    human_message = Message(message=human_message["message"], role=human_message["role"])
-    ai_message = Message(message=ai_message["message"], role=ai_message["role"])
-    return f"{human_message.role}: {human_message.message}\n{ai_message.role}: {ai_message.message}"
+    return f"{human_message['role']}: {human_message['message']}\n{ai_message['role']}: {ai_message['message']}"
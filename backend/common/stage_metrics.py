@@ -0,0 +1,109 @@
+import time
+from typing import Any, Dict, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .metrics import REGISTRY, Histogram, MetricsRegistry
+
+STAGE_METRIC = "chatbot_stage_duration_seconds"
+TIME_TO_FIRST_TOKEN_METRIC = "chatbot_llm_time_to_first_token_seconds"
+
+# Runnables of the bot's pipeline, by run name, and the stage they are recorded as
+DEFAULT_RUN_STAGES = {
+    "LoadHistory": "history_load",
+    "AnonymizeSentence": "anonymize",
+    "DeAnonymizeResponse": "deanonymize"
+}
+
+# Stages of runnables recognized by their run type rather than their name
+RUN_TYPE_STAGES = {
+    "prompt": "prompt_render",
+    "parser": "output_parse"
+}
+
+
+def stage_histogram(stage: str, registry: MetricsRegistry = REGISTRY) -> Histogram:
+    """Return the histogram of the durations of one stage of a chat request"""
+    return registry.histogram(STAGE_METRIC, "Duration of each stage of a chat request", labels={"stage": stage})
+
+
+def time_to_first_token_histogram(registry: MetricsRegistry = REGISTRY) -> Histogram:
+    return registry.histogram(TIME_TO_FIRST_TOKEN_METRIC, "Time from calling the LLM to its first streamed token")
+
+
+class StageMetricsHandler(BaseCallbackHandler):
+    """
+    Callback handler recording the duration of the stages of a chain run: the runnables named in `run_stages`,
+    prompt rendering, output parsing, LLM calls and tool calls, plus the time to the first token of streamed
+    LLM calls. It relies on the callbacks LangChain always emits, so it works with tracing disabled, and keeps
+    no state beyond the start time of the runs in progress, so one handler can be shared by all requests.
+    """
+
+    # Timestamps are taken when the event happens, not when a callback thread gets to it
+    run_inline = True
+
+    def __init__(self, run_stages: Optional[Dict[str, str]] = None, registry: MetricsRegistry = REGISTRY):
+        """
+        :param run_stages: Stage of the runnables to time, by run name, defaults to the bot's pipeline
+        :param registry: Registry the histograms are recorded in
+        """
+        self.run_stages = DEFAULT_RUN_STAGES if run_stages is None else run_stages
+        self.registry = registry
+        self._starts: Dict[UUID, Tuple[str, float]] = {}
+        self._streaming: Dict[UUID, float] = {}
+
+    def _start(self, run_id: UUID, stage: Optional[str]):
+        if stage is not None:
+            self._starts[run_id] = (stage, time.perf_counter())
+
+    def _finish(self, run_id: UUID):
+        self._streaming.pop(run_id, None)
+        started = self._starts.pop(run_id, None)
+        if started is not None:
+            stage, start = started
+            stage_histogram(stage, self.registry).observe(time.perf_counter() - start)
+
+    def on_chain_start(self, serialized: Optional[Dict[str, Any]], inputs: Any, *, run_id: UUID, **kwargs: Any):
+        stage = RUN_TYPE_STAGES.get(kwargs.get("run_type"))
+        self._start(run_id, stage if stage is not None else self.run_stages.get(kwargs.get("name")))
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id)
+
+    def on_llm_start(self, serialized: Optional[Dict[str, Any]], prompts: Any, *, run_id: UUID, **kwargs: Any):
+        self._start(run_id, "llm")
+        self._streaming[run_id] = self._starts[run_id][1]
+
+    def on_chat_model_start(
+            self,
+            serialized: Optional[Dict[str, Any]],
+            messages: Any,
+            *,
+            run_id: UUID,
+            **kwargs: Any
+    ):
+        self.on_llm_start(serialized, messages, run_id=run_id, **kwargs)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any):
+        start = self._streaming.pop(run_id, None)
+        if start is not None:
+            time_to_first_token_histogram(self.registry).observe(time.perf_counter() - start)
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id)
+
+    def on_tool_start(self, serialized: Optional[Dict[str, Any]], input_str: str, *, run_id: UUID, **kwargs: Any):
+        self._start(run_id, "tool")
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id)
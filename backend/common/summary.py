@@ -0,0 +1,104 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Set
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """Progressively summarize the lines of conversation provided, adding onto the previous summary \
+and returning a new summary. Keep every fact, name, number and decision the conversation may refer back to.
+
+Current summary:
+{summary}
+
+New lines of conversation:
+{new_lines}
+
+New summary:"""
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+
+def llm_summarize(llm) -> Callable[[str], str]:
+    """Turn a LangChain chat model or LLM into a function from a prompt to its text completion"""
+
+    def summarize(prompt: str) -> str:
+        output = llm.invoke(prompt)
+        return str(getattr(output, "content", output)).strip()
+
+    return summarize
+
+
+class BackgroundSummarizer:
+    """
+    Folds old turns of conversations into rolling summaries, in background threads outside the request path.
+    At most one job per conversation is queued or running, scheduling a conversation that already has one
+    is a no-op, and at most `max_pending` jobs are queued overall: further ones are dropped and the
+    conversation is summarized by a job scheduled after one of its next turns instead.
+    """
+
+    def __init__(self, complete: Callable[[str], str], max_workers: int = 1, max_pending: int = 256):
+        """
+        :param complete: Function returning the completion of a prompt, see `llm_summarize`
+        :param max_workers: Number of threads running summarization jobs
+        :param max_pending: Maximum number of jobs queued or running
+        """
+        self.complete = complete
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="summarizer")
+        self._lock = threading.Lock()
+        self._pending: Set[Hashable] = set()
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def summarize(self, summary: str, new_lines: str) -> str:
+        """Return the summary extended with new lines of conversation"""
+        return self.complete(SUMMARY_PROMPT.format(summary=summary or "(empty)", new_lines=new_lines))
+
+    def schedule(self, key: Hashable, job: Callable[[], Any]) -> bool:
+        """Run `job` in the background unless `key` already has a pending job, return whether it was queued"""
+        with self._lock:
+            if key in self._pending:
+                return False
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending.add(key)
+        try:
+            future = self._executor.submit(job)
+        except RuntimeError:
+            # Shut down
+            with self._lock:
+                self._pending.discard(key)
+            return False
+        future.add_done_callback(lambda f: self._done(key, f))
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "completed": self.completed,
+                "failed": self.failed,
+                "dropped": self.dropped
+            }
+
+    def close(self, wait: bool = False):
+        """Stop the workers, queued jobs are dropped since their conversations are summarized again later"""
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _done(self, key: Hashable, future: Future):
+        if future.cancelled():
+            with self._lock:
+                self._pending.discard(key)
+            return
+        error = future.exception()
+        with self._lock:
+            self._pending.discard(key)
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+        if error is not None:
+            logger.warning(f"Failed to summarize conversation <{key}>: {error}")
@@ -0,0 +1,89 @@
+import logging
+import math
+import re
+from typing import Callable, List, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+# Tokens of history allowed in the prompt per model type, leaving room for the instructions, the tools,
+# the agent scratchpad and the answer. Llama.cpp models are run with a 512 token context, see examples
+DEFAULT_HISTORY_TOKEN_BUDGETS = {
+    "OPENAI": 4000,
+    "VERTEX": 2000,
+    "LLAMA-CPP": 160
+}
+# Role label, separator and newline added around each message when the history is formatted
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_WORD_PATTERN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """Return the tiktoken encoding if the package is installed and its vocabulary can be loaded, else None"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.info(f"tiktoken is not available ({e}), estimating token counts")
+    return _encoding
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate: about 4 characters per token, and at least one token per word or punctuation mark"""
+    if not text:
+        return 0
+    return max(math.ceil(len(text) / 4), len(_WORD_PATTERN.findall(text)))
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens of a text, exactly with tiktoken when it is installed, estimated otherwise"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_turn_tokens(human_message: str, ai_message: str) -> int:
+    """Tokens taken by one human / AI turn once formatted into the prompt history"""
+    return count_tokens(human_message) + count_tokens(ai_message) + 2 * MESSAGE_OVERHEAD_TOKENS
+
+
+def budget_left(budget: int, text: Optional[str]) -> int:
+    """Tokens of `budget` left once `text`, e.g. the rolling summary, is in the prompt history"""
+    if not text:
+        return budget
+    return max(budget - count_tokens(text) - MESSAGE_OVERHEAD_TOKENS, 0)
+
+
+def history_token_budget(model_type: Optional[str], budget: Optional[int] = None) -> int:
+    """Return `budget` if set, else the default history budget of a model type"""
+    if budget is not None:
+        return budget
+    return DEFAULT_HISTORY_TOKEN_BUDGETS.get(str(getattr(model_type, "value", model_type)),
+                                             DEFAULT_HISTORY_TOKEN_BUDGETS["VERTEX"])
+
+
+def window_by_budget(turns: Sequence[T], budget: int, tokens: Callable[[T], int]) -> List[T]:
+    """
+    Return the most recent turns whose token counts add up to at most `budget`, oldest first.
+    The window is filled newest-first and stops at the first turn that does not fit,
+    so that the history never has gaps.
+    """
+    total = 0
+    start = len(turns)
+    while start > 0:
+        total += tokens(turns[start - 1])
+        if total > budget:
+            break
+        start -= 1
+    return list(turns[start:])
@@ -0,0 +1,250 @@
+import atexit
+import logging
+import queue
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.env import get_runtime_environment
+from langchain_core.tracers.langchain import LangChainTracer
+from langchain_core.tracers.schemas import Run
+from langsmith.utils import tracing_is_enabled
+
+logger = logging.getLogger(__name__)
+
+# Stops the upload thread
+_CLOSE = object()
+
+
+def _has_error(run: Run) -> bool:
+    runs = [run]
+    while runs:
+        run = runs.pop()
+        if run.error:
+            return True
+        runs.extend(run.child_runs)
+    return False
+
+
+class TraceFlusher:
+    """
+    Uploads finished traces to LangSmith from a background thread, so that requests never wait for the network.
+    At most `max_buffered` traces wait for upload, further ones are dropped rather than growing the backlog.
+    """
+
+    def __init__(self, client=None, max_buffered: int = 1000):
+        """
+        :param client: LangSmith client, defaults to the one of the LangChain tracers
+        :param max_buffered: Maximum number of traces waiting for upload
+        """
+        self.client = client
+        self._queue: queue.Queue = queue.Queue(maxsize=max_buffered)
+        self._closed = False
+        self.uploaded = 0
+        self.failed = 0
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._upload_loop, name="trace-flusher", daemon=True)
+        self._thread.start()
+
+    def submit(self, run: Run, client, project_name: Optional[str] = None) -> bool:
+        """Queue the tree of a finished root run for upload, return False if it was dropped"""
+        if self._closed:
+            return False
+        try:
+            self._queue.put_nowait((run, self.client or client, project_name))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "buffered": self._queue.qsize(),
+            "uploaded": self.uploaded,
+            "failed": self.failed,
+            "dropped": self.dropped
+        }
+
+    def close(self, timeout: Optional[float] = None) -> bool:
+        """
+        Upload the buffered traces, waiting at most `timeout` seconds, then stop the thread
+        :return: Whether every buffered trace was uploaded in time
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        if not self._closed:
+            self._closed = True
+            try:
+                self._queue.put(_CLOSE, timeout=timeout)
+            except queue.Full:
+                logger.warning(f"Dropped {self._queue.qsize()} buffered traces on shutdown")
+                return False
+        self._thread.join(max(deadline - time.monotonic(), 0) if deadline is not None else None)
+        if self._thread.is_alive():
+            logger.warning(f"Trace upload did not finish within {timeout} seconds")
+            return False
+        return True
+
+    def _upload_loop(self):
+        clients = set()
+        while True:
+            item = self._queue.get()
+            if item is _CLOSE:
+                break
+            run, client, project_name = item
+            clients.add(client)
+            try:
+                self._upload(run, client, project_name)
+                self.uploaded += 1
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"Failed to upload trace <{run.id}>: {e}")
+        # The LangSmith client batches uploads in a thread of its own
+        for client in clients:
+            if hasattr(client, "flush"):
+                client.flush()
+
+    @staticmethod
+    def _upload(root: Run, client, project_name: Optional[str]):
+        runtime = get_runtime_environment()
+        runs = [root]
+        while runs:
+            run = runs.pop()
+            # Parents are created before their children
+            runs.extend(reversed(run.child_runs))
+            client.create_run(
+                name=run.name,
+                inputs=run.inputs,
+                run_type=run.run_type,
+                project_name=run.session_name or project_name,
+                id=run.id,
+                trace_id=run.trace_id,
+                dotted_order=run.dotted_order,
+                parent_run_id=run.parent_run_id,
+                start_time=run.start_time,
+                end_time=run.end_time,
+                outputs=run.outputs,
+                error=run.error,
+                extra={**(run.extra or {}), "runtime": runtime},
+                tags=run.tags,
+                events=run.events,
+                reference_example_id=run.reference_example_id
+            )
+
+
+class SampledLangChainTracer(LangChainTracer):
+    """
+    LangChain tracer that keeps traces in memory until their root run ends, then hands the sampled ones to a
+    `TraceFlusher` instead of uploading every run as it starts and ends.
+    Since it is a `LangChainTracer`, LangChain does not add its own tracer to runs it is passed to.
+    """
+
+    def __init__(
+            self,
+            flusher: Optional[TraceFlusher] = None,
+            sample_rate: float = 1.0,
+            trace_errors: bool = True,
+            **kwargs: Any
+    ):
+        super().__init__(**kwargs)
+        self.flusher = flusher
+        self.sample_rate = sample_rate
+        self.trace_errors = trace_errors
+
+    def copy_with_metadata_defaults(self, **kwargs: Any) -> "SampledLangChainTracer":
+        # LangChain copies tracers to add metadata, the copies share the runs but must sample them the same way
+        tracer = super().copy_with_metadata_defaults(**kwargs)
+        tracer.flusher = self.flusher
+        tracer.sample_rate = self.sample_rate
+        tracer.trace_errors = self.trace_errors
+        return tracer
+
+    def _persist_run_single(self, run: Run) -> None:
+        # Uploaded with the whole trace, see `_persist_run`
+        pass
+
+    def _update_run_single(self, run: Run) -> None:
+        pass
+
+    def _persist_run(self, run: Run) -> None:
+        """Called with the tree of a root run once it ended"""
+        if self.flusher is None or run.extra.get("__disabled"):
+            return
+        if random.random() < self.sample_rate or (self.trace_errors and _has_error(run)):
+            self.flusher.submit(run, self.client, self.project_name)
+
+
+class TraceSampler:
+    """
+    Traces a random share of the requests plus, optionally, every request that failed.
+    Traces are uploaded in the background, and `close` gives the buffered ones a bounded time to be uploaded.
+    """
+
+    def __init__(
+            self,
+            sample_rate: float = 1.0,
+            trace_errors: bool = True,
+            max_buffered: int = 1000,
+            flush_timeout: float = 5,
+            client=None
+    ):
+        """
+        :param sample_rate: Share of the requests traced, between 0 and 1, 0.01 is recommended in production
+        :param trace_errors: Whether requests with an error are traced regardless of sampling
+        :param max_buffered: Maximum number of traces waiting for upload
+        :param flush_timeout: Seconds `close` waits for the buffered traces to be uploaded
+        :param client: LangSmith client, defaults to the one of the LangChain tracers
+        """
+        self.sample_rate = sample_rate
+        self.trace_errors = trace_errors
+        self.flush_timeout = flush_timeout
+        self.flusher = TraceFlusher(client=client, max_buffered=max_buffered)
+
+    @classmethod
+    def from_config(cls, config) -> "TraceSampler":
+        return cls(
+            sample_rate=config.trace_sample_rate,
+            trace_errors=config.trace_errors,
+            max_buffered=config.trace_buffer_size,
+            flush_timeout=config.trace_flush_timeout
+        )
+
+    def callbacks(self) -> List[SampledLangChainTracer]:
+        """
+        Callbacks tracing one request, a tracer keeps the ids of the runs it has seen and is not reused.
+        It is returned even when nothing is sampled, so that LangChain does not trace the request itself.
+        """
+        return [SampledLangChainTracer(
+            self.flusher,
+            sample_rate=self.sample_rate,
+            trace_errors=self.trace_errors,
+            client=self.flusher.client
+        )]
+
+    def stats(self) -> Dict[str, int]:
+        return self.flusher.stats()
+
+    def close(self, timeout: Optional[float] = None) -> bool:
+        return self.flusher.close(self.flush_timeout if timeout is None else timeout)
+
+
+_sampler: Optional[TraceSampler] = None
+_sampler_lock = threading.Lock()
+
+
+def get_trace_sampler(config) -> Optional[TraceSampler]:
+    """Return the process-wide trace sampler, or None when LangSmith tracing is disabled"""
+    global _sampler
+    if not tracing_is_enabled():
+        return None
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = TraceSampler.from_config(config)
+            atexit.register(_sampler.close)
+        return _sampler
+
+
+def trace_callbacks(config) -> list:
+    """Callbacks tracing one request, none when tracing is disabled"""
+    sampler = get_trace_sampler(config)
+    return sampler.callbacks() if sampler is not None else []
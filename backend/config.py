@@ -16,9 +16,31 @@ class Settings(BaseSettings):
     openai_api_key: Optional[str] = Field(default=None, description="OpenAI API Key")
     base_model_name: str = Field(default="gpt-3.5-turbo", description="Base model name to use")
     
+    # Micro-batching of concurrent LLM calls
+    enable_micro_batching: bool = Field(default=False, 
+                                        description="Group concurrent LLM calls into batched requests")
+    micro_batch_max_size: int = Field(default=16, description="Number of pending calls that triggers a batch")
+    micro_batch_max_wait_ms: float = Field(default=10, 
+                                           description="Maximum milliseconds a call waits for its batch")
+    
     # MongoDB Configuration
     mongo_uri: str = Field(default="mongodb://localhost:27017/chatbot", 
                          description="MongoDB connection string")
+    history_window_size: int = Field(default=10, 
+                                     description="Number of most recent turns loaded into the prompt (0 loads all)")
+    history_window_mode: str = Field(default="turns", 
+                                     description="'turns' windows the history by turn count, 'tokens' also caps it by a token budget")
+    history_token_budget: Optional[int] = Field(default=None, 
+                                                description="History tokens allowed in 'tokens' mode, defaults to the budget of the model type")
+    history_summary_threshold: Optional[int] = Field(default=None, 
+                                                     description="Fold turns older than the history window into a rolling summary once this many accumulate (disabled when unset)")
+    mongo_max_workers: int = Field(default=32, description="Threads used for non-blocking MongoDB calls")
+    mongo_write_behind: bool = Field(default=False, 
+                                     description="Buffer history writes and flush them in batches")
+    mongo_write_behind_batch_size: int = Field(default=100, 
+                                               description="Number of buffered turns that triggers a flush")
+    mongo_write_behind_interval: float = Field(default=1.0, 
+                                               description="Maximum seconds a turn stays buffered")
     
     # Anonymizer Configuration
     enable_anonymizer: bool = Field(default=False, description="Enable PII anonymization")
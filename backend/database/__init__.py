@@ -1,4 +1,4 @@
 """Database access module for the chatbot."""
-from .mongodb import MongodbClient
+from .mongodb import AsyncMongodbClient, MongodbClient
 
-__all__ = ["MongodbClient"] 
\ No newline at end of file
+__all__ = ["AsyncMongodbClient", "MongodbClient"] 
\ No newline at end of file
@@ -1,25 +1,38 @@
 """MongoDB database client for the chatbot application."""
-from typing import Dict, List, Any, Optional, cast
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, List, Any, Optional, Set, Tuple, TypeVar, cast
 from datetime import datetime, timezone
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 from pymongo.collection import Collection
 from pymongo.database import Database
+from pymongo.errors import BulkWriteError, OperationFailure
 
+from ..common.summary import SUMMARY_PREFIX
+from ..common.tokens import budget_left, count_turn_tokens, history_token_budget, window_by_budget
 from ..config import settings
 
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
 
 class MongodbClient:
     """MongoDB client for chat history storage."""
     
-    def __init__(self, collection_name: Optional[str] = None):
+    def __init__(self, collection_name: Optional[str] = None, client: Optional[MongoClient] = None):
         """Initialize the MongoDB client.
         
         Args:
             collection_name: Optional name of the MongoDB collection to use.
                 Defaults to the value in settings.
+            client: Optional pre-built client, e.g. a ``mongomock.MongoClient``
+                for local testing. Defaults to a client for ``settings.mongo_uri``.
         """
         self.mongo_uri = settings.mongo_uri
-        self.client = MongoClient(self.mongo_uri)
+        self.client = client if client is not None else MongoClient(self.mongo_uri)
         
         # Extract the database name from the MongoDB URI
         db_name = self.mongo_uri.split("/")[-1]
@@ -27,6 +40,12 @@ class MongodbClient:
         # Get database and collection
         self.db: Database = self.client[db_name]
         self.collection: Collection = self.db[collection_name or settings.collection_name]
+        
+        # Unique so that concurrent upserts of a new conversation cannot create duplicates
+        try:
+            self.collection.create_index("conversation_id", unique=True)
+        except OperationFailure as e:
+            logger.warning(f"Could not create unique index on conversation_id: {e}")
     
     def add_conversation_message(
         self, 
@@ -41,44 +60,93 @@ class MongodbClient:
             user_message: Message from the user.
             ai_message: Response from the AI.
         """
-        # Check if conversation exists
-        conversation = self.collection.find_one({"conversation_id": conversation_id})
+        self.collection.update_one(
+            {"conversation_id": conversation_id},
+            self._push_update([self.build_message(user_message, ai_message)]),
+            upsert=True
+        )
+    
+    def add_conversation_messages(
+        self,
+        messages: Dict[str, List[Dict[str, Any]]]
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """Add buffered message pairs for many conversations in one round trip.
         
-        # Get current UTC time
-        current_time = datetime.now(timezone.utc)
+        The write is unordered, so when some conversations fail the others are
+        still written. Only the failed ones are returned, since retrying a
+        conversation whose `$push` succeeded would duplicate its pairs.
         
-        if conversation:
-            # Update existing conversation
-            self.collection.update_one(
-                {"conversation_id": conversation_id},
-                {"$push": {"messages": {
-                    "user": user_message,
-                    "ai": ai_message,
-                    "timestamp": current_time
-                }}}
+        Args:
+            messages: Message pairs built by `build_message`, grouped by
+                conversation ID and in insertion order.
+                
+        Returns:
+            Message pairs that were not written, grouped by conversation ID.
+        """
+        if not messages:
+            return {}
+        conversation_ids = list(messages)
+        try:
+            self.collection.bulk_write(
+                [
+                    UpdateOne({"conversation_id": conversation_id}, self._push_update(messages[conversation_id]),
+                              upsert=True)
+                    for conversation_id in conversation_ids
+                ],
+                ordered=False
             )
-        else:
-            # Create new conversation
-            self.collection.insert_one({
-                "conversation_id": conversation_id,
-                "created_at": current_time,
-                "messages": [{
-                    "user": user_message,
-                    "ai": ai_message,
-                    "timestamp": current_time
-                }]
-            })
-    
-    def get_conversation_history(self, conversation_id: str) -> List[Dict[str, Any]]:
+        except BulkWriteError as e:
+            failed = [conversation_ids[error["index"]] for error in e.details.get("writeErrors", [])]
+            logger.error(f"Failed to write the history of {len(failed)} conversations: {e}")
+            return {conversation_id: messages[conversation_id] for conversation_id in failed}
+        return {}
+    
+    @staticmethod
+    def build_message(user_message: str, ai_message: str) -> Dict[str, Any]:
+        """Build a stored message pair stamped with the current UTC time.
+        
+        The token count of the pair is stored with it, so that token-budget
+        windowing never re-tokenizes the history.
+        
+        Args:
+            user_message: Message from the user.
+            ai_message: Response from the AI.
+            
+        Returns:
+            Message pair document.
+        """
+        return {
+            "user": user_message,
+            "ai": ai_message,
+            "tokens": count_turn_tokens(user_message, ai_message),
+            "timestamp": datetime.now(timezone.utc)
+        }
+    
+    @staticmethod
+    def _push_update(pairs: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Build an upsert update appending message pairs to a conversation."""
+        return {
+            "$push": {"messages": {"$each": pairs}},
+            "$setOnInsert": {"created_at": pairs[0]["timestamp"]}
+        }
+    
+    def get_conversation_history(
+        self, 
+        conversation_id: str, 
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
         """Get the chat history for a conversation.
         
         Args:
             conversation_id: ID of the conversation.
+            limit: If set to a positive number, only the last `limit` message
+                pairs are read, using a `$slice` projection on the server.
             
         Returns:
             List of message pairs.
         """
-        conversation = self.collection.find_one({"conversation_id": conversation_id})
+        projection = {"_id": 0, "messages": {"$slice": -limit}} if limit and limit > 0 else None
+        conversation = self.collection.find_one({"conversation_id": conversation_id}, projection)
         
         if conversation:
             # Cast to the expected type to satisfy the type checker
@@ -95,20 +163,202 @@ class MongodbClient:
         """
         self.collection.update_one(
             {"conversation_id": conversation_id},
-            {"$set": {"messages": []}}
+            {"$set": {"messages": [], "summary": "", "summarized_count": 0}}
+        )
+    
+    def get_conversation_window(
+        self, 
+        conversation_id: str, 
+        limit: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Get the rolling summary of a conversation and its turns not folded into it.
+        
+        The summary, the number of stored pairs and the last `limit` pairs are
+        read in one round trip, without loading the whole conversation.
+        
+        Args:
+            conversation_id: ID of the conversation.
+            limit: If set to a positive number, only the last `limit` message
+                pairs are read.
+            
+        Returns:
+            Dictionary with the ``summary`` string and the ``messages`` not
+            summarized yet.
+        """
+        messages: Any = {"$ifNull": ["$messages", []]}
+        if limit and limit > 0:
+            messages = {"$slice": [messages, -limit]}
+        pipeline = [
+            {"$match": {"conversation_id": conversation_id}},
+            {"$project": {
+                "_id": 0,
+                "summary": 1,
+                "summarized_count": 1,
+                "total": {"$size": {"$ifNull": ["$messages", []]}},
+                "messages": messages
+            }}
+        ]
+        conversation = next(iter(self.collection.aggregate(pipeline)), None)
+        if not conversation:
+            return {"summary": "", "messages": []}
+        
+        pairs = cast(List[Dict[str, Any]], conversation.get("messages", []))
+        # Index of the first returned pair in the conversation
+        first = conversation["total"] - len(pairs)
+        summarized = conversation.get("summarized_count", 0)
+        return {
+            "summary": conversation.get("summary", ""),
+            "messages": pairs[max(summarized - first, 0):]
+        }
+    
+    def fold_summary(
+        self, 
+        conversation_id: str, 
+        summarize: Callable[[str, str], str], 
+        keep_recent: int, 
+        threshold: int
+    ) -> bool:
+        """Fold the oldest pairs of a conversation into its rolling summary.
+        
+        Runs once at least `threshold` pairs older than the `keep_recent` most
+        recent ones are not summarized. The summary is only written if the
+        conversation was neither summarized nor cleared in the meantime.
+        This calls the LLM and is meant to run in the background.
+        
+        Args:
+            conversation_id: ID of the conversation.
+            summarize: Function extending a summary with formatted new lines,
+                see `BackgroundSummarizer.summarize`.
+            keep_recent: Number of most recent pairs kept out of the summary.
+            threshold: Minimum number of pairs to fold.
+            
+        Returns:
+            Whether the summary was updated.
+        """
+        state = next(iter(self.collection.aggregate([
+            {"$match": {"conversation_id": conversation_id}},
+            {"$project": {
+                "_id": 0,
+                "summary": 1,
+                "summarized_count": 1,
+                "total": {"$size": {"$ifNull": ["$messages", []]}}
+            }}
+        ])), None)
+        if not state:
+            return False
+        summarized = state.get("summarized_count", 0)
+        count = state["total"] - summarized - max(keep_recent, 0)
+        if count < max(threshold, 1):
+            return False
+        
+        conversation = self.collection.find_one(
+            {"conversation_id": conversation_id},
+            {"_id": 0, "messages": {"$slice": [summarized, count]}}
+        ) or {}
+        summary = summarize(state.get("summary", ""), self.format_messages(conversation.get("messages", [])))
+        result = self.collection.update_one(
+            {
+                "conversation_id": conversation_id,
+                "summarized_count": summarized if summarized else {"$in": [0, None]},
+                # Not cleared while the summary was written
+                f"messages.{summarized + count - 1}": {"$exists": True}
+            },
+            {"$set": {"summary": summary, "summarized_count": summarized + count}}
         )
+        return result.modified_count == 1
     
-    def format_history(self, conversation_id: str) -> str:
-        """Format the chat history for use in prompts.
+    def format_history(
+        self, 
+        conversation_id: str, 
+        limit: Optional[int] = None, 
+        token_budget: Optional[int] = None
+    ) -> str:
+        """Format the recent chat history for use in prompts.
+        
+        In rolling-summary mode the history starts with the summary of the
+        conversation, followed by the pairs not folded into it yet.
         
         Args:
             conversation_id: ID of the conversation.
+            limit: Number of most recent message pairs to include.
+                Defaults to `settings.history_window_size`.
+            token_budget: Maximum number of history tokens, filled with the
+                most recent pairs first. Defaults to the configured budget in
+                'tokens' window mode, unbounded otherwise.
+            
+        Returns:
+            Formatted history string.
+        """
+        if limit is None:
+            limit = settings.history_window_size
+        if settings.history_summary_threshold is not None:
+            return self.format_window(self.get_conversation_window(conversation_id, limit=limit), token_budget)
+        messages = self.get_conversation_history(conversation_id, limit=limit)
+        return self.format_messages(self.window_messages(messages, token_budget))
+    
+    @staticmethod
+    def format_window(window: Dict[str, Any], token_budget: Optional[int] = None) -> str:
+        """Format a rolling summary and the recent message pairs for use in prompts.
+        
+        Args:
+            window: Summary and message pairs as returned by
+                `get_conversation_window`.
+            token_budget: Maximum number of tokens of the history, see
+                `window_messages`. The summary counts against it.
             
         Returns:
             Formatted history string.
         """
-        messages = self.get_conversation_history(conversation_id)
+        summary = f"{SUMMARY_PREFIX}{window['summary']}" if window["summary"] else ""
+        history = MongodbClient.format_messages(
+            MongodbClient.window_messages(window["messages"], token_budget, reserved=summary)
+        )
+        if not summary:
+            return history
+        return f"{summary}\n\n{history}".strip()
+    
+    @staticmethod
+    def window_messages(
+        messages: List[Dict[str, Any]], 
+        token_budget: Optional[int] = None,
+        reserved: str = ""
+    ) -> List[Dict[str, Any]]:
+        """Keep the most recent message pairs that fit in a token budget.
+        
+        Args:
+            messages: Message pairs as returned by `get_conversation_history`.
+            token_budget: Maximum number of tokens. Defaults to the configured
+                budget in 'tokens' window mode, no limit otherwise.
+            reserved: Text placed before the pairs in the prompt, such as the
+                rolling summary, whose tokens are taken from the budget.
+            
+        Returns:
+            The most recent message pairs within the budget, oldest first.
+        """
+        if token_budget is None:
+            if settings.history_window_mode != "tokens":
+                return messages
+            token_budget = history_token_budget(settings.model_type, settings.history_token_budget)
+        return window_by_budget(messages, budget_left(token_budget, reserved), MongodbClient._message_tokens)
+    
+    @staticmethod
+    def _message_tokens(message: Dict[str, Any]) -> int:
+        """Token count stored with a message pair, counted now for pairs stored without it."""
+        tokens = message.get("tokens")
+        if tokens is None:
+            tokens = count_turn_tokens(message.get("user", ""), message.get("ai", ""))
+        return tokens
+    
+    @staticmethod
+    def format_messages(messages: List[Dict[str, Any]]) -> str:
+        """Format stored message pairs for use in prompts.
         
+        Args:
+            messages: Message pairs as returned by `get_conversation_history`.
+            
+        Returns:
+            Formatted history string.
+        """
         if not messages:
             return ""
         
@@ -122,4 +372,269 @@ class MongodbClient:
     
     def close(self) -> None:
         """Close the MongoDB client connection."""
-        self.client.close() 
\ No newline at end of file
+        self.client.close()
+
+
+class AsyncMongodbClient:
+    """Awaitable MongoDB client for chat history storage.
+    
+    Wraps `MongodbClient` and runs every blocking pymongo call on a dedicated
+    thread pool, so that database round trips never stall the event loop.
+    
+    In write-behind mode, new message pairs are buffered in memory and written
+    with a single `bulk_write` once `batch_size` pairs are pending or every
+    `flush_interval` seconds. Reads merge buffered pairs into the stored
+    history, so a conversation always sees its own latest turns.
+    """
+    
+    def __init__(
+        self,
+        collection_name: Optional[str] = None,
+        client: Optional[MongoClient] = None,
+        max_workers: Optional[int] = None,
+        write_behind: Optional[bool] = None,
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None
+    ):
+        """Initialize the async MongoDB client.
+        
+        Args:
+            collection_name: Optional name of the MongoDB collection to use.
+                Defaults to the value in settings.
+            client: Optional pre-built client, e.g. a ``mongomock.MongoClient``
+                for local testing.
+            max_workers: Number of threads used for database calls.
+                Defaults to the value in settings.
+            write_behind: Whether to buffer writes. Defaults to the value in settings.
+            batch_size: Number of buffered message pairs that triggers a flush.
+                Defaults to the value in settings.
+            flush_interval: Maximum number of seconds a message pair stays buffered.
+                Defaults to the value in settings.
+        """
+        self.sync_client = MongodbClient(collection_name=collection_name, client=client)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or settings.mongo_max_workers,
+            thread_name_prefix="mongodb"
+        )
+        
+        self.write_behind = settings.mongo_write_behind if write_behind is None else write_behind
+        self.batch_size = batch_size or settings.mongo_write_behind_batch_size
+        self.flush_interval = flush_interval or settings.mongo_write_behind_interval
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+        self._pending_count = 0
+        # Incremented whenever a flush starts, so readers can detect that
+        # buffered pairs moved to the database while they were reading
+        self._flush_seq = 0
+        self._flush_lock = asyncio.Lock()
+        self._flush_timer: Optional[asyncio.Task] = None
+        self._flush_tasks: Set[asyncio.Task] = set()
+    
+    @property
+    def pending_writes(self) -> int:
+        """Number of message pairs buffered and not yet written."""
+        return self._pending_count
+
+    async def _run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run a blocking call on the database thread pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+    
+    async def add_conversation_message(
+        self, 
+        conversation_id: str, 
+        user_message: str, 
+        ai_message: str
+    ) -> None:
+        """Add a message pair to the chat history.
+        
+        Args:
+            conversation_id: ID of the conversation.
+            user_message: Message from the user.
+            ai_message: Response from the AI.
+        """
+        if not self.write_behind:
+            await self._run(
+                self.sync_client.add_conversation_message,
+                conversation_id=conversation_id,
+                user_message=user_message,
+                ai_message=ai_message
+            )
+            return
+        
+        self._pending.setdefault(conversation_id, []).append(
+            MongodbClient.build_message(user_message, ai_message)
+        )
+        self._pending_count += 1
+        if self._flush_timer is None:
+            self._flush_timer = asyncio.create_task(self._flush_periodically())
+        if self._pending_count >= self.batch_size:
+            task = asyncio.create_task(self.flush())
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+    
+    async def flush(self) -> None:
+        """Write all buffered message pairs to the database.
+        
+        Pairs that were not written are put back in the buffer, and retried on
+        the next flush.
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            batch_count, self._pending_count = self._pending_count, 0
+            self._flush_seq += 1
+            try:
+                failed = await self._run(self.sync_client.add_conversation_messages, batch)
+            except Exception as e:
+                logger.error(f"Failed to flush {batch_count} buffered messages: {e}")
+                failed = batch
+            if failed:
+                # Ahead of the pairs buffered during the write, to keep each conversation in order
+                for conversation_id, pairs in self._pending.items():
+                    failed.setdefault(conversation_id, []).extend(pairs)
+                self._pending = failed
+                self._pending_count = sum(len(pairs) for pairs in failed.values())
+    
+    async def _flush_periodically(self) -> None:
+        """Flush the write buffer every `flush_interval` seconds."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+    
+    async def get_conversation_history(
+        self, 
+        conversation_id: str, 
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Get the chat history for a conversation.
+        
+        Args:
+            conversation_id: ID of the conversation.
+            limit: If set to a positive number, only the last `limit` message
+                pairs are read.
+            
+        Returns:
+            List of message pairs.
+        """
+        if not self.write_behind:
+            return await self._run(self.sync_client.get_conversation_history, conversation_id, limit=limit)
+        
+        messages, buffered = await self._read_with_buffer(
+            self.sync_client.get_conversation_history, conversation_id, limit
+        )
+        messages = messages + buffered
+        return messages[-limit:] if limit and limit > 0 else messages
+    
+    async def get_conversation_window(
+        self, 
+        conversation_id: str, 
+        limit: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Get the rolling summary of a conversation and its turns not folded into it.
+        
+        Args:
+            conversation_id: ID of the conversation.
+            limit: If set to a positive number, only the last `limit` message
+                pairs are read.
+            
+        Returns:
+            Dictionary with the ``summary`` string and the ``messages`` not
+            summarized yet.
+        """
+        if not self.write_behind:
+            return await self._run(self.sync_client.get_conversation_window, conversation_id, limit=limit)
+        
+        window, buffered = await self._read_with_buffer(
+            self.sync_client.get_conversation_window, conversation_id, limit
+        )
+        messages = window["messages"] + buffered
+        window["messages"] = messages[-limit:] if limit and limit > 0 else messages
+        return window
+    
+    async def _read_with_buffer(
+        self, 
+        read: Callable[..., T], 
+        conversation_id: str, 
+        limit: Optional[int]
+    ) -> Tuple[T, List[Dict[str, Any]]]:
+        """Read stored history together with the pairs still buffered for it.
+        
+        The read is retried if a flush started meanwhile, so that no pair is
+        missed or returned twice.
+        """
+        while True:
+            async with self._flush_lock:
+                flush_seq = self._flush_seq
+                buffered = list(self._pending.get(conversation_id, []))
+            result = await self._run(read, conversation_id, limit=limit)
+            if flush_seq == self._flush_seq:
+                return result, buffered
+    
+    async def clear_conversation_history(self, conversation_id: str) -> None:
+        """Clear the chat history for a conversation.
+        
+        Args:
+            conversation_id: ID of the conversation.
+        """
+        async with self._flush_lock:
+            self._pending_count -= len(self._pending.pop(conversation_id, []))
+            await self._run(self.sync_client.clear_conversation_history, conversation_id)
+    
+    async def format_history(
+        self, 
+        conversation_id: str, 
+        limit: Optional[int] = None, 
+        token_budget: Optional[int] = None
+    ) -> str:
+        """Format the recent chat history for use in prompts.
+        
+        Args:
+            conversation_id: ID of the conversation.
+            limit: Number of most recent message pairs to include.
+                Defaults to `settings.history_window_size`.
+            token_budget: Maximum number of history tokens, see
+                `MongodbClient.window_messages`.
+            
+        Returns:
+            Formatted history string.
+        """
+        if limit is None:
+            limit = settings.history_window_size
+        if settings.history_summary_threshold is not None:
+            window = await self.get_conversation_window(conversation_id, limit=limit)
+            return MongodbClient.format_window(window, token_budget)
+        messages = await self.get_conversation_history(conversation_id, limit=limit)
+        return MongodbClient.format_messages(MongodbClient.window_messages(messages, token_budget))
+    
+    def fold_summary(
+        self, 
+        conversation_id: str, 
+        summarize: Callable[[str, str], str], 
+        keep_recent: int, 
+        threshold: int
+    ) -> bool:
+        """Fold the oldest pairs of a conversation into its rolling summary.
+        
+        Blocking, meant to run in a background summarizer thread, see
+        `MongodbClient.fold_summary`. Buffered pairs are folded once flushed.
+        """
+        return self.sync_client.fold_summary(conversation_id, summarize, keep_recent, threshold)
+    
+    async def aclose(self) -> None:
+        """Drain the write buffer, then release all resources."""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        await self.flush()
+        self.close()
+    
+    def close(self) -> None:
+        """Shut down the thread pool and close the MongoDB client connection.
+        
+        Buffered message pairs are not written, use `aclose` to drain them first.
+        """
+        self._executor.shutdown(wait=True)
+        self.sync_client.close()
@@ -14,7 +14,8 @@ from chatbot_backend.prompt import LLAMA_PROMPT, BOT_PERSONALITY
 
 if __name__ == "__main__":
     GGML_MODEL_PATH = os.environ["GGML_MODEL_PATH"]
-    config = Config()
+    # The 512 token context only leaves room for a short history, windowed by its token count
+    config = Config(memory_window_mode="tokens")
     callback_manager = CallbackManager([StreamingStdOutCallbackHandler()])
 
     partial_variables = {"personality": BOT_PERSONALITY}
@@ -1,4 +1,19 @@
+import importlib
+
+from common.conversation_store import ConversationStore, ShelveBackingStore
 from .base_memory import BaseChatbotMemory
 from .mongo_memory import MongoChatbotMemory
 from .custom_memory import CustomMongoChatbotMemory
 from .memory_types import MemoryTypes, MEM_TO_CLASS
+
+# Attributes backed by optional heavy dependencies (NumPy), imported on first access
+_LAZY_ATTRIBUTES = {
+    "RetrievalMongoChatbotMemory": ".retrieval_memory",
+    "TurnIndex": ".retrieval_memory"
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,13 +1,36 @@
+import asyncio
+import threading
 from typing import Optional
 
 from langchain.memory import ConversationBufferWindowMemory, ChatMessageHistory
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, get_buffer_string
 
 from common.config import BaseObject, Config
+from common.conversation_store import BackingStore, ConversationStore
 from common.objects import MessageTurn
+from common.summary import SUMMARY_PREFIX, BackgroundSummarizer
+from common.tokens import MESSAGE_OVERHEAD_TOKENS, budget_left, count_tokens, window_by_budget
+
+
+def chat_history_size(chat_history) -> int:
+    """Approximate size in bytes of the messages held by a chat history"""
+    return sum(len(message.content) for message in getattr(chat_history, "messages", []))
+
+
+def message_tokens(message: BaseMessage) -> int:
+    """Token count stored with a message when it was added, counted now for messages written before that"""
+    tokens = message.additional_kwargs.get("tokens")
+    if tokens is None:
+        tokens = count_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS
+    return tokens
 
 
 class BaseChatbotMemory(BaseObject):
     __slots__ = ["_base_memory", "_memory"]
+    # Whether the chat history class does network I/O, in which case async calls run it in a thread
+    blocking_io = False
+    # Whether old messages can be replaced by a summary in the chat history class
+    supports_summary = True
 
     def __init__(
             self,
@@ -15,6 +38,12 @@ class BaseChatbotMemory(BaseObject):
             chat_history_class=ChatMessageHistory,
             memory_class=ConversationBufferWindowMemory,
             chat_history_kwargs: Optional[dict] = None,
+            max_conversations: Optional[int] = None,
+            max_memory_bytes: Optional[int] = None,
+            conversation_ttl: Optional[float] = None,
+            backing_store: Optional[BackingStore] = None,
+            token_budget: Optional[int] = None,
+            summarizer: Optional[BackgroundSummarizer] = None,
             **kwargs
     ):
         """
@@ -22,6 +51,14 @@ class BaseChatbotMemory(BaseObject):
         :param config: Config object
         :param chat_history_class: LangChain's chat history class
         :param memory_class: LangChain's memory class
+        :param max_conversations: Maximum number of conversations kept in memory, defaults to config
+        :param max_memory_bytes: Maximum approximate size of kept conversations, defaults to config,
+            not applied to chat histories stored in a database
+        :param conversation_ttl: Seconds of inactivity before a conversation is dropped, defaults to config
+        :param backing_store: Optional store receiving evicted conversations
+        :param token_budget: Maximum number of history tokens returned, only the turn window applies if None
+        :param summarizer: Folds turns past the window into a rolling summary, once `memory_summary_threshold`
+            of them accumulate, turns past the window are dropped if None
         :param kwargs: Memory class kwargs
         """
         super().__init__()
@@ -30,7 +67,24 @@ class BaseChatbotMemory(BaseObject):
         self.chat_history_kwargs = chat_history_kwargs or {}
         self._base_memory_class = chat_history_class
         self._memory = memory_class(**self.params)
-        self._user_memory = dict()
+        self.token_budget = token_budget
+        self.summarizer = summarizer
+        if summarizer is not None and (not self.supports_summary or self.config.memory_summary_threshold is None):
+            self.logger.warning(f"{self.class_name()} does not keep rolling summaries, ignoring the summarizer")
+            self.summarizer = None
+        # Serializes writes with the swap of summarized messages, reads work on snapshots
+        self._write_lock = threading.Lock()
+        max_bytes = max_memory_bytes if max_memory_bytes is not None else self.config.memory_max_bytes
+        if self.blocking_io:
+            # Messages stay in the database, reading them all back to measure a conversation would cost a query
+            max_bytes = None
+        self._user_memory = ConversationStore(
+            max_entries=max_conversations if max_conversations is not None else self.config.memory_max_conversations,
+            max_bytes=max_bytes,
+            ttl=conversation_ttl if conversation_ttl is not None else self.config.memory_conversation_ttl,
+            size_func=chat_history_size if max_bytes is not None else None,
+            backing_store=backing_store
+        )
 
     @property
     def params(self):
@@ -52,20 +106,118 @@ class BaseChatbotMemory(BaseObject):
     def user_memory(self):
         return self._user_memory
 
+    @property
+    def stats(self):
+        return self._user_memory.stats()
+
     def clear(self, conversation_id: str):
-        if conversation_id in self.user_memory:
-            memory = self.user_memory.pop(conversation_id)
+        memory = self.user_memory.pop(conversation_id)
+        if memory is not None:
             memory.clear()
 
+    def get_chat_history(self, conversation_id: str):
+        return self.user_memory.get_or_create(conversation_id, lambda: self.new_chat_history(conversation_id))
+
+    def new_chat_history(self, conversation_id: str):
+        """Create the chat history object of a conversation"""
+        return self._base_memory_class(**self.chat_history_kwargs)
+
     def load_history(self, conversation_id: str) -> str:
-        if conversation_id not in self._user_memory:
-            memory = self._base_memory_class(**self.chat_history_kwargs)
-            self.memory.chat_memory = memory
-            self.user_memory[conversation_id] = memory
-            return ""
+        """
+        Return the last k turns of a conversation, capped to `token_budget` tokens when it is set,
+        after the summary of the older turns if there is one. The summary counts against the budget.
+        The window is computed from a snapshot of the conversation's messages, without touching
+        the shared memory object, so it is safe to call concurrently from many threads or tasks.
+        """
+        messages = list(self.get_chat_history(conversation_id).messages)
+        # Drop a turn that is still being written by a concurrent `add_message`
+        if messages and messages[-1].type == "human":
+            messages = messages[:-1]
+        summary = messages.pop(0) if messages and messages[0].type == "system" else None
 
-        self.memory.chat_memory = self.user_memory.get(conversation_id)
-        return self._memory.load_memory_variables({})["history"]
+        k = getattr(self.memory, "k", self.config.memory_window_size)
+        window = messages[-k * 2:] if k > 0 else []
+        if self.token_budget is not None:
+            turns = [window[i:i + 2] for i in range(0, len(window), 2)]
+            summary_line = f"{SUMMARY_PREFIX}{summary.content}" if summary is not None else None
+            budget = budget_left(self.token_budget, summary_line)
+            turns = window_by_budget(turns, budget, lambda turn: sum(map(message_tokens, turn)))
+            window = [message for turn in turns for message in turn]
+        if getattr(self.memory, "return_messages", False):
+            return [summary] + window if summary is not None else window
+        history = get_buffer_string(
+            window,
+            human_prefix=getattr(self.memory, "human_prefix", self.config.human_prefix),
+            ai_prefix=getattr(self.memory, "ai_prefix", self.config.ai_prefix)
+        )
+        if summary is None:
+            return history
+        return f"{SUMMARY_PREFIX}{summary.content}\n{history}".strip()
 
     def add_message(self, message_turn: MessageTurn):
-        pass
+        conversation_id = message_turn.conversation_id
+        memory = self.get_chat_history(conversation_id)
+        human_message = message_turn.human_message.message
+        ai_message = message_turn.ai_message.message
+        # Token counts are stored with the messages so that windowing never re-tokenizes the history
+        with self._write_lock:
+            memory.add_message(HumanMessage(
+                content=human_message,
+                additional_kwargs={"tokens": count_tokens(human_message) + MESSAGE_OVERHEAD_TOKENS}
+            ))
+            memory.add_message(AIMessage(
+                content=ai_message,
+                additional_kwargs={"tokens": count_tokens(ai_message) + MESSAGE_OVERHEAD_TOKENS}
+            ))
+        # Counted as the turn is appended, never by reading the whole history back
+        self.user_memory.resize(conversation_id, delta=len(human_message) + len(ai_message))
+        if self.summarizer is not None:
+            self.summarizer.schedule(conversation_id, lambda: self.fold_summary(conversation_id))
+
+    def fold_summary(self, conversation_id: str) -> bool:
+        """
+        Replace the turns past the window by a summary message, once `memory_summary_threshold` of them accumulate.
+        Calls the LLM, so it runs in the background summarizer. The messages are only swapped if the conversation
+        was not cleared or evicted meanwhile, turns added during the call are kept.
+        """
+        chat_history = self.user_memory.get(conversation_id)
+        if chat_history is None:
+            return False
+        messages = list(chat_history.messages)
+        summary = messages[0] if messages and messages[0].type == "system" else None
+        turns = messages[1:] if summary is not None else messages
+        k = getattr(self.memory, "k", self.config.memory_window_size)
+        # Whole turns only, a turn being written is never folded
+        count = (len(turns) - 2 * max(k, 0)) // 2 * 2
+        if count < 2 * max(self.config.memory_summary_threshold, 1):
+            return False
+
+        folded = turns[:count]
+        new_summary = self.summarizer.summarize(
+            summary.content if summary is not None else "",
+            get_buffer_string(
+                folded,
+                human_prefix=getattr(self.memory, "human_prefix", self.config.human_prefix),
+                ai_prefix=getattr(self.memory, "ai_prefix", self.config.ai_prefix)
+            )
+        )
+        prefix = messages[:len(messages) - len(turns) + count]
+        with self._write_lock:
+            current = chat_history.messages
+            if self.user_memory.get(conversation_id) is not chat_history or len(current) < len(prefix) \
+                    or any(a is not b for a, b in zip(current, prefix)):
+                return False
+            chat_history.messages = [SystemMessage(content=new_summary)] + current[len(prefix):]
+        self.user_memory.resize(conversation_id)
+        return True
+
+    async def aload_history(self, conversation_id: str) -> str:
+        if self.blocking_io:
+            return await asyncio.to_thread(self.load_history, conversation_id)
+        return self.load_history(conversation_id)
+
+    async def aadd_message(self, message_turn: MessageTurn):
+        if self.blocking_io:
+            await asyncio.to_thread(self.add_message, message_turn)
+        else:
+            self.add_message(message_turn)
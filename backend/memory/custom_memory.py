@@ -1,9 +1,47 @@
+import asyncio
 import json
-from typing import List
-from pymongo import MongoClient, errors
+from typing import List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import MongoClient, ASCENDING, DESCENDING, UpdateOne, errors
+from pymongo.collection import Collection
 
 from common.config import Config, BaseObject
 from common.objects import MessageTurn, messages_from_dict
+from common.summary import SUMMARY_PREFIX, BackgroundSummarizer
+from common.tokens import budget_left, count_turn_tokens, window_by_budget
+
+# Only the parts of a stored turn needed to build the prompt history
+HISTORY_PROJECTION = {
+    "History.human_message.role": 1,
+    "History.human_message.message": 1,
+    "History.ai_message.role": 1,
+    "History.ai_message.message": 1,
+    "Tokens": 1,
+}
+
+
+def migrate_history_encoding(collection: Collection, batch_size: int = 1000) -> int:
+    """
+    Convert turns stored as JSON strings into native BSON sub-documents
+    :param collection: Collection used by the custom memory
+    :param batch_size: Number of documents read and rewritten per round trip
+    :return: Number of converted documents
+    """
+    converted = 0
+    operations = []
+    cursor = collection.find({"History": {"$type": "string"}}, {"History": 1}).batch_size(batch_size)
+    for document in cursor:
+        operations.append(UpdateOne(
+            {"_id": document["_id"], "History": {"$type": "string"}},
+            {"$set": {"History": json.loads(document["History"])}}
+        ))
+        if len(operations) >= batch_size:
+            converted += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        converted += collection.bulk_write(operations, ordered=False).modified_count
+    return converted
 
 
 class BaseCustomMongoChatbotMemory(BaseObject):
@@ -15,6 +53,9 @@ class BaseCustomMongoChatbotMemory(BaseObject):
             database_name: str = None,
             collection_name: str = None,
             k: int = 5,
+            token_budget: int = None,
+            summarizer: Optional[BackgroundSummarizer] = None,
+            client: Optional[MongoClient] = None,
             **kwargs
     ):
         super(BaseCustomMongoChatbotMemory, self).__init__()
@@ -25,29 +66,45 @@ class BaseCustomMongoChatbotMemory(BaseObject):
         self.database_name = database_name
         self.collection_name = collection_name
 
+        # A pre-built client, e.g. a `mongomock.MongoClient` for benchmarks, is used as is
         try:
-            self.client: MongoClient = MongoClient(connection_string)
+            self.client: MongoClient = client if client is not None else MongoClient(connection_string)
         except errors.ConnectionFailure as error:
             self.logger.error(error)
 
         self.db = self.client[database_name]
         self.collection = self.db[collection_name]
-        self.collection.create_index("SessionId")
+        # Serves both per-session deletes and "latest k turns of a conversation" reads;
+        # `_id` is an ObjectId, so it follows insertion order
+        self.collection.create_index([("SessionId", ASCENDING), ("ConversationId", ASCENDING), ("_id", DESCENDING)])
         self.k = k
-
-    def add_message(self, message_turn: MessageTurn):
+        self.token_budget = token_budget
+        # Rolling summaries of the turns past the window, one document per conversation
+        self.summarizer = summarizer if self.config.memory_summary_threshold is not None else None
+        self.summaries = self.db[f"{collection_name}_summaries"]
+        if self.summarizer is not None:
+            self.summaries.create_index([("SessionId", ASCENDING), ("ConversationId", ASCENDING)], unique=True)
+
+    def add_message(self, message_turn: MessageTurn) -> Optional[ObjectId]:
+        """Store a turn, return its id or None if the write failed"""
         conversation_id = message_turn.conversation_id
         try:
             self.logger.info(f"Save 1 message turn of conversation <{conversation_id}>")
-            self.collection.insert_one(
+            result = self.collection.insert_one(
                 {
                     "ConversationId": conversation_id,
                     "SessionId": self.session_id,
-                    "History": json.dumps(message_turn.dict(), ensure_ascii=False),
+                    "History": message_turn.dict(),
+                    # Read back by token-budget windowing, so that loading never re-tokenizes the history
+                    "Tokens": count_turn_tokens(message_turn.human_message.message, message_turn.ai_message.message),
                 }
             )
         except errors.WriteError as err:
             self.logger.error(err)
+            return None
+        if self.summarizer is not None:
+            self.summarizer.schedule(conversation_id, lambda: self.fold_summary(conversation_id))
+        return result.inserted_id
 
     def clear_history(self, conversation_id: str = None):
         try:
@@ -55,28 +112,110 @@ class BaseCustomMongoChatbotMemory(BaseObject):
             if conversation_id is None:
                 self.logger.warning(f"You are deleting all collection with session: {self.session_id}")
                 self.collection.delete_many({"SessionId": self.session_id})
+                self.summaries.delete_many({"SessionId": self.session_id})
             else:
                 self.collection.delete_many({"SessionId": self.session_id, "ConversationId": conversation_id})
+                self.summaries.delete_many({"SessionId": self.session_id, "ConversationId": conversation_id})
         except errors.WriteError as err:
             self.logger.error(err)
 
     def load_history(self, conversation_id: str) -> str:
-        """Retrieve the messages from MongoDB"""
-        from pymongo import errors
-        cursor = None
+        """
+        Retrieve the last k messages from MongoDB (all of them if k is 0),
+        capped to `token_budget` tokens when it is set, after the summary of the older ones if there is one,
+        which counts against the budget
+        """
+        summary, documents = self._load_recent_turns(conversation_id)
+        return self._format_history(summary, documents)
+
+    def _load_recent_turns(self, conversation_id: str) -> Tuple[Optional[dict], List[dict]]:
+        """Return the summary document of a conversation, if any, and its last k turns newer than it, oldest first"""
+        documents = []
+        summary = None
         try:
-            cursor = self.collection.find({"SessionId": self.session_id, "ConversationId": conversation_id})
+            query = {"SessionId": self.session_id, "ConversationId": conversation_id}
+            if self.summarizer is not None:
+                summary = self.summaries.find_one(query, {"Summary": 1, "SummarizedUntil": 1})
+                if summary is not None:
+                    query["_id"] = {"$gt": summary["SummarizedUntil"]}
+            cursor = self.collection.find(query, HISTORY_PROJECTION).sort("_id", DESCENDING).limit(self.k)
+            documents = list(cursor)
+            self._load_legacy_turns(documents)
         except errors.OperationFailure as error:
             self.logger.error(error)
+        documents.reverse()
+        return summary, documents
 
-        if cursor:
-            items = [json.loads(document["History"]) for document in cursor][-self.k:]
-        else:
-            items = []
+    def _format_history(self, summary: Optional[dict], documents: List[dict]) -> str:
+        summary_line = f"{SUMMARY_PREFIX}{summary['Summary']}" if summary is not None else None
+        if self.token_budget is not None:
+            documents = window_by_budget(documents, budget_left(self.token_budget, summary_line), self._turn_tokens)
+        items = [document["History"] for document in documents]
 
         messages: List[str] = [messages_from_dict(item) for item in items]
+        if summary_line is not None:
+            messages.insert(0, summary_line)
         return "\n".join(messages)
 
+    def fold_summary(self, conversation_id: str) -> bool:
+        """
+        Fold the turns past the last k into the conversation's summary, once `memory_summary_threshold`
+        of them accumulate. Calls the LLM, so it runs in the background summarizer. The summary is only
+        written if no other fold updated it meanwhile.
+        """
+        query = {"SessionId": self.session_id, "ConversationId": conversation_id}
+        state = self.summaries.find_one(query, {"Summary": 1, "SummarizedUntil": 1}) or {}
+        until = state.get("SummarizedUntil")
+        turn_query = dict(query, _id={"$gt": until}) if until is not None else query
+        ids = [document["_id"] for document in self.collection.find(turn_query, {"_id": 1}).sort("_id", ASCENDING)]
+        count = len(ids) - max(self.k, 0)
+        if count < max(self.config.memory_summary_threshold, 1):
+            return False
+
+        documents = list(self.collection.find({"_id": {"$in": ids[:count]}}, HISTORY_PROJECTION).sort("_id", ASCENDING))
+        self._load_legacy_turns(documents)
+        summary = self.summarizer.summarize(
+            state.get("Summary", ""),
+            "\n".join(messages_from_dict(document["History"]) for document in documents)
+        )
+        try:
+            self.summaries.update_one(
+                dict(query, SummarizedUntil=until),
+                {"$set": {"Summary": summary, "SummarizedUntil": ids[count - 1]}},
+                upsert=True
+            )
+        except errors.DuplicateKeyError:
+            # Another fold got there first
+            return False
+        if self.collection.find_one({"_id": ids[count - 1]}, {"_id": 1}) is None:
+            # Cleared while the summary was written
+            self.summaries.delete_one(dict(query, SummarizedUntil=ids[count - 1]))
+            return False
+        return True
+
+    @staticmethod
+    def _turn_tokens(document: dict) -> int:
+        """Token count stored with a turn, counted now for turns written before it was stored"""
+        tokens = document.get("Tokens")
+        if tokens is None:
+            history = document["History"]
+            tokens = count_turn_tokens(history["human_message"]["message"], history["ai_message"]["message"])
+        return tokens
+
+    def _load_legacy_turns(self, documents: List[dict]):
+        """Fill in turns still stored as JSON strings, which the sub-field projection leaves out"""
+        legacy_ids = [document["_id"] for document in documents if "History" not in document]
+        if not legacy_ids:
+            return
+        self.logger.warning(f"Found {len(legacy_ids)} JSON-encoded turns, run `python -m memory.migrate` to convert them")
+        legacy = {
+            document["_id"]: json.loads(document["History"])
+            for document in self.collection.find({"_id": {"$in": legacy_ids}}, {"History": 1})
+        }
+        for document in documents:
+            if "History" not in document:
+                document["History"] = legacy[document["_id"]]
+
 
 class CustomMongoChatbotMemory(BaseObject):
     def __init__(self, config: Config = None, **kwargs):
@@ -97,3 +236,9 @@ class CustomMongoChatbotMemory(BaseObject):
 
     def add_message(self, message_turn: MessageTurn):
         self.memory.add_message(message_turn)
+
+    async def aload_history(self, conversation_id: str):
+        return await asyncio.to_thread(self.memory.load_history, conversation_id)
+
+    async def aadd_message(self, message_turn: MessageTurn):
+        await asyncio.to_thread(self.memory.add_message, message_turn)
@@ -1,5 +1,6 @@
 from enum import Enum
-from memory import MongoChatbotMemory, BaseChatbotMemory, CustomMongoChatbotMemory
+
+from common.lazy import LazyMapping
 
 
 class MemoryTypes(str, Enum):
@@ -7,10 +8,13 @@ class MemoryTypes(str, Enum):
     BASE_MEMORY = "base-memory"
     MONGO_MEMORY = "mongodb-memory"
     CUSTOM_MEMORY = "custom-memory"
+    RETRIEVAL_MEMORY = "retrieval-memory"
 
 
-MEM_TO_CLASS = {
-    "mongodb-memory": MongoChatbotMemory,
-    "base-memory": BaseChatbotMemory,
-    "custom-memory": CustomMongoChatbotMemory
-}
+# Memory classes are only imported once their type is used, the retrieval memory loads NumPy
+MEM_TO_CLASS = LazyMapping({
+    "mongodb-memory": "memory.mongo_memory:MongoChatbotMemory",
+    "base-memory": "memory.base_memory:BaseChatbotMemory",
+    "custom-memory": "memory.custom_memory:CustomMongoChatbotMemory",
+    "retrieval-memory": "memory.retrieval_memory:RetrievalMongoChatbotMemory"
+})
@@ -0,0 +1,37 @@
+"""
+Convert custom memory turns stored as JSON strings into native BSON documents.
+
+Usage (from the backend directory):
+    python -m memory.migrate --batch-size 1000
+"""
+import argparse
+import logging
+import os
+
+from pymongo import MongoClient
+
+from common.common_keys import MONGO_CONNECTION_STRING, MONGO_DATABASE, MONGO_COLLECTION
+from memory.custom_memory import migrate_history_encoding
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connection-string", default=os.getenv(MONGO_CONNECTION_STRING))
+    parser.add_argument("--database", default=os.getenv(MONGO_DATABASE, "langchain_bot"))
+    parser.add_argument("--collection", default=os.getenv(MONGO_COLLECTION, "chatbot"))
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    client = MongoClient(args.connection_string)
+    try:
+        converted = migrate_history_encoding(client[args.database][args.collection], batch_size=args.batch_size)
+        logger.info(f"Converted {converted} turns in {args.database}.{args.collection}")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
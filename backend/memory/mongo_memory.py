@@ -8,6 +8,10 @@ logger = logging.getLogger(__name__)
 
 
 class MongoChatbotMemory(BaseChatbotMemory):
+    blocking_io = True
+    # MongoDB chat histories cannot replace their messages by a summary
+    supports_summary = False
+
     def __init__(self, config: Config = None, **kwargs):
         config = config if config is not None else Config()
         super(MongoChatbotMemory, self).__init__(
@@ -18,5 +22,19 @@ class MongoChatbotMemory(BaseChatbotMemory):
                 "session_id": config.session_id,
                 "database_name": config.memory_database_name,
                 "collection_name": config.memory_collection_name
-            }
+            },
+            token_budget=kwargs.get("token_budget"),
+            summarizer=kwargs.get("summarizer")
         )
+
+    def new_chat_history(self, conversation_id: str):
+        # One MongoDB session per conversation, so that conversations never read each other's messages
+        return self._base_memory_class(**{
+            **self.chat_history_kwargs,
+            "session_id": f"{self.chat_history_kwargs['session_id']}:{conversation_id}"
+        })
+
+    def clear(self, conversation_id: str):
+        # The messages stay in MongoDB once the conversation is evicted from memory
+        self.user_memory.pop(conversation_id)
+        self.new_chat_history(conversation_id).clear()
@@ -0,0 +1,304 @@
+import asyncio
+import threading
+import zlib
+from typing import Hashable, Iterable, List, Optional, Sequence
+
+import numpy as np
+from bson import Binary, ObjectId
+from pymongo import ASCENDING, errors
+
+from common.config import BaseObject, Config
+from common.conversation_store import ConversationStore
+from common.objects import MessageTurn, messages_from_dict
+from memory.custom_memory import BaseCustomMongoChatbotMemory, HISTORY_PROJECTION
+from utils.embeddings import HashingEmbedding, as_embedding_function, embed_texts
+
+# Conversations whose index is being loaded or extended share one of these locks
+_LOCK_STRIPES = 64
+
+
+class TurnIndex:
+    """
+    Embeddings of the turns of one conversation, as L2-normalized float32 rows so that a dot product is the cosine
+    similarity. Rows live in a buffer that doubles when full, so that adding a turn never copies the whole index.
+    """
+
+    def __init__(self, dim: int, turn_ids: Sequence[ObjectId] = (), vectors: Optional[np.ndarray] = None):
+        self.dim = dim
+        self.turn_ids: List[ObjectId] = []
+        self._known = set()
+        self._vectors = np.zeros((max(len(turn_ids), 16), dim), dtype=np.float32)
+        for turn_id, vector in zip(turn_ids, vectors if vectors is not None else []):
+            self.add(turn_id, vector)
+
+    def __len__(self):
+        return len(self.turn_ids)
+
+    def __contains__(self, turn_id: Hashable) -> bool:
+        return turn_id in self._known
+
+    @property
+    def nbytes(self) -> int:
+        return self._vectors.nbytes
+
+    def add(self, turn_id: ObjectId, vector: np.ndarray) -> bool:
+        """Append the vector of a turn, return False if the turn is already indexed"""
+        if turn_id in self._known:
+            return False
+        size = len(self.turn_ids)
+        if size == len(self._vectors):
+            grown = np.zeros((2 * size, self.dim), dtype=np.float32)
+            grown[:size] = self._vectors
+            self._vectors = grown
+        self._vectors[size] = vector
+        self.turn_ids.append(turn_id)
+        self._known.add(turn_id)
+        return True
+
+    def search(
+            self,
+            query: np.ndarray,
+            top_m: int,
+            exclude: Iterable[Hashable] = (),
+            min_similarity: float = 0.0
+    ) -> List[ObjectId]:
+        """Return the ids of the `top_m` turns most similar to `query`, most similar first"""
+        size = len(self.turn_ids)
+        if size == 0 or top_m <= 0:
+            return []
+        scores = self._vectors[:size] @ query
+        for position, turn_id in enumerate(self.turn_ids):
+            if turn_id in exclude:
+                scores[position] = -np.inf
+        top_m = min(top_m, size)
+        best = np.argpartition(-scores, top_m - 1)[:top_m]
+        best = best[np.argsort(-scores[best])]
+        return [self.turn_ids[position] for position in best if scores[position] >= min_similarity]
+
+
+class BaseRetrievalMongoChatbotMemory(BaseCustomMongoChatbotMemory):
+    """
+    Custom Mongo memory that sends the last k turns plus the `top_m` older turns most relevant to the current input,
+    so that prompts stay small in long conversations while facts from far back can still be recalled.
+    Each turn is embedded when it is stored. The vectors of a conversation are appended to one document of a
+    side collection, and are loaded into an in-memory `TurnIndex` on the first retrieval in that conversation.
+    With 256-dimensional vectors, that document holds about 16 000 turns before reaching the MongoDB size limit.
+    """
+
+    def __init__(
+            self,
+            config: Config = None,
+            top_m: int = None,
+            min_similarity: float = None,
+            embedding=None,
+            **kwargs
+    ):
+        """
+        :param top_m: Number of relevant older turns retrieved, defaults to config
+        :param min_similarity: Minimum cosine similarity of a retrieved turn to the input, defaults to config
+        :param embedding: Callable embedding a list of texts, or a LangChain `Embeddings`,
+            defaults to the local `HashingEmbedding`
+        :param kwargs: `BaseCustomMongoChatbotMemory` kwargs
+        """
+        super(BaseRetrievalMongoChatbotMemory, self).__init__(config=config, **kwargs)
+        self.top_m = top_m if top_m is not None else self.config.memory_retrieval_top_m
+        self.min_similarity = min_similarity if min_similarity is not None \
+            else self.config.memory_retrieval_min_similarity
+        self.embedding_function = as_embedding_function(embedding if embedding is not None else HashingEmbedding())
+        self.vectors = self.db[f"{self.collection_name}_vectors"]
+        self.vectors.create_index([("SessionId", ASCENDING), ("ConversationId", ASCENDING)], unique=True)
+        self._embedding_dim: Optional[int] = None
+        self._indexes = self._new_index_store()
+        self._locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+
+    def _new_index_store(self) -> ConversationStore:
+        # Indexes are bounded like the in-memory conversations, and simply reloaded after eviction
+        return ConversationStore(
+            max_entries=self.config.memory_max_conversations,
+            max_bytes=self.config.memory_max_bytes,
+            ttl=self.config.memory_conversation_ttl,
+            size_func=lambda index: index.nbytes
+        )
+
+    def _lock(self, conversation_id: str) -> threading.Lock:
+        return self._locks[zlib.crc32(conversation_id.encode("utf-8")) % _LOCK_STRIPES]
+
+    def _query(self, conversation_id: str) -> dict:
+        return {"SessionId": self.session_id, "ConversationId": conversation_id}
+
+    def add_message(self, message_turn: MessageTurn) -> Optional[ObjectId]:
+        turn_id = super(BaseRetrievalMongoChatbotMemory, self).add_message(message_turn)
+        if turn_id is None:
+            return None
+        conversation_id = message_turn.conversation_id
+        vector = self._embed([messages_from_dict(message_turn.dict())])[0]
+        # Under the lock, so that a concurrent rebuild of the index does not overwrite the vector
+        with self._lock(conversation_id):
+            try:
+                self._push_vectors(conversation_id, [turn_id], vector[None, :])
+            except errors.PyMongoError as err:
+                # The turn is indexed again when the conversation's index is next loaded, see `_load_index`
+                self.logger.error(err)
+            # Indexes not loaded yet read the vector from the database on first access
+            index = self._indexes.get(conversation_id)
+            if index is not None and len(vector) == index.dim:
+                index.add(turn_id, vector)
+                self._indexes.resize(conversation_id)
+        return turn_id
+
+    def _push_vectors(self, conversation_id: str, turn_ids: List[ObjectId], vectors: np.ndarray):
+        """Append vectors to the conversation's document, unless a rebuild already stored the first turn"""
+        try:
+            self.vectors.update_one(
+                dict(self._query(conversation_id), TurnIds={"$ne": turn_ids[0]}),
+                {
+                    "$push": {
+                        "TurnIds": {"$each": turn_ids},
+                        "Vectors": {"$each": [Binary(vector.tobytes()) for vector in vectors]}
+                    },
+                    "$setOnInsert": {"Dim": vectors.shape[1]}
+                },
+                upsert=True
+            )
+        except errors.DuplicateKeyError:
+            # The document exists and holds the turn, the upsert hit the unique index
+            pass
+
+    def clear_history(self, conversation_id: str = None):
+        super(BaseRetrievalMongoChatbotMemory, self).clear_history(conversation_id=conversation_id)
+        try:
+            if conversation_id is None:
+                self.vectors.delete_many({"SessionId": self.session_id})
+            else:
+                self.vectors.delete_many(self._query(conversation_id))
+        except errors.WriteError as err:
+            self.logger.error(err)
+        if conversation_id is None:
+            self._indexes = self._new_index_store()
+        else:
+            with self._lock(conversation_id):
+                self._indexes.pop(conversation_id)
+
+    def get_index(self, conversation_id: str) -> TurnIndex:
+        """Return the index of a conversation, loading it from the database on first access"""
+        index = self._indexes.get(conversation_id)
+        if index is not None:
+            return index
+        with self._lock(conversation_id):
+            index = self._indexes.get(conversation_id)
+            if index is None:
+                index = self._load_index(conversation_id)
+                self._indexes.set(conversation_id, index)
+        return index
+
+    def _load_index(self, conversation_id: str) -> TurnIndex:
+        document = self.vectors.find_one(self._query(conversation_id)) or {}
+        turn_ids = document.get("TurnIds", [])
+        dim = document.get("Dim")
+        if not turn_ids or dim != self.embedding_dim:
+            return self._rebuild_index(conversation_id)
+        vectors = np.frombuffer(b"".join(document["Vectors"]), dtype=np.float32).reshape(len(turn_ids), dim)
+        index = TurnIndex(dim, turn_ids, vectors)
+        self._index_missing_turns(conversation_id, index)
+        return index
+
+    def _index_missing_turns(self, conversation_id: str, index: TurnIndex):
+        """Embed the stored turns whose vector is not in the index, e.g. because writing it failed"""
+        stored = self.collection.find(self._query(conversation_id), {"_id": 1}).sort("_id", ASCENDING)
+        missing = [document["_id"] for document in stored if document["_id"] not in index]
+        if not missing:
+            return
+        documents = list(self.collection.find({"_id": {"$in": missing}}, HISTORY_PROJECTION).sort("_id", ASCENDING))
+        self._load_legacy_turns(documents)
+        turn_ids = [document["_id"] for document in documents]
+        vectors = self._embed([messages_from_dict(document["History"]) for document in documents])
+        for turn_id, vector in zip(turn_ids, vectors):
+            index.add(turn_id, vector)
+        self.logger.info(f"Indexed {len(turn_ids)} missing turns of conversation <{conversation_id}>")
+        try:
+            self._push_vectors(conversation_id, turn_ids, vectors)
+        except errors.PyMongoError as err:
+            self.logger.error(err)
+
+    def _rebuild_index(self, conversation_id: str) -> TurnIndex:
+        """Embed every stored turn of a conversation, for turns written before it had an index or another embedding"""
+        documents = list(self.collection.find(self._query(conversation_id), HISTORY_PROJECTION).sort("_id", ASCENDING))
+        self._load_legacy_turns(documents)
+        turn_ids = [document["_id"] for document in documents]
+        vectors = self._embed([messages_from_dict(document["History"]) for document in documents])
+        index = TurnIndex(self.embedding_dim, turn_ids, vectors)
+        if turn_ids:
+            self.logger.info(f"Indexed {len(turn_ids)} turns of conversation <{conversation_id}>")
+        self.vectors.replace_one(
+            self._query(conversation_id),
+            dict(
+                self._query(conversation_id),
+                TurnIds=turn_ids,
+                Vectors=[Binary(vector.tobytes()) for vector in vectors],
+                Dim=index.dim
+            ),
+            upsert=True
+        )
+        return index
+
+    @property
+    def embedding_dim(self) -> int:
+        if self._embedding_dim is None:
+            self._embedding_dim = self._embed(["dimension"]).shape[1]
+        return self._embedding_dim
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        # A conversation without turns yet is not passed to the embedding
+        return embed_texts(self.embedding_function, texts, dim=self.embedding_dim if not texts else 0)
+
+    def load_history(self, conversation_id: str, query: Optional[str] = None) -> str:
+        """
+        Retrieve the last k turns and, when `query` is given, the `top_m` older turns most similar to it,
+        in conversation order
+        """
+        summary, documents = self._load_recent_turns(conversation_id)
+        if query and self.top_m > 0:
+            recent = {document["_id"] for document in documents}
+            turn_ids = self.get_index(conversation_id).search(
+                self._embed([query])[0],
+                self.top_m,
+                exclude=recent,
+                min_similarity=self.min_similarity
+            )
+            if turn_ids:
+                relevant = list(self.collection.find({"_id": {"$in": turn_ids}}, HISTORY_PROJECTION))
+                self._load_legacy_turns(relevant)
+                documents = sorted(relevant + documents, key=lambda document: document["_id"])
+        return self._format_history(summary, documents)
+
+
+class RetrievalMongoChatbotMemory(BaseObject):
+    # The bot passes the current input, used to retrieve the relevant turns
+    retrieves_by_input = True
+
+    def __init__(self, config: Config = None, **kwargs):
+        super(RetrievalMongoChatbotMemory, self).__init__()
+        config = config if config is not None else Config()
+        self.memory = BaseRetrievalMongoChatbotMemory(
+            config=config,
+            connection_string=config.memory_connection_string,
+            session_id=config.session_id,
+            database_name=config.memory_database_name,
+            collection_name=config.memory_collection_name,
+            **kwargs
+        )
+
+    def clear(self, conversation_id: str = None):
+        self.memory.clear_history(conversation_id=conversation_id)
+
+    def load_history(self, conversation_id: str, query: Optional[str] = None):
+        return self.memory.load_history(conversation_id, query=query)
+
+    def add_message(self, message_turn: MessageTurn):
+        self.memory.add_message(message_turn)
+
+    async def aload_history(self, conversation_id: str, query: Optional[str] = None):
+        return await asyncio.to_thread(self.memory.load_history, conversation_id, query)
+
+    async def aadd_message(self, message_turn: MessageTurn):
+        await asyncio.to_thread(self.memory.add_message, message_turn)
@@ -1,6 +1,6 @@
 from enum import Enum
-from langchain.chat_models import ChatVertexAI, ChatOpenAI
-from langchain.llms import LlamaCpp
+
+from common.lazy import LazyMapping
 
 
 class ModelTypes(str, Enum):
@@ -9,8 +9,9 @@ class ModelTypes(str, Enum):
     LLAMA_CPP = "LLAMA-CPP"
 
 
-MODEL_TO_CLASS = {
-    "OPENAI": ChatOpenAI,
-    "VERTEX": ChatVertexAI,
-    "LLAMA-CPP": LlamaCpp
-}
+# Model classes are only imported once their type is used
+MODEL_TO_CLASS = LazyMapping({
+    "OPENAI": "langchain.chat_models:ChatOpenAI",
+    "VERTEX": "langchain.chat_models:ChatVertexAI",
+    "LLAMA-CPP": "langchain.llms:LlamaCpp"
+})
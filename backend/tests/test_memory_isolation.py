@@ -0,0 +1,140 @@
+"""
+Stress test that concurrent requests never see each other's history.
+Many threads add turns to and load the history of a set of conversations at the same time, starting from
+conversations that do not exist yet so that first requests race on their creation. Every message is tagged with
+its conversation, and the test fails when a loaded history contains another conversation's message, when a window
+is not the latest turns in order, or when a turn was lost.
+"""
+import random
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import pytest
+from langchain_core.messages import messages_from_dict, message_to_dict
+
+from common.config import Config, Singleton
+from common.objects import Message, MessageTurn
+from memory.base_memory import BaseChatbotMemory
+
+TAG = re.compile(r"<(c\d+):(\d+)>")
+THREADS = 32
+CONVERSATIONS = 20
+TURNS = 10
+WINDOW = 3
+
+
+class MongomockChatMessageHistory:
+    """
+    Stand-in for `MongoDBChatMessageHistory` on a mongomock collection: every instance stores its messages under
+    its session id and reads them back from the collection, as the real one does.
+    """
+    # mongomock is not thread-safe
+    _lock = threading.Lock()
+
+    def __init__(self, connection_string: str, session_id: str, database_name: str, collection_name: str):
+        self.session_id = session_id
+        self.collection = MongomockChatMessageHistory.client[database_name][collection_name]
+
+    @property
+    def messages(self):
+        with self._lock:
+            documents = list(self.collection.find({"SessionId": self.session_id}).sort("_id", 1))
+        return messages_from_dict([document["History"] for document in documents])
+
+    def add_message(self, message):
+        with self._lock:
+            self.collection.insert_one({"SessionId": self.session_id, "History": message_to_dict(message)})
+
+    def clear(self):
+        with self._lock:
+            self.collection.delete_many({"SessionId": self.session_id})
+
+
+def turn(conversation_id: str, index: int) -> MessageTurn:
+    return MessageTurn(
+        human_message=Message(message=f"question <{conversation_id}:{index}>", role="Human"),
+        ai_message=Message(message=f"answer <{conversation_id}:{index}>", role="AI"),
+        conversation_id=conversation_id
+    )
+
+
+def check_window(conversation_id: str, history: str, k: int) -> List[str]:
+    """Return the problems found in one loaded history"""
+    problems = []
+    tags = TAG.findall(history)
+    strangers = {owner for owner, _ in tags if owner != conversation_id}
+    if strangers:
+        problems.append(f"{conversation_id} saw messages of {sorted(strangers)}")
+    # Each turn appears twice, question then answer, and turns are consecutive
+    indexes = [int(index) for owner, index in tags if owner == conversation_id]
+    turns = indexes[::2]
+    if indexes[1::2] != turns:
+        problems.append(f"{conversation_id} has a question without its answer: {indexes}")
+    if len(turns) > k or turns != (list(range(turns[0], turns[0] + len(turns))) if turns else []):
+        problems.append(f"{conversation_id} window is not consecutive turns in order: {turns}")
+    return problems
+
+
+def in_memory():
+    return BaseChatbotMemory(config=Config())
+
+
+def mongo():
+    mongomock = pytest.importorskip("mongomock")
+    from memory.mongo_memory import MongoChatbotMemory
+
+    MongomockChatMessageHistory.client = mongomock.MongoClient()
+    memory = MongoChatbotMemory(config=Config())
+    memory._base_memory_class = MongomockChatMessageHistory
+    return memory
+
+
+@pytest.fixture(params=[in_memory, mongo], ids=["in_memory", "mongo"])
+def memory(request, monkeypatch):
+    monkeypatch.setattr(Config(), "memory_window_size", WINDOW)
+    monkeypatch.setattr(Config(), "memory_connection_string", "mongodb://localhost")
+    # Memories are singletons, each test gets new ones
+    monkeypatch.setattr(Singleton, "_instances", {
+        cls: instance for cls, instance in Singleton._instances.items() if not issubclass(cls, BaseChatbotMemory)
+    })
+    return request.param()
+
+
+def test_concurrent_conversations_never_see_each_other(memory):
+    conversation_ids = [f"c{i}" for i in range(CONVERSATIONS)]
+    # One writer per conversation at a time, as the admission controller guarantees, but any number of readers
+    writers = {conversation_id: threading.Lock() for conversation_id in conversation_ids}
+    written = {conversation_id: 0 for conversation_id in conversation_ids}
+    problems: List[str] = []
+
+    def worker(seed: int):
+        rng = random.Random(seed)
+        while True:
+            conversation_id = rng.choice(conversation_ids)
+            if rng.random() < 0.5 and writers[conversation_id].acquire(blocking=False):
+                try:
+                    if written[conversation_id] < TURNS:
+                        memory.add_message(turn(conversation_id, written[conversation_id]))
+                        written[conversation_id] += 1
+                finally:
+                    writers[conversation_id].release()
+            found = check_window(conversation_id, memory.load_history(conversation_id), WINDOW)
+            if found:
+                problems.extend(found)
+                return
+            if all(count >= TURNS for count in written.values()):
+                return
+
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        for future in [executor.submit(worker, i) for i in range(THREADS)]:
+            future.result()
+    assert problems == []
+
+    # Nothing written may be missing once every writer is done
+    for conversation_id in conversation_ids:
+        assert len(memory.get_chat_history(conversation_id).messages) == 2 * TURNS
+        expected = [f"<{conversation_id}:{i}>" for i in range(TURNS - WINDOW, TURNS)]
+        tags = [f"<{owner}:{index}>" for owner, index in TAG.findall(memory.load_history(conversation_id))[::2]]
+        assert tags == expected
@@ -0,0 +1,105 @@
+"""
+The PII pre-filter must never skip a message Presidio would change. The recall check runs the real anonymizer
+over a generated corpus of clean chat messages, messages with entities the pre-filter screens, and near-misses
+(digits, '*', identifier-like words), and is skipped when Presidio or its English model is not installed.
+"""
+import random
+import string
+from typing import List
+
+import pytest
+
+from utils.pii_filter import ENTITY_SCREENS, PIIPreFilter
+
+CLEAN_MESSAGES = [
+    "Hello, how are you today?",
+    "Can you recommend a good book about history?",
+    "What's the weather like in Hanoi this week?",
+    "Tell me a joke about programmers.",
+    "Xin chào, bạn có khỏe không?",
+    "I need help writing an email to my manager.",
+]
+
+ENTITY_TEMPLATES = [
+    "My SSN is {ssn}, please update my file.",
+    "ITIN: {itin}",
+    "Transfer to account {bank} today.",
+    "Passport number {passport} expires soon.",
+    "Driver license {license} was suspended.",
+    "Write to {word}.{word}@example.com about it.",
+    "Charge the card {card} please.",
+    "Call me at ({digits3}) {digits3}-{digits4}.",
+    "The server is at 192.168.{octet}.{octet}.",
+    "Here it is: {digits}",
+    "Reference {word}{digits} and {word}*{word}",
+]
+
+ENGLISH_CONFIG = {"nlp_engine_name": "spacy", "models": [{"lang_code": "en", "model_name": "en_core_web_md"}]}
+
+
+def _digits(rng: random.Random, low: int, high: int) -> str:
+    return "".join(rng.choice(string.digits) for _ in range(rng.randint(low, high)))
+
+
+def generate(rng: random.Random, samples: int) -> List[str]:
+    messages = list(CLEAN_MESSAGES)
+    for _ in range(samples):
+        if rng.random() < 0.4:
+            message = rng.choice(CLEAN_MESSAGES)
+            # Identifier-like words without digits, e.g. upper-case tokens
+            message += " " + "".join(rng.choice(string.ascii_letters) for _ in range(rng.randint(1, 14)))
+        else:
+            message = rng.choice(ENTITY_TEMPLATES).format(
+                ssn=f"{_digits(rng, 3, 3)}-{_digits(rng, 2, 2)}-{_digits(rng, 4, 4)}",
+                itin=f"9{_digits(rng, 2, 2)}-7{_digits(rng, 1, 1)}-{_digits(rng, 4, 4)}",
+                bank=_digits(rng, 8, 17),
+                passport=rng.choice(["", rng.choice(string.ascii_uppercase)]) + _digits(rng, 8, 9),
+                license=rng.choice(string.ascii_uppercase) + _digits(rng, 1, 12),
+                card="4111 1111 1111 1111",
+                digits3=_digits(rng, 3, 3),
+                digits4=_digits(rng, 4, 4),
+                octet=rng.randint(0, 255),
+                digits=_digits(rng, 1, 12),
+                word="".join(rng.choice(string.ascii_uppercase) for _ in range(rng.randint(1, 6)))
+            )
+        messages.append(message)
+    return messages
+
+
+def test_prefilter_is_disabled_by_an_entity_without_screen():
+    assert PIIPreFilter(list(ENTITY_SCREENS)).enabled
+    assert not PIIPreFilter(["US_SSN", "PERSON"]).enabled
+    assert PIIPreFilter(["US_SSN", "PERSON"]).might_contain_pii("Hello John")
+
+
+def test_prefilter_of_the_analyzed_entities():
+    pytest.importorskip("langchain_experimental")
+    from utils.anonymizer import analyzed_fields
+
+    prefilter = PIIPreFilter(analyzed_fields())
+    assert prefilter.enabled == all(field in ENTITY_SCREENS for field in analyzed_fields())
+
+
+@pytest.fixture(scope="module")
+def screened_anonymizer():
+    pytest.importorskip("presidio_analyzer")
+    pytest.importorskip("langchain_experimental")
+    spacy = pytest.importorskip("spacy")
+    if not spacy.util.is_package("en_core_web_md"):
+        pytest.skip("The spaCy model en_core_web_md is not installed")
+    from utils.anonymizer import LanguageAnonymizers
+
+    return LanguageAnonymizers(languages_config=ENGLISH_CONFIG, warm_up=["en"], fields=list(ENTITY_SCREENS))
+
+
+def test_prefilter_has_no_false_negatives(screened_anonymizer):
+    prefilter = PIIPreFilter(screened_anonymizer.fields)
+    messages = generate(random.Random(0), 500)
+
+    false_negatives = [
+        message for message in messages
+        if not prefilter.might_contain_pii(message) and screened_anonymizer.anonymize(message, "en") != message
+    ]
+    assert false_negatives == []
+    # The corpus exercises both sides of the screen
+    assert any(not prefilter.might_contain_pii(message) for message in messages)
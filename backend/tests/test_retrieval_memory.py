@@ -0,0 +1,65 @@
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from pymongo import errors
+
+from common.config import Config, Singleton
+from common.objects import Message, MessageTurn
+from memory.retrieval_memory import BaseRetrievalMongoChatbotMemory
+
+
+def list_embedding(texts):
+    """Custom embedding returning plain lists, like most remote embedding clients"""
+    return [[float(len(text)), 1.0, 0.0] for text in texts]
+
+
+def build_memory(embedding=None) -> BaseRetrievalMongoChatbotMemory:
+    # Memories are singletons, each test gets a new one
+    Singleton._instances.pop(BaseRetrievalMongoChatbotMemory, None)
+    return BaseRetrievalMongoChatbotMemory(
+        config=Config(),
+        session_id="session",
+        database_name="chatbot",
+        collection_name="history",
+        client=mongomock.MongoClient(),
+        embedding=embedding,
+        k=2
+    )
+
+
+def turn(conversation_id: str, human: str, ai: str) -> MessageTurn:
+    return MessageTurn(
+        human_message=Message(message=human, role="Human"),
+        ai_message=Message(message=ai, role="AI"),
+        conversation_id=conversation_id
+    )
+
+
+@pytest.mark.parametrize("embedding", [None, list_embedding])
+def test_first_request_of_empty_conversation(embedding):
+    memory = build_memory(embedding)
+
+    assert memory.load_history("new", query="hello") == ""
+    assert len(memory.get_index("new")) == 0
+    assert memory.get_index("new").dim == memory.embedding_dim
+
+    memory.add_message(turn("new", "hello", "hi"))
+    assert len(memory.get_index("new")) == 1
+
+
+def test_turn_whose_vector_was_not_stored_is_indexed_on_load(monkeypatch):
+    memory = build_memory()
+    memory.add_message(turn("c", "my dog is called Rex", "nice name"))
+
+    def fail(*args):
+        raise errors.PyMongoError("vector write failed")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(memory, "_push_vectors", fail)
+        memory.add_message(turn("c", "I live in Paris", "lovely"))
+    assert len(memory.get_index("c")) == 2
+
+    memory._indexes = memory._new_index_store()
+    assert len(memory.get_index("c")) == 2
+    assert len(memory.vectors.find_one({"ConversationId": "c"})["TurnIds"]) == 2
@@ -1 +1,12 @@
-from .serp import CustomSearchTool
+import importlib
+
+# Tools pull in their API clients, they are imported on first access
+_LAZY_ATTRIBUTES = {
+    "CustomSearchTool": ".serp"
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,3 +1,20 @@
+import importlib
+
 from .chain_cache import ChatbotCache
-from .anonymizer import BotAnonymizer
 from .chain_cache import CacheTypes
+from .llm_cache import BoundedLLMCache
+from .prompt_store import PromptStore
+from .admission import AdmissionController, AdmissionRejected
+
+# Attributes backed by optional heavy dependencies (Presidio, NumPy), imported on first access
+_LAZY_ATTRIBUTES = {
+    "BotAnonymizer": ".anonymizer",
+    "SemanticCache": ".semantic_cache",
+    "HashingEmbedding": ".embeddings"
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
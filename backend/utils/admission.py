@@ -0,0 +1,118 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+from common.metrics import REGISTRY, Histogram
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed because the wait queue is full or the wait timed out"""
+
+
+class AdmissionController:
+    """
+    Limits the number of requests processed at once.
+    Requests beyond `max_concurrency` wait in a bounded queue for at most `queue_timeout` seconds, and are
+    rejected immediately when the queue is full. Requests of the same conversation are processed one at a time,
+    in arrival order, while different conversations run in parallel.
+    """
+
+    def __init__(self, max_concurrency: int = 16, max_queue_size: int = 64, queue_timeout: float = 30):
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._conversation_locks: Dict[str, asyncio.Lock] = {}
+        self._conversation_refs: Dict[str, int] = {}
+        self._waiting = 0
+        self._in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_time = REGISTRY.register(Histogram("admission_wait_seconds", "Time spent waiting for admission"))
+        REGISTRY.gauge("admission_in_flight", "Requests holding a processing slot", function=lambda: self._in_flight)
+        REGISTRY.gauge("admission_queue_depth", "Requests waiting for a processing slot",
+                       function=lambda: self._waiting)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._waiting
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def stats(self) -> Dict:
+        return {
+            "queue_depth": self._waiting,
+            "in_flight": self._in_flight,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_time": self.wait_time.snapshot()
+        }
+
+    @asynccontextmanager
+    async def slot(self, conversation_id: Optional[str] = None) -> AsyncIterator[None]:
+        """
+        Wait for a processing slot, keeping it for the duration of the context
+        :param conversation_id: Requests with the same id are serialized
+        :raise AdmissionRejected: If the queue is full or the slot was not granted within `queue_timeout`
+        """
+        if self._in_flight + self._waiting >= self.max_concurrency + self.max_queue_size:
+            self.rejected += 1
+            raise AdmissionRejected(
+                f"Too many pending requests ({self._in_flight} running, {self._waiting} queued)")
+
+        start = time.monotonic()
+        lock = self._acquire_conversation_lock(conversation_id)
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._acquire(lock), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._release_conversation_lock(conversation_id)
+            self.rejected += 1
+            self.timed_out += 1
+            raise AdmissionRejected(f"Request was not admitted within {self.queue_timeout} seconds")
+        except BaseException:
+            self._release_conversation_lock(conversation_id)
+            raise
+        finally:
+            self._waiting -= 1
+        self.wait_time.observe(time.monotonic() - start)
+
+        self.admitted += 1
+        self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+            if lock is not None:
+                lock.release()
+            self._release_conversation_lock(conversation_id)
+
+    async def _acquire(self, lock: Optional[asyncio.Lock]):
+        if lock is not None:
+            await lock.acquire()
+        try:
+            await self._semaphore.acquire()
+        except BaseException:
+            if lock is not None:
+                lock.release()
+            raise
+
+    def _acquire_conversation_lock(self, conversation_id: Optional[str]) -> Optional[asyncio.Lock]:
+        if conversation_id is None:
+            return None
+        self._conversation_refs[conversation_id] = self._conversation_refs.get(conversation_id, 0) + 1
+        return self._conversation_locks.setdefault(conversation_id, asyncio.Lock())
+
+    def _release_conversation_lock(self, conversation_id: Optional[str]):
+        if conversation_id is None:
+            return
+        self._conversation_refs[conversation_id] -= 1
+        if not self._conversation_refs[conversation_id]:
+            del self._conversation_refs[conversation_id]
+            del self._conversation_locks[conversation_id]
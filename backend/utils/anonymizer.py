@@ -1,49 +1,401 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+
 import langdetect
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Iterable, List, Optional, Tuple
 from langchain_experimental.data_anonymizer import PresidioReversibleAnonymizer
+from langchain_experimental.data_anonymizer.deanonymizer_mapping import DeanonymizerMapping
+from langchain_experimental.data_anonymizer.deanonymizer_matching_strategies import exact_matching_strategy
+from langchain_experimental.data_anonymizer.faker_presidio_mapping import get_pseudoanonymizer_mapping
+from langchain_core.messages import BaseMessage
 from langchain_core.runnables import RunnableLambda
 
 from common.config import BaseObject, Config
 from common.constants import ANONYMIZED_FIELDS, NLP_CONFIG
+from common.conversation_store import ConversationStore
+from utils.pii_filter import PIIPreFilter
+from utils.process_pool import ShardedProcessPool, worker_resource
+
+logger = logging.getLogger(__name__)
+
+# Keywords starting the lines of the ReAct agent scratchpad
+SCRATCHPAD_LABELS = ("Thought", "Action", "Action Input", "Observation")
+
+
+@functools.lru_cache(maxsize=None)
+def analyzed_fields() -> Tuple[str, ...]:
+    """Entities analyzed: Presidio's defaults plus the custom `ANONYMIZED_FIELDS`"""
+    fields = list(get_pseudoanonymizer_mapping())
+    return tuple(fields + [field for field in ANONYMIZED_FIELDS if field not in fields])
+
+
+class LanguageAnonymizers:
+    """
+    Reversible anonymizer loading the NLP model of a language on its first use.
+    Each language gets its own Presidio anonymizer, at most `max_loaded` of them stay resident (least recently used
+    ones are dropped). Presidio anonymizers are not thread-safe, so each language serves one call at a time.
+    `anonymize_lines` returns the de-anonymizer mapping entries of the placeholders it produced, for the caller to
+    keep with the conversation they belong to.
+    """
+
+    def __init__(
+            self,
+            languages_config: Optional[Dict[str, Any]] = None,
+            max_loaded: Optional[int] = None,
+            warm_up: Iterable[str] = (),
+            fields: Optional[Iterable[str]] = None
+    ):
+        """
+        :param languages_config: Presidio NLP configuration listing the available models, defaults to NLP_CONFIG
+        :param max_loaded: Maximum number of language models kept in memory, unbounded if None
+        :param warm_up: Languages loaded right away instead of on first use
+        :param fields: Entities analyzed, defaults to `analyzed_fields()`
+        """
+        self.fields = list(fields) if fields is not None else list(analyzed_fields())
+        languages_config = languages_config if languages_config is not None else NLP_CONFIG
+        self._engine_name = languages_config["nlp_engine_name"]
+        self._models = {model["lang_code"]: model for model in languages_config["models"]}
+        self.default_language = "en" if "en" in self._models else next(iter(self._models))
+        self.max_loaded = max_loaded
+        self._loaded: "OrderedDict[str, PresidioReversibleAnonymizer]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {language: threading.Lock() for language in self._models}
+        self._call_locks = {language: threading.Lock() for language in self._models}
+        self.loads = 0
+        self.unloads = 0
+        for language in warm_up:
+            if language in self._models:
+                self.get(language)
+
+    @property
+    def languages(self) -> List[str]:
+        return list(self._models)
+
+    @property
+    def loaded_languages(self) -> List[str]:
+        with self._lock:
+            return list(self._loaded)
+
+    def get(self, language: str) -> PresidioReversibleAnonymizer:
+        if language not in self._models:
+            language = self.default_language
+        with self._lock:
+            anonymizer = self._loaded.get(language)
+            if anonymizer is not None:
+                self._loaded.move_to_end(language)
+                return anonymizer
+        # Loading a model takes seconds, don't hold up the languages that are already loaded
+        with self._load_locks[language]:
+            with self._lock:
+                anonymizer = self._loaded.get(language)
+            if anonymizer is None:
+                anonymizer = self._load(language)
+            with self._lock:
+                self._loaded[language] = anonymizer
+                self._loaded.move_to_end(language)
+                while self.max_loaded is not None and len(self._loaded) > self.max_loaded:
+                    self._loaded.popitem(last=False)
+                    self.unloads += 1
+            return anonymizer
+
+    def _load(self, language: str) -> PresidioReversibleAnonymizer:
+        logger.info(f"Loading the anonymizer model of language '{language}'")
+        anonymizer = PresidioReversibleAnonymizer(
+            analyzed_fields=list(self.fields),
+            languages_config={"nlp_engine_name": self._engine_name, "models": [self._models[language]]}
+        )
+        self.loads += 1
+        return anonymizer
+
+    def anonymize(self, text: str, language: str) -> str:
+        if language not in self._models:
+            language = self.default_language
+        anonymizer = self.get(language)
+        with self._call_locks[language]:
+            return anonymizer.anonymize(text, language=language)
+
+    def anonymize_lines(self, texts: List[str], language: str) -> Tuple[List[str], Dict[str, Dict[str, str]]]:
+        """
+        Anonymize several single-line texts with one analyzer call
+        :return: The anonymized texts and the de-anonymizer mapping entries of their placeholders
+        """
+        if language not in self._models:
+            language = self.default_language
+        anonymizer = self.get(language)
+        with self._call_locks[language]:
+            if len(texts) == 1:
+                anonymized = [anonymizer.anonymize(texts[0], language=language)]
+            else:
+                anonymized = anonymizer.anonymize("\n".join(texts), language=language).split("\n")
+                if len(anonymized) != len(texts):
+                    # A replacement changed the line structure, fall back to one call per line
+                    anonymized = [anonymizer.anonymize(text, language=language) for text in texts]
+            mapping = anonymizer.deanonymizer_mapping
+        return anonymized, placeholder_entries(mapping, "\n".join(anonymized))
+
+
+def placeholder_entries(mapping: Dict[str, Dict[str, str]], text: str) -> Dict[str, Dict[str, str]]:
+    """Return the entries of a de-anonymizer mapping whose placeholder appears in `text`"""
+    entries = {}
+    for entity_type, values in mapping.items():
+        used = {placeholder: value for placeholder, value in values.items() if placeholder in text}
+        if used:
+            entries[entity_type] = used
+    return entries
+
+
+def build_presidio_anonymizer(max_loaded: Optional[int] = None, warm_up: Iterable[str] = ()) -> LanguageAnonymizers:
+    return LanguageAnonymizers(languages_config=NLP_CONFIG, max_loaded=max_loaded, warm_up=warm_up)
+
+
+def _detect_in_worker(text: str) -> str:
+    return langdetect.detect(text)
+
+
+def _anonymize_in_worker(texts: List[str], language: str) -> Tuple[List[str], Dict[str, Dict[str, str]]]:
+    """Anonymize in a pool worker, return the texts and the mapping entries of their placeholders"""
+    return worker_resource().anonymize_lines(texts, language)
 
 
 class BotAnonymizer(BaseObject):
     """
     Anonymizer class to handle PII data in chat messages
-    Uses Presidio for anonymization and de-anonymization
+    Uses Presidio for anonymization and de-anonymization.
+    With `anonymizer_workers` set, language detection and anonymization run in a pool of worker processes, each
+    holding its own Presidio models, and this process only keeps the mappings needed to de-anonymize responses.
+    Each conversation has its own de-anonymizer mapping, so that a placeholder never restores another
+    conversation's entity, even when two workers produced the same one.
     """
     def __init__(self, config: Config = None):
         super(BotAnonymizer, self).__init__()
         self.config = config if config is not None else Config()
-        self._anonymizer = PresidioReversibleAnonymizer(languages_config=NLP_CONFIG)
-        # Custom entities to anonymize can be added here
-        self._anonymizer.add_recognizer_for_entities(ANONYMIZED_FIELDS)
+        self._pool = None
+        self._anonymizer = None
+        self._languages = [model["lang_code"] for model in NLP_CONFIG["models"]]
+        factory = functools.partial(
+            build_presidio_anonymizer,
+            max_loaded=self.config.anonymizer_max_languages,
+            warm_up=self.config.anonymizer_warm_up_languages
+        )
+        if self.config.anonymizer_workers:
+            self._pool = ShardedProcessPool(
+                num_workers=self.config.anonymizer_workers,
+                factory=factory,
+                max_pending=self.config.anonymizer_max_pending,
+                timeout=self.config.anonymizer_timeout
+            )
+        else:
+            self._anonymizer = factory()
+        # Per conversation, the lines of the last turn (content hash of a line -> its anonymized text)
+        # and the de-anonymizer mapping of every placeholder sent to the LLM
+        self._conversations = ConversationStore(
+            max_entries=self.config.memory_max_conversations,
+            ttl=self.config.memory_conversation_ttl
+        )
+        self.lines_reused = 0
+        self.lines_analyzed = 0
+        self.lines_skipped = 0
+        # Screens the entities actually analyzed, disabled when one of them has no screen
+        self.prefilter = PIIPreFilter(analyzed_fields())
+        # Role labels of history and scratchpad lines ("Human: ", "Action Input: "), kept out of the cache key
+        # so that a message anonymized as the input is reused once it shows up in the history. Only these known
+        # labels are split off, any other "Name: " prefix is anonymized with the rest of the line
+        labels = sorted({self.config.human_prefix, self.config.ai_prefix, *SCRATCHPAD_LABELS}, key=len, reverse=True)
+        self._line_label_pattern = re.compile(f"^((?:{'|'.join(map(re.escape, labels))}): )?(.*)$", re.DOTALL)
+        self.messages_skipped = 0
+        self.messages_analyzed = 0
 
     @property
     def anonymizer(self):
         return self._anonymizer
 
+    def deanonymizer_mapping(self, conversation_id: Optional[str] = None) -> Dict[str, Dict[str, str]]:
+        conversation = self._conversations.get(conversation_id)
+        return conversation[1].data if conversation is not None else {}
+
     @property
     def supported_lang(self):
-        return ["vi", "en"]
+        return self._languages
+
+    def _check_lang(self, language: str) -> str:
+        if language not in self.supported_lang:
+            self.logger.warning(
+                f"Detected language '{language}' is not supported in this Chatbot. "
+                f"Only {self.supported_lang} are supported. Defaulting to English.")
+            language = "en"
+        return language
+
+    def _needs_analysis(self, input_dict: Dict[str, Any]) -> bool:
+        """Pre-screen the request, False when no text can contain an entity to anonymize"""
+        if any(self.prefilter.might_contain_pii(text) for text in self._texts(input_dict).values()):
+            self.messages_analyzed += 1
+            return True
+        self.messages_skipped += 1
+        return False
 
     def _detect_lang(self, input_dict: Dict[str, Any]) -> Dict[str, Any]:
         """Detect the language of the input text"""
+        if not self._needs_analysis(input_dict):
+            # Without a language the anonymizer passes the texts through
+            return input_dict
         try:
-            language = langdetect.detect(input_dict["input"])
-            if language not in self.supported_lang:
-                self.logger.warning(
-                    f"Detected language '{language}' is not supported in this Chatbot. "
-                    f"Only {self.supported_lang} are supported. Defaulting to English.")
-                language = "en"
+            if self._pool is not None:
+                language = self._pool.call(input_dict.get("conversation_id"), _detect_in_worker, input_dict["input"])
+            else:
+                language = langdetect.detect(input_dict["input"])
+            language = self._check_lang(language)
         except Exception as e:
             self.logger.error(f"Error detecting language: {e}")
             language = "en"  # Default to English if detection fails
-            
+
         return {"language": language, **input_dict}
 
+    async def _adetect_lang(self, input_dict: Dict[str, Any]) -> Dict[str, Any]:
+        if not self._needs_analysis(input_dict):
+            return input_dict
+        try:
+            if self._pool is not None:
+                language = await self._pool.acall(input_dict.get("conversation_id"), _detect_in_worker,
+                                                  input_dict["input"])
+            else:
+                language = await asyncio.to_thread(langdetect.detect, input_dict["input"])
+            language = self._check_lang(language)
+        except Exception as e:
+            self.logger.error(f"Error detecting language: {e}")
+            language = "en"  # Default to English if detection fails
+
+        return {"language": language, **input_dict}
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "conversations": len(self._conversations),
+            "lines_reused": self.lines_reused,
+            "lines_analyzed": self.lines_analyzed,
+            "lines_skipped": self.lines_skipped,
+            "messages_skipped": self.messages_skipped,
+            "messages_analyzed": self.messages_analyzed
+        }
+        if self._pool is not None:
+            stats["pool"] = self._pool.stats()
+        else:
+            stats["loaded_languages"] = self._anonymizer.loaded_languages
+            stats["language_loads"] = self._anonymizer.loads
+            stats["language_unloads"] = self._anonymizer.unloads
+        return stats
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+
+    @staticmethod
+    def _line_key(language: str, text: str) -> str:
+        return hashlib.blake2b(f"{language}\x00{text}".encode("utf-8"), digest_size=16).hexdigest()
+
+    def _anonymize_texts(
+            self,
+            texts: List[str],
+            language: str,
+            conversation_id: Optional[str] = None
+    ) -> Tuple[List[str], Dict[str, Dict[str, str]]]:
+        if self._pool is None:
+            return self._anonymizer.anonymize_lines(texts, language)
+        return self._pool.call(conversation_id, _anonymize_in_worker, texts, language)
+
+    async def _aanonymize_texts(
+            self,
+            texts: List[str],
+            language: str,
+            conversation_id: Optional[str] = None
+    ) -> Tuple[List[str], Dict[str, Dict[str, str]]]:
+        if self._pool is None:
+            return await asyncio.to_thread(self._anonymizer.anonymize_lines, texts, language)
+        return await self._pool.acall(conversation_id, _anonymize_in_worker, texts, language)
+
+    def _split_texts(
+            self,
+            texts: Dict[str, str],
+            language: str,
+            cached: Dict[str, str]
+    ) -> Tuple[Dict[str, List[Tuple[Optional[str], str]]], Dict[str, str], Dict[str, str]]:
+        """
+        Split texts into labelled lines and look them up in `cached`, the user's input is never labelled.
+        Return the split texts, the cache entries of the known lines and the lines still to be anonymized.
+        """
+        split_texts = {
+            name: [(None, line) if name == "input" else self._line_label_pattern.match(line).groups()
+                   for line in text.split("\n")]
+            for name, text in texts.items()
+        }
+        used = {}
+        missing = {}
+        for lines in split_texts.values():
+            for _, body in lines:
+                key = self._line_key(language, body)
+                if key in used or key in missing:
+                    continue
+                if not body.strip():
+                    used[key] = body
+                elif not self.prefilter.might_contain_pii(body):
+                    used[key] = body
+                    self.lines_skipped += 1
+                elif key in cached:
+                    used[key] = cached[key]
+                    self.lines_reused += 1
+                else:
+                    missing[key] = body
+        self.lines_analyzed += len(missing)
+        return split_texts, used, missing
+
+    def _join_texts(
+            self,
+            split_texts: Dict[str, List[Tuple[Optional[str], str]]],
+            language: str,
+            used: Dict[str, str]
+    ) -> Dict[str, str]:
+        return {
+            name: "\n".join(f"{label or ''}{used[self._line_key(language, body)]}" for label, body in lines)
+            for name, lines in split_texts.items()
+        }
+
+    @staticmethod
+    def _texts(input_dict: Dict[str, Any]) -> Dict[str, str]:
+        texts = {
+            "input": input_dict["input"],
+            "history": input_dict.get("history", ""),
+            "agent_scratchpad": input_dict.get("agent_scratchpad", "")
+        }
+        return {name: text for name, text in texts.items() if text}
+
+    def _conversation(self, conversation_id: Optional[str]) -> Tuple[Dict[str, str], DeanonymizerMapping]:
+        """Return the cached lines and the de-anonymizer mapping of a conversation"""
+        return self._conversations.get_or_create(conversation_id, lambda: ({}, DeanonymizerMapping()))
+
+    def _output(
+            self,
+            anonymized: Dict[str, str],
+            conversation_id: Optional[str],
+            used: Dict[str, str],
+            mapping: DeanonymizerMapping
+    ):
+        # Lines are only reused within an identified conversation
+        self._conversations.set(conversation_id, (used if conversation_id is not None else {}, mapping))
+        return {
+            "input": anonymized.get("input", ""),
+            "history": anonymized.get("history", ""),
+            "agent_scratchpad": anonymized.get("agent_scratchpad", "")
+        }
+
     def anonymize_func(self, input_dict: Dict[str, Any]) -> Dict[str, Any]:
-        """Anonymize the input text and conversation history"""
+        """
+        Anonymize the input text, conversation history and agent scratchpad.
+        Lines already anonymized in the previous turn of the conversation are reused rather than analyzed again,
+        the reversible anonymizer keeps the entity mapping consistent for the new ones.
+        """
         language = input_dict.get("language")
         if not language:
             return {
@@ -51,28 +403,46 @@ class BotAnonymizer(BaseObject):
                 "history": input_dict.get("history", ""),
                 "agent_scratchpad": input_dict.get("agent_scratchpad", "")
             }
-            
-        # Anonymize user input
-        anonymized_input = self.anonymizer.anonymize(input_dict["input"], language)
-        
-        # Anonymize conversation history if available
-        history = input_dict.get("history", "")
-        anonymized_history = ""
-        if history:
-            anonymized_history = self.anonymizer.anonymize(history, language)
-            
-        # Anonymize agent scratchpad if available
-        agent_scratchpad = input_dict.get("agent_scratchpad", "")
-        anonymized_scratchpad = ""
-        if agent_scratchpad:
-            anonymized_scratchpad = self.anonymizer.anonymize(agent_scratchpad, language)
-            
-        return {
-            "input": anonymized_input,
-            "history": anonymized_history,
-            "agent_scratchpad": anonymized_scratchpad
-        }
+
+        conversation_id = input_dict.get("conversation_id")
+        cached, mapping = self._conversation(conversation_id)
+        split_texts, used, missing = self._split_texts(self._texts(input_dict), language, cached)
+        if missing:
+            anonymized, entries = self._anonymize_texts(list(missing.values()), language, conversation_id)
+            used.update(zip(missing, anonymized))
+            mapping.update(entries)
+        return self._output(self._join_texts(split_texts, language, used), conversation_id, used, mapping)
+
+    async def aanonymize_func(self, input_dict: Dict[str, Any]) -> Dict[str, Any]:
+        language = input_dict.get("language")
+        if not language:
+            return self.anonymize_func(input_dict)
+
+        conversation_id = input_dict.get("conversation_id")
+        cached, mapping = self._conversation(conversation_id)
+        split_texts, used, missing = self._split_texts(self._texts(input_dict), language, cached)
+        if missing:
+            anonymized, entries = await self._aanonymize_texts(list(missing.values()), language, conversation_id)
+            used.update(zip(missing, anonymized))
+            mapping.update(entries)
+        return self._output(self._join_texts(split_texts, language, used), conversation_id, used, mapping)
+
+    def deanonymize(self, output: Any, conversation_id: Optional[str] = None) -> Any:
+        """Restore the original entities of a conversation in a response, given as a string or a message"""
+        if isinstance(output, BaseMessage):
+            return output.copy(update={"content": self.deanonymize(output.content, conversation_id)})
+        if not isinstance(output, str):
+            return output
+        mapping = self.deanonymizer_mapping(conversation_id)
+        if not mapping:
+            return output
+        return exact_matching_strategy(output, mapping)
 
     def get_runnable_anonymizer(self):
         """Create a runnable chain for the anonymizer"""
-        return RunnableLambda(self._detect_lang) | RunnableLambda(self.anonymize_func)
+        return (RunnableLambda(self._detect_lang, afunc=self._adetect_lang)
+                | RunnableLambda(self.anonymize_func, afunc=self.aanonymize_func))
+
+    def get_runnable_deanonymizer(self):
+        """Create a runnable de-anonymizing the `output` of a dict input with the mapping of its `conversation_id`"""
+        return RunnableLambda(lambda inputs: self.deanonymize(inputs["output"], inputs.get("conversation_id")))
@@ -1,41 +1,64 @@
 from enum import Enum
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
+import hashlib
 
-from langchain.cache import InMemoryCache
-from langchain.cache import GPTCache
 from langchain.globals import set_llm_cache
-import hashlib
-from gptcache import Cache
-from gptcache.adapter.api import init_similar_cache
 
-from common.config import BaseObject
+from common.config import BaseObject, Config
+from common.lazy import LazyMapping
+from utils.llm_cache import BoundedLLMCache
+
+if TYPE_CHECKING:
+    import gptcache
 
-CACHE_TYPE = {
-    "in_memory": InMemoryCache,
-    "GPTCache": GPTCache
-}
+# gptcache and numpy are only imported once their cache type is used
+CACHE_TYPE = LazyMapping({
+    "in_memory": "langchain.cache:InMemoryCache",
+    "GPTCache": "langchain.cache:GPTCache"
+})
 
 
 class CacheTypes(str, Enum):
     in_memory = "in_memory"
     GPTCache = "GPTCache"
+    semantic = "semantic"
+    bounded = "bounded"
 
 
 def get_hashed_name(name):
     return hashlib.sha256(name.encode()).hexdigest()
 
 
-def init_gptcache(cache_obj: Cache, llm: str):
+def init_gptcache(cache_obj: "gptcache.Cache", llm: str):
+    from gptcache.adapter.api import init_similar_cache
+
     hashed_llm = get_hashed_name(llm)
     init_similar_cache(cache_obj=cache_obj, data_dir=f"similar_cache_{hashed_llm}")
 
 
 class ChatbotCache(BaseObject):
     @classmethod
-    def create(cls, cache_type: Optional[CacheTypes] = None):
+    def create(cls, cache_type: Optional[CacheTypes] = None, config: Optional[Config] = None):
         param = {}
         if cache_type is None:
-            cache_type = CacheTypes.in_memory
+            cache_type = CacheTypes.bounded
+        config = config if config is not None else Config()
+        if cache_type == CacheTypes.bounded:
+            # Scoped to the model it is passed to, see ChainManager, rather than installed globally
+            return BoundedLLMCache(
+                max_entries=config.llm_cache_max_entries,
+                max_bytes=config.llm_cache_max_bytes,
+                ttl=config.llm_cache_ttl
+            )
+        if cache_type == CacheTypes.semantic:
+            # Not an LLM cache: it is put in front of the chain, see ChainManager
+            from utils.semantic_cache import SemanticCache
+
+            return SemanticCache(
+                data_dir=config.semantic_cache_dir,
+                similarity_threshold=config.semantic_cache_threshold,
+                max_entries=config.semantic_cache_max_entries
+            )
         cache = CACHE_TYPE[cache_type]
         if cache_type == "GPTCache":
             param = {"init_func": init_gptcache}
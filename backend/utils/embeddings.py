@@ -0,0 +1,60 @@
+import re
+import zlib
+from typing import Callable, List, Sequence, Union
+
+import numpy as np
+
+EmbeddingFunction = Callable[[List[str]], Union[np.ndarray, Sequence[Sequence[float]]]]
+
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbedding:
+    """
+    Local, dependency-free text embedding based on the hashing trick.
+    Words and character trigrams are hashed into a fixed number of signed buckets and the result is L2-normalized,
+    so that cosine similarity is a plain dot product. It captures lexical overlap only, which is enough to match
+    rephrasings of the same question; plug in a neural embedding function for semantic matching.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def _features(self, text: str) -> List[str]:
+        words = _WORD_PATTERN.findall(text.lower())
+        features = list(words)
+        for word in words:
+            padded = f"#{word}#"
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in self._features(text):
+            hashed = zlib.crc32(feature.encode("utf-8"))
+            vector[hashed % self.dim] += 1.0 if hashed & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        return np.stack([self.embed(text) for text in texts]) if texts else np.zeros((0, self.dim), np.float32)
+
+
+def as_embedding_function(embedding) -> EmbeddingFunction:
+    """Accept either a callable on a list of texts or a LangChain `Embeddings` object"""
+    if hasattr(embedding, "embed_documents"):
+        return embedding.embed_documents
+    return embedding
+
+
+def embed_texts(embedding_function: EmbeddingFunction, texts: List[str], dim: int = 0) -> np.ndarray:
+    """
+    Embed texts into L2-normalized float32 rows
+    :param dim: Number of columns returned for an empty list of texts, which is not passed to the embedding
+    """
+    if not texts:
+        return np.zeros((0, dim), dtype=np.float32)
+    vectors = np.asarray(embedding_function(texts), dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
@@ -0,0 +1,85 @@
+import hashlib
+import re
+from typing import Any, Dict, Optional
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+
+from common.conversation_store import ConversationStore
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# Rough per-entry bookkeeping cost: key, list, generation objects
+ENTRY_OVERHEAD_BYTES = 256
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace so prompts differing only in formatting share a cache entry"""
+    return _WHITESPACE_PATTERN.sub(" ", prompt).strip()
+
+
+class BoundedLLMCache(BaseCache):
+    """
+    Exact-match LLM cache bounded in entries and bytes.
+    Entries are keyed on the normalized prompt and the LLM parameters, the least recently used ones are evicted
+    once `max_entries` or `max_bytes` is exceeded and every entry expires `ttl` seconds after it was written.
+    Pass it to a model through its `cache` parameter to keep it private to that model.
+    """
+
+    def __init__(
+            self,
+            max_entries: Optional[int] = 1000,
+            max_bytes: Optional[int] = None,
+            ttl: Optional[float] = None
+    ):
+        """
+        :param max_entries: Maximum number of cached generations, unbounded if None
+        :param max_bytes: Maximum approximate size of the cached generations, unbounded if None
+        :param ttl: Lifetime of an entry in seconds, never expires if None
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # Shares its eviction with the conversation memories, except that reads do not extend an entry's lifetime
+        self._entries = ConversationStore(
+            max_entries=max_entries,
+            max_bytes=max_bytes,
+            ttl=ttl,
+            size_func=self._size,
+            refresh_on_access=False
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\x00{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _size(return_val: RETURN_VAL_TYPE) -> int:
+        return ENTRY_OVERHEAD_BYTES + sum(len(generation.text.encode("utf-8")) for generation in return_val)
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        return self._entries.get(self._key(prompt, llm_string))
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        self._entries.set(self._key(prompt, llm_string), return_val)
+
+    def clear(self, **kwargs: Any) -> None:
+        self._entries.clear()
+
+    # The cache never blocks, skip the executor hop of the default async implementations
+    async def alookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        return self.lookup(prompt, llm_string)
+
+    async def aupdate(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        self.update(prompt, llm_string, return_val)
+
+    async def aclear(self, **kwargs: Any) -> None:
+        self.clear(**kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._entries.stats()
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,41 @@
+import re
+from typing import Dict, Iterable, Optional
+
+# Shortest fragment every Presidio pattern of an entity contains. Presidio matches digits as [0-9], so
+# screening with \d (any Unicode digit) can only let more text through, never less.
+ENTITY_SCREENS: Dict[str, str] = {
+    # ###-##-####, #####-####, ###-######, 9 digits
+    "US_SSN": r"\d{3}",
+    # 9##-##-####
+    "US_ITIN": r"\d{3}",
+    # 8 to 17 digits
+    "US_BANK_NUMBER": r"\d{8}",
+    # 9 digits, or a letter and 8 digits
+    "US_PASSPORT": r"\d{8}",
+    # Mostly letters and digits, down to a single digit; the Washington format may use '*' instead
+    "US_DRIVER_LICENSE": r"[\d*]",
+    "EMAIL_ADDRESS": r"@",
+    "CREDIT_CARD": r"\d{4}",
+    "PHONE_NUMBER": r"\d{3}",
+    "IP_ADDRESS": r"\d|:",
+}
+
+
+class PIIPreFilter:
+    """
+    Cheap screen run before Presidio: a text with none of the fragments required by the patterns of the
+    analyzed entities cannot contain any of them, and is not worth analyzing.
+    Entities without a known screen, such as names found by the NLP model, disable the filter.
+    """
+
+    def __init__(self, entities: Iterable[str], screens: Optional[Dict[str, str]] = None):
+        screens = screens if screens is not None else ENTITY_SCREENS
+        entities = list(entities)
+        self.enabled = bool(entities) and all(entity in screens for entity in entities)
+        self._pattern = re.compile("|".join(sorted({screens[entity] for entity in entities}))) if self.enabled \
+            else None
+
+    def might_contain_pii(self, text: str) -> bool:
+        if not self.enabled:
+            return True
+        return self._pattern.search(text) is not None
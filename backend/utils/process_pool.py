@@ -0,0 +1,127 @@
+import asyncio
+import threading
+import zlib
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from utils.admission import AdmissionRejected
+
+# Built once per worker process by the pool's factory, e.g. an anonymizer with its NLP models loaded
+_worker_resource = None
+
+
+def _init_worker(factory: Callable[[], Any]):
+    global _worker_resource
+    _worker_resource = factory()
+
+
+def _warm_up():
+    return True
+
+
+def worker_resource() -> Any:
+    """Return the resource built for the current worker process"""
+    return _worker_resource
+
+
+class ShardedProcessPool:
+    """
+    Runs CPU-bound calls in worker processes, off the GIL of the serving process.
+    Each worker is its own single-process executor and calls are routed by key, so that the calls of one
+    conversation always reach the same worker, in order, while different conversations spread over all of them.
+    Every worker builds its resource with `factory` once, when the pool starts. At most `max_pending` calls
+    are queued or running, further calls are rejected, and callers wait at most `timeout` seconds for a result.
+    """
+
+    def __init__(
+            self,
+            num_workers: int,
+            factory: Callable[[], Any],
+            max_pending: int = 64,
+            timeout: Optional[float] = 10.0
+    ):
+        """
+        :param num_workers: Number of worker processes
+        :param factory: Picklable function building the per-worker resource, see `worker_resource`
+        :param max_pending: Maximum number of calls queued or running across all workers
+        :param timeout: Seconds a caller waits for a result, unbounded if None
+        """
+        self.num_workers = num_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executors = [
+            ProcessPoolExecutor(max_workers=1, initializer=_init_worker, initargs=(factory,))
+            for _ in range(num_workers)
+        ]
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        # Start the processes now so that the first requests don't pay for loading the resource
+        for executor in self._executors:
+            executor.submit(_warm_up)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "workers": self.num_workers,
+                "pending": self._pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out
+            }
+
+    def submit(self, key: Optional[Hashable], fn: Callable, *args) -> Future:
+        """Submit `fn(*args)` to the worker owning `key`, raise AdmissionRejected when the pool is saturated"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise AdmissionRejected(f"Worker pool is saturated ({self.max_pending} calls pending)")
+        shard = zlib.crc32(str(key).encode("utf-8")) % self.num_workers
+        with self._lock:
+            self._pending += 1
+        try:
+            future = self._executors[shard].submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        # The slot is held until the worker is done, even if the caller stopped waiting
+        future.add_done_callback(self._done)
+        return future
+
+    def call(self, key: Optional[Hashable], fn: Callable, *args) -> Any:
+        future = self.submit(key, fn, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            self._timed_out(future)
+            raise
+
+    async def acall(self, key: Optional[Hashable], fn: Callable, *args) -> Any:
+        future = self.submit(key, fn, *args)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self._timed_out(future)
+            raise
+
+    def close(self, wait: bool = True):
+        for executor in self._executors:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _timed_out(self, future: Future):
+        future.cancel()
+        with self._lock:
+            self.timed_out += 1
+
+    def _done(self, _future: Future):
+        with self._lock:
+            self.completed += 1
+        self._release()
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
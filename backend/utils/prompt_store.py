@@ -0,0 +1,133 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from langchain_core.load import dumpd, load
+from langchain_core.prompts import BasePromptTemplate
+
+logger = logging.getLogger(__name__)
+
+# "owner/name" or "owner/name:commit", as accepted by the LangChain hub
+HUB_HANDLE_PATTERN = re.compile(r"^[\w.-]+/[\w.-]+(:[\w.-]+)?$")
+
+
+def is_hub_handle(template: str) -> bool:
+    return bool(HUB_HANDLE_PATTERN.match(template))
+
+
+def hub_pull(handle: str) -> BasePromptTemplate:
+    # Imported lazily so that starting from a snapshot never loads the hub client
+    from langchain import hub
+    return hub.pull(handle)
+
+
+def content_hash(serialized: dict) -> str:
+    return hashlib.sha256(json.dumps(serialized, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class PromptStore:
+    """
+    On-disk snapshots of hub prompts, so that startup never depends on the network.
+    Each prompt is stored as its LangChain serialization together with a content hash, which is checked on read
+    and used to skip rewriting unchanged prompts. Snapshots are either vendored at build time
+    (`python -m utils.vendor_prompts`) or written on the first successful pull, and can be kept fresh by a
+    background thread.
+    """
+
+    def __init__(self, directory: str, pull: Callable[[str], BasePromptTemplate] = hub_pull):
+        """
+        :param directory: Directory holding one JSON snapshot per prompt
+        :param pull: Function fetching a prompt from the hub by its handle
+        """
+        self.directory = directory
+        self.pull = pull
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._stop_refresh = threading.Event()
+
+    def path(self, handle: str) -> str:
+        return os.path.join(self.directory, f"{handle.replace('/', '__').replace(':', '@')}.json")
+
+    def load(self, handle: str) -> Optional[BasePromptTemplate]:
+        """Read the snapshot of a prompt, None if it is missing or corrupted"""
+        path = self.path(handle)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            if content_hash(snapshot["prompt"]) != snapshot["sha256"]:
+                raise ValueError("content hash mismatch")
+            return load(snapshot["prompt"])
+        except Exception as e:
+            logger.warning(f"Ignoring corrupted prompt snapshot {path}: {e}")
+            return None
+
+    def save(self, handle: str, prompt: BasePromptTemplate) -> bool:
+        """Write the snapshot of a prompt, return whether its content changed"""
+        serialized = dumpd(prompt)
+        digest = content_hash(serialized)
+        path = self.path(handle)
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    if json.load(f).get("sha256") == digest:
+                        return False
+            except (OSError, ValueError):
+                pass
+        os.makedirs(self.directory, exist_ok=True)
+        snapshot = {"handle": handle, "sha256": digest, "fetched_at": time.time(), "prompt": serialized}
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False, indent=2)
+        os.replace(f"{path}.tmp", path)
+        return True
+
+    def refresh(self, handle: str) -> BasePromptTemplate:
+        """Pull a prompt from the hub and update its snapshot"""
+        prompt = self.pull(handle)
+        if self.save(handle, prompt):
+            logger.info(f"Updated prompt snapshot of {handle}")
+        return prompt
+
+    def get(self, handle: str) -> BasePromptTemplate:
+        """Return the snapshot of a prompt, pulling it from the hub only when there is none"""
+        prompt = self.load(handle)
+        if prompt is not None:
+            return prompt
+        logger.warning(f"No snapshot of prompt {handle} in {self.directory}, pulling it from the hub")
+        try:
+            return self.refresh(handle)
+        except Exception as e:
+            raise RuntimeError(
+                f"Could not load prompt {handle}: no snapshot in {self.directory} and the hub pull failed ({e}). "
+                f"Vendor it with `python -m utils.vendor_prompts {handle}`."
+            ) from e
+
+    def start_refresh(self, handles: Iterable[str], interval: float):
+        """
+        Refresh the snapshots of `handles` every `interval` seconds in a daemon thread.
+        Updated snapshots are picked up on the next startup, running chains keep the prompt they were built with.
+        """
+        if self._refresh_thread is not None:
+            return
+        handles = list(handles)
+        self._stop_refresh = stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                for handle in handles:
+                    try:
+                        self.refresh(handle)
+                    except Exception as e:
+                        logger.warning(f"Failed to refresh prompt {handle}: {e}")
+
+        self._refresh_thread = threading.Thread(target=run, name="prompt-refresh", daemon=True)
+        self._refresh_thread.start()
+
+    def stop_refresh(self):
+        self._stop_refresh.set()
+        self._refresh_thread = None
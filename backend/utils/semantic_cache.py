@@ -0,0 +1,253 @@
+import asyncio
+import atexit
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Hashable, Iterable, List, Optional
+
+import numpy as np
+from langchain_core.load import dumpd, load
+from langchain_core.runnables import RunnableLambda
+
+from common.conversation_store import ConversationStore
+from utils.embeddings import EmbeddingFunction, HashingEmbedding, as_embedding_function, embed_texts
+
+logger = logging.getLogger(__name__)
+
+VECTORS_FILE = "vectors.npy"
+ENTRIES_FILE = "entries.json"
+
+
+class SemanticCache:
+    """
+    Response cache matching inputs by embedding similarity.
+    Entries are grouped by namespace, a hash of everything that must match exactly (prompt template, model,
+    recent history window); inside a namespace the cached response of the most similar input is reused when
+    the cosine similarity reaches `similarity_threshold`. Embeddings live in a NumPy matrix, memory-mapped from
+    `data_dir` when given, one row per slot. Occupied slots are kept in a `ConversationStore`, which evicts the
+    least recently used one once `max_entries` is exceeded.
+    """
+
+    def __init__(
+            self,
+            data_dir: Optional[str] = None,
+            embedding: Optional[EmbeddingFunction] = None,
+            similarity_threshold: float = 0.92,
+            max_entries: int = 10000,
+            save_every: int = 32
+    ):
+        """
+        :param data_dir: Directory persisting the cache, kept in memory only if None
+        :param embedding: Callable embedding a list of texts, or a LangChain `Embeddings`.
+            Defaults to the local `HashingEmbedding`
+        :param similarity_threshold: Minimum cosine similarity for a cache hit
+        :param max_entries: Maximum number of cached responses
+        :param save_every: Number of updates between two saves of the entry metadata
+        """
+        self.embedding_function = as_embedding_function(embedding or HashingEmbedding())
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.save_every = save_every
+        self.data_dir = data_dir
+        self.dim = embed_texts(self.embedding_function, ["dimension probe"]).shape[1]
+
+        self._lock = threading.RLock()
+        self._slots_by_namespace: Dict[str, List[int]] = {}
+        # Slot -> (namespace, serialized value), the one spare row receives a new entry before the eviction
+        self._entries = ConversationStore(max_entries=max_entries, on_evict=self._release)
+        self._free = list(range(max_entries, -1, -1))
+        self._unsaved = 0
+        self.hits = 0
+        self.misses = 0
+        self._vectors = self._open_vectors()
+        self._load_entries()
+        if data_dir:
+            atexit.register(self.save)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self._entries.evictions
+            }
+
+    @staticmethod
+    def namespace(*parts: Any) -> str:
+        """Hash the parts of a cache key that must match exactly"""
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def embed(self, text: str) -> np.ndarray:
+        """Embed a text, to pass the vector to both `lookup` and `update`"""
+        return embed_texts(self.embedding_function, [text])[0]
+
+    def lookup(self, namespace: str, text: str, vector: Optional[np.ndarray] = None) -> Optional[Any]:
+        """
+        :param vector: Embedding of `text` if already computed
+        """
+        # Embedding can be slow, e.g. with a remote model, and must not hold up other requests
+        query = self.embed(text) if vector is None else vector
+        with self._lock:
+            slots = self._slots_by_namespace.get(namespace)
+            if not slots:
+                self.misses += 1
+                return None
+            similarities = self._vectors[slots] @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            _, value = self._entries.get(slots[best])
+            return self._deserialize(value)
+
+    def update(self, namespace: str, text: str, value: Any, vector: Optional[np.ndarray] = None):
+        """
+        :param vector: Embedding of `text` if already computed
+        """
+        if vector is None:
+            vector = self.embed(text)
+        with self._lock:
+            slot = self._find_duplicate(namespace, vector)
+            if slot is None:
+                slot = self._free.pop()
+                self._slots_by_namespace.setdefault(namespace, []).append(slot)
+            self._vectors[slot] = vector
+            # Evicts the least recently used slot when full, see `_release`
+            self._entries.set(slot, (namespace, self._serialize(value)))
+            self._unsaved += 1
+            if self.data_dir and self._unsaved >= self.save_every:
+                self.save()
+
+    def clear(self):
+        with self._lock:
+            self._slots_by_namespace = {}
+            self._entries.clear()
+            self._free = list(range(self.max_entries, -1, -1))
+            self.save()
+
+    def wrap(self, runnable, namespace_keys: Iterable[str], scope: Any = None, input_key: str = "input"):
+        """
+        Put the cache in front of a runnable taking a dict input
+        :param runnable: Runnable to cache, e.g. prompt | model
+        :param namespace_keys: Input keys that must match exactly, e.g. the history window
+        :param scope: Anything else identifying the runnable, e.g. the prompt template and model parameters
+        :param input_key: Input key matched by similarity
+        """
+        namespace_keys = sorted(key for key in namespace_keys if key != input_key)
+
+        def get_namespace(inputs: dict) -> str:
+            return self.namespace(scope, [inputs.get(key) for key in namespace_keys])
+
+        def invoke(inputs: dict, config=None):
+            namespace = get_namespace(inputs)
+            vector = self.embed(inputs[input_key])
+            cached = self.lookup(namespace, inputs[input_key], vector)
+            if cached is not None:
+                return cached
+            output = runnable.invoke(inputs, config)
+            self.update(namespace, inputs[input_key], output, vector)
+            return output
+
+        async def ainvoke(inputs: dict, config=None):
+            namespace = get_namespace(inputs)
+            # Off the event loop, so that a slow embedding does not stall the other requests
+            vector = await asyncio.to_thread(self.embed, inputs[input_key])
+            cached = self.lookup(namespace, inputs[input_key], vector)
+            if cached is not None:
+                return cached
+            output = await runnable.ainvoke(inputs, config)
+            self.update(namespace, inputs[input_key], output, vector)
+            return output
+
+        return RunnableLambda(invoke, afunc=ainvoke).with_config(run_name="SemanticCache")
+
+    def save(self):
+        if not self.data_dir:
+            return
+        with self._lock:
+            self._vectors.flush()
+            entries = {
+                "dim": self.dim,
+                "slots": [
+                    {"slot": slot, "namespace": namespace, "value": value}
+                    for slot, (namespace, value) in self._entries.items()
+                ]
+            }
+            path = os.path.join(self.data_dir, ENTRIES_FILE)
+            with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(f"{path}.tmp", path)
+            self._unsaved = 0
+
+    def _find_duplicate(self, namespace: str, vector: np.ndarray) -> Optional[int]:
+        slots = self._slots_by_namespace.get(namespace)
+        if not slots:
+            return None
+        similarities = self._vectors[slots] @ vector
+        best = int(np.argmax(similarities))
+        return slots[best] if similarities[best] >= 0.999 else None
+
+    def _release(self, slot: Hashable, entry: tuple):
+        namespace, _ = entry
+        slots = self._slots_by_namespace[namespace]
+        slots.remove(slot)
+        if not slots:
+            del self._slots_by_namespace[namespace]
+        self._free.append(slot)
+
+    def _open_vectors(self) -> np.ndarray:
+        shape = (self.max_entries + 1, self.dim)
+        if not self.data_dir:
+            return np.zeros(shape, dtype=np.float32)
+        os.makedirs(self.data_dir, exist_ok=True)
+        path = os.path.join(self.data_dir, VECTORS_FILE)
+        if os.path.exists(path):
+            vectors = np.lib.format.open_memmap(path, mode="r+")
+            if vectors.shape == shape and vectors.dtype == np.float32:
+                return vectors
+            logger.warning(f"Discarding semantic cache at {self.data_dir}: shape {vectors.shape} != {shape}")
+            del vectors
+        return np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=shape)
+
+    def _load_entries(self):
+        if not self.data_dir:
+            return
+        path = os.path.join(self.data_dir, ENTRIES_FILE)
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read semantic cache entries from {path}: {e}")
+            return
+        if entries.get("dim") != self.dim:
+            return
+        # Saved from least to most recently used, which `set` restores
+        for entry in entries["slots"]:
+            slot = entry["slot"]
+            if slot > self.max_entries:
+                continue
+            self._slots_by_namespace.setdefault(entry["namespace"], []).append(slot)
+            self._entries.set(slot, (entry["namespace"], entry["value"]))
+        occupied = {slot for slot, _ in self._entries.items()}
+        self._free = [slot for slot in range(self.max_entries, -1, -1) if slot not in occupied]
+
+    @staticmethod
+    def _serialize(value: Any) -> dict:
+        if isinstance(value, str):
+            return {"type": "text", "value": value}
+        return {"type": "lc", "value": dumpd(value)}
+
+    @staticmethod
+    def _deserialize(value: dict) -> Any:
+        if value["type"] == "text":
+            return value["value"]
+        return load(value["value"])
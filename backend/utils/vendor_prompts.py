@@ -0,0 +1,49 @@
+"""
+Snapshot hub prompts into the prompt directory, so that the service starts without network access.
+Run it at build time and ship the resulting files with the image.
+
+Usage (from the backend directory):
+    python -m utils.vendor_prompts                       # every prompt referenced in common.constants
+    python -m utils.vendor_prompts owner/prompt-name     # specific prompts
+"""
+import argparse
+import logging
+import os
+import sys
+
+from common import constants
+from common.common_keys import PROMPT_SNAPSHOT_DIR
+from common.config import DEFAULT_PROMPT_SNAPSHOT_DIR
+from utils.prompt_store import PromptStore, is_hub_handle
+
+logger = logging.getLogger(__name__)
+
+
+def default_handles():
+    return sorted({
+        value for name, value in vars(constants).items()
+        if "PROMPT" in name and isinstance(value, str) and is_hub_handle(value)
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("handles", nargs="*", help="Hub handles to vendor, defaults to the ones in common.constants")
+    parser.add_argument("--directory", default=os.getenv(PROMPT_SNAPSHOT_DIR, DEFAULT_PROMPT_SNAPSHOT_DIR))
+    args = parser.parse_args()
+
+    store = PromptStore(args.directory)
+    failed = 0
+    for handle in args.handles or default_handles():
+        try:
+            store.refresh(handle)
+            logger.info(f"Vendored {handle} into {store.path(handle)}")
+        except Exception as e:
+            failed += 1
+            logger.error(f"Failed to vendor {handle}: {e}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()